@@ -0,0 +1,219 @@
+"""
+Exact expected value of cascades under the payment model of TestEnvironment.play_cascade.
+
+A step of a cascade succeeds with probability primary_proba[arm] - primary_proba[previous arm]
+(never if it is not positive), the next step is tried only after a failure. After a success
+int(gamma(1, 2)) repeated payments are made at the same arm.
+"""
+
+import math
+
+import numpy as np
+
+# mean number of repeated payments: E int(X) = sum of P(X >= k) = 1 / (e^(1/2) - 1) for exponential X with mean 2
+REPEATED_MEAN = 1 / math.expm1(0.5)
+
+
+def step_success(primary_proba, arms):
+    """ Probability that a cascade payment succeeds exactly at each step.
+
+    :param primary_proba: success probability of each arm
+    :param arms: n x depth arms of cascades padded with -1
+    :return: n x depth probabilities
+    """
+    arms = np.asarray(arms, dtype=np.int64)
+    valid = arms >= 0
+
+    step_proba = np.where(valid, np.asarray(primary_proba, dtype=float)[arms], 0.)
+    previous_proba = np.zeros_like(step_proba)
+    previous_proba[:, 1:] = step_proba[:, :-1]
+    chance = np.where(valid, np.clip(step_proba - previous_proba, 0., 1.), 0.)
+
+    # probability to reach each step, i.e. all previous steps failed
+    reach = np.ones_like(chance)
+    reach[:, 1:] = np.cumprod(1. - chance[:, :-1], axis=1)
+
+    return reach * chance
+
+
+def cascade_value(arms_proba, arms, repeated_weight=0.):
+    """ Expected success probability and number of successful repeated payments of cascades.
+
+    :param arms_proba: {'primary': probabilities, 'repeated': probabilities}
+    :param arms: n x depth arms of cascades padded with -1
+    :param repeated_weight: weight of a successful repeated payment in value
+    :return: success probabilities, expected repeated successes, values (success + repeated_weight * repeated)
+    """
+    arms = np.asarray(arms, dtype=np.int64)
+    success_at = step_success(arms_proba['primary'], arms)
+    repeated_proba = np.where(arms >= 0, np.asarray(arms_proba['repeated'], dtype=float)[arms], 0.)
+
+    success = success_at.sum(axis=1)
+    repeated = REPEATED_MEAN * (success_at * repeated_proba).sum(axis=1)
+
+    return success, repeated, success + repeated_weight * repeated
+
+
+class CascadeEvaluator:
+    """ Memoized exact values of cascades and the best cascade of the environment.
+
+    Values are cached per config and dropped when probabilities of the environment change
+    (TestEnvironment.set_arm_proba bumps its proba_version).
+    """
+
+    def __init__(self, env, repeated_weight=0.):
+        """
+        :param env: TestEnvironment
+        :param repeated_weight: weight of a successful repeated payment in value, 0 counts only cascade success
+        """
+        self.env = env
+        self.repeated_weight = repeated_weight
+
+        self._version = None
+        # config -> (success, repeated, value)
+        self._values = {}
+        # (available arms, depth) -> (best config, value)
+        self._oracles = {}
+
+    def _check_version(self):
+        version = self.env.proba_version
+        if version != self._version:
+            self._values.clear()
+            self._oracles.clear()
+            self._version = version
+
+    def evaluate(self, arms):
+        """ Expected success probability, repeated successes and value of a cascade.
+
+        :param arms: sequence of arms
+        :return: (success, repeated, value)
+        """
+        self._check_version()
+        config = tuple(int(a) for a in arms)
+        result = self._values.get(config)
+        if result is None:
+            success, repeated, value = cascade_value(self.env.arms_proba, [config], self.repeated_weight)
+            result = self._values[config] = (float(success[0]), float(repeated[0]), float(value[0]))
+
+        return result
+
+    def values(self, config_ids):
+        """ Values of registered cascade configs, configs not in the cache are evaluated together.
+
+        :param config_ids: sequence of config ids of the environment CascadeRegistry
+        :return: array of values
+        """
+        self._check_version()
+        configs = self.env.cascades.configs
+        config_ids = np.asarray(config_ids, dtype=np.int64)
+
+        unique_ids = np.unique(config_ids)
+        missing = [config_id for config_id in unique_ids.tolist() if configs[config_id] not in self._values]
+        if len(missing) > 0:
+            success, repeated, value = cascade_value(self.env.arms_proba, self.env.cascades.arms[missing],
+                                                     self.repeated_weight)
+            for i, config_id in enumerate(missing):
+                self._values[configs[config_id]] = (float(success[i]), float(repeated[i]), float(value[i]))
+
+        unique_values = np.array([self._values[configs[config_id]][2] for config_id in unique_ids.tolist()])
+
+        return unique_values[np.searchsorted(unique_ids, config_ids)]
+
+    def oracle(self, depth: int, available=None):
+        """ Cascade of the given depth with the highest value, found by branch and bound.
+
+        Cascades are extended arm by arm, most promising first. A partial cascade is dropped when even
+        its best completion with repeated arms allowed, found by dynamic programming over the previous arm,
+        is not better than the best cascade found so far. Ties are resolved in favour of the first found.
+        The search is exact and takes milliseconds for a few steps over hundreds of arms, but deep cascades
+        over many arms with close probabilities may take long, as many cascades are close to the bound.
+
+        :param depth: number of steps, fewer if there are not enough available arms
+        :param available: boolean mask of arms with capacity, arms with positive constraints by default
+        :return: (best config, its value), (None, 0.) if no arm is available
+        """
+        self._check_version()
+        if available is None:
+            available = self.env.constraints > 0
+        available = np.asarray(available, dtype=bool)
+
+        key = (available.tobytes(), depth)
+        result = self._oracles.get(key)
+        if result is not None:
+            return result
+
+        arms = np.flatnonzero(available)
+        depth = min(depth, len(arms))
+        if depth == 0:
+            result = self._oracles[key] = (None, 0.)
+            return result
+
+        primary = np.asarray(self.env.arms_proba['primary'], dtype=float)[arms]
+        repeated = np.asarray(self.env.arms_proba['repeated'], dtype=float)[arms]
+        gain = 1. + self.repeated_weight * REPEATED_MEAN * repeated
+        # chance[i, j] of success at arm j after a failure at arm i, the last row is the first step
+        chance = np.clip(primary[None, :] - np.append(primary, 0.)[:, None], 0., 1.)
+
+        # bounds[k][i]: the best value of k more steps after a failure at arm i if arms may repeat
+        bounds = [np.zeros(len(arms) + 1)]
+        for _ in range(depth - 1):
+            bounds.append((chance * gain + (1. - chance) * bounds[-1][None, :-1]).max(axis=1))
+
+        used = np.zeros(len(arms), dtype=bool)
+        cascade = []
+        best = [None, -1.]
+
+        def extend(previous, reach, value):
+            remaining = depth - len(cascade)
+            if remaining == 0:
+                best[:] = [tuple(arms[cascade].tolist()), value]
+                return
+
+            step_chance = chance[previous]
+            values = value + reach * step_chance * gain
+            upper = values + reach * (1. - step_chance) * bounds[remaining - 1][:-1]
+            upper[used] = -1.
+            for arm in np.argsort(-upper, kind='stable').tolist():
+                if upper[arm] <= best[1]:
+                    break
+
+                used[arm] = True
+                cascade.append(arm)
+                extend(arm, reach * (1. - step_chance[arm]), values[arm])
+                cascade.pop()
+                used[arm] = False
+
+        extend(len(arms), 1., 0.)
+        result = self._oracles[key] = (best[0], self.evaluate(best[0])[2])
+
+        return result
+
+    def expected_regret(self, trace, depth: int):
+        """ Expected regret of every iteration of a simulation run against the best cascade.
+
+        Arms available at an iteration are taken from constraints recorded after the previous one,
+        all arms with initial capacity are available if constraints were not recorded.
+
+        :param trace: SimulationTrace of a run at the environment, run with record_constraints=True
+            to follow capacity of arms
+        :param depth: number of steps of the best cascade, usually len(cascade_params)
+        :return: array of value of the best cascade minus value of the played one
+        """
+        played = trace.cascade >= 0
+        played_values = np.zeros(trace.n_iters)
+        if played.any():
+            # played configs are few compared to iterations
+            positions, inverse = np.unique(trace.cascade[played], return_inverse=True)
+            value = np.array([self.evaluate(trace.configs[position])[2] for position in positions.tolist()])
+            played_values[played] = value[inverse.reshape(-1)]
+
+        initial = np.array(self.env.basic_constraints) > 0
+        if trace.constraints is None:
+            best_values = np.full(trace.n_iters, self.oracle(depth, initial)[1])
+        else:
+            available = np.vstack([initial[None, :], trace.constraints[:-1] > 0])
+            masks, inverse = np.unique(available, axis=0, return_inverse=True)
+            best = np.array([self.oracle(depth, mask)[1] for mask in masks])
+            best_values = best[inverse.reshape(-1)]
+
+        return best_values - played_values
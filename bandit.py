@@ -1,5 +1,8 @@
+from time import perf_counter
+
 import numpy as np
 
+from analytic import REPEATED_MEAN, step_success
 from environment import TestEnvironment
 
 
@@ -7,30 +10,66 @@ class Strategy:
     """Base for possible bandit strategies.
     """
 
-    def __init__(self, env: TestEnvironment, cascade_params = ['primary']):
+    def __init__(self, env: TestEnvironment, cascade_params = ['primary'], rng=None, step_posteriors=None):
+        """
+        :param env:
+        :param cascade_params: 'primary' or 'repeated' statistics used to choose arm of each cascade step
+        :param rng:
+        :param step_posteriors: posterior for each cascade step, e.g. forgetting.DiscountedBeta or
+            SlidingWindowBeta, None for a step keeps all evidence of the environment. Evidence of cascade
+            configs is discounted only if the environment is made with cascade_gamma
+        """
         self.env = env
 
         self.cascade_params = cascade_params
 
-    def choose_step_arm(self, step_parameter, current_cascade):
+        if step_posteriors is None:
+            step_posteriors = [None] * len(cascade_params)
+        self.step_posteriors = list(step_posteriors)
+        for step_parameter, posterior in zip(cascade_params, self.step_posteriors):
+            if posterior is not None:
+                env.add_posterior('repeated' if step_parameter == 'repeated' else 'primary', posterior)
+
+        # seed, SeedSequence or numpy Generator, generator of environment by default
+        if rng is None:
+            self.rng = env.rng
+        else:
+            self.rng = np.random.default_rng(rng)
+
+    def step_statistics(self, step_parameter, posterior=None):
+        """ Alphas and betas of arms used to choose arm of a cascade step.
+
+        :param step_parameter: 'primary' or 'repeated'
+        :param posterior: posterior of the step, all evidence of the environment is used if None
+        :return:
+        """
+        if posterior is not None:
+            return posterior.alphas, posterior.betas
+        elif step_parameter == 'repeated':
+            return self.env.repeated_alphas, self.env.repeated_betas
+        else:
+            return self.env.primary_alphas, self.env.primary_betas
+
+    def choose_step_arm(self, step_parameter, current_cascade, posterior=None):
         """Particular bandit strategy based on Thompson Sampling.
 
         Always choose an arm with highest estimate.
+        Arms without capacity and arms already used in current cascade are not sampled.
+        Return None if there is no such arm.
+        Posterior of the step is used instead of all evidence of the environment if it is given.
         """
-        if step_parameter == 'repeated':
-            estimation_list = [np.random.beta(self.env.repeated_alphas[i], self.env.repeated_betas[i])
-                               if (self.env.constraints[i] > 0) and (i not in current_cascade) else 0
-                               for i in range(self.env.n_arms)]
-        else:
-            estimation_list = [np.random.beta(self.env.primary_alphas[i], self.env.primary_betas[i])
-                               if (self.env.constraints[i] > 0) and (i not in current_cascade) else 0
-                               for i in range(self.env.n_arms)]
-        if len(estimation_list) == 0 or sum(estimation_list) == 0:
-            arm = None
-        else:
-            arm = np.argmax(estimation_list)
+        alphas, betas = self.step_statistics(step_parameter, posterior)
+
+        mask = self.env.constraints > 0
+        mask[current_cascade] = False
+        eligible = np.flatnonzero(mask)
 
-        return arm
+        if len(eligible) == 0:
+            return None
+
+        estimation = self.rng.beta(alphas[eligible], betas[eligible])
+
+        return eligible[np.argmax(estimation)]
 
     def cascade_builder(self):
         """Compound bandit strategy based on Thompson Sampling.
@@ -38,8 +77,8 @@ class Strategy:
         Always choose an config with highest estimate.
         """
         current_cascade = []
-        for step_params in self.cascade_params:
-            step_arm = self.choose_step_arm(step_params, current_cascade)
+        for step_params, posterior in zip(self.cascade_params, self.step_posteriors):
+            step_arm = self.choose_step_arm(step_params, current_cascade, posterior)
 
             if step_arm is None:
                 break
@@ -48,21 +87,179 @@ class Strategy:
         return current_cascade
 
     def choose_cascade(self):
+        """Choose cascade config id by Thompson Sampling among TOP5 cascades.
+
+        Return None if there is no cascade to choose from.
+        """
+        instruments = self.env.instruments
+        if instruments is not None:
+            start = perf_counter()
 
         # Create a new cascade config
         new_cascade_config = self.cascade_builder()
         # Add a new cascade config to cascade config list
         if len(new_cascade_config) != 0:
-            config_string = ' '.join([str(x) for x in new_cascade_config])
-            self.env.update_cascade_config(config_string)
+            self.env.update_cascade_config(new_cascade_config)
+
+        if instruments is not None:
+            built = perf_counter()
+            instruments.observe('build_seconds', built - start)
 
         # Get TOP5 sorted cascades by mean of the beta distribution
-        final_cascade_list = self.env.get_cascade_mean()[:5]
+        final_cascade_list = self.env.get_cascade_mean(5)
+
+        if instruments is not None:
+            instruments.observe('top_seconds', perf_counter() - built)
+            instruments.count('decisions')
+
+        if len(final_cascade_list) == 0:
+            if instruments is not None:
+                instruments.count('no_cascade')
+            return None
+
+        best_cascade_position = np.argmax(self.rng.beta(*self.env.cascades.posterior(final_cascade_list)))
+
+        if instruments is not None:
+            instruments.observe('choose_seconds', perf_counter() - start)
+
+        return int(final_cascade_list[best_cascade_position])
+
+    def cascade_builder_batch(self, n: int):
+        """ Build n cascades at once, same as n calls of cascade_builder without updates between them.
+
+        :param n:
+        :return: n x depth arms padded with -1
+        """
+        n_arms = self.env.n_arms
+        rows = np.arange(n)
+        current_cascade = np.full((n, len(self.cascade_params)), -1, dtype=np.int64)
+        building = np.ones(n, dtype=bool)
+        available = self.env.constraints > 0
+
+        for step, (step_params, posterior) in enumerate(zip(self.cascade_params, self.step_posteriors)):
+            alphas, betas = self.step_statistics(step_params, posterior)
+
+            mask = np.repeat(available[None, :], n, axis=0)
+            for previous in range(step):
+                used = current_cascade[:, previous] >= 0
+                mask[rows[used], current_cascade[used, previous]] = False
+
+            estimation = np.where(mask, self.rng.beta(alphas, betas, size=(n, n_arms)), -1.)
+            # cascade stops building at the first step without available arm
+            building &= mask.any(axis=1)
+            current_cascade[building, step] = estimation.argmax(axis=1)[building]
+
+        return current_cascade
+
+    def _demand(self, config_ids, reserve_all=False):
+        """ Capacity of arms taken by one payment through each config.
+
+        By default it is what TestEnvironment.play_cascade consumes: a unit of the first arm, which is spent
+        on success at the first step (success at later steps spends nothing), and expected number of
+        successful repeated payments at the arm where the cascade succeeds, estimated by posterior means.
+        With reserve_all every arm of the config takes a unit and nothing else: ConcurrentRoutingService
+        reserves them until feedback, then returns all but what play_cascade would consume,
+        and reserves repeated payments one by one.
 
-        best_cascade_position = np.argmax([np.random.beta(self.env.cascade_alphas[i], self.env.cascade_betas[i])
-                                           for i in final_cascade_list])
+        :param config_ids:
+        :param reserve_all:
+        :return: len(config_ids) x depth arms of the configs padded with -1, capacity taken at each of them
+            and mask of arms which need a whole unit left
+        """
+        env = self.env
+        arms = env.cascades.arms[config_ids]
+        valid = arms >= 0
+        if reserve_all:
+            return arms, valid.astype(float), valid
+
+        required = np.zeros(arms.shape, dtype=bool)
+        required[:, 0] = True
+
+        primary_means = env.primary_alphas / (env.primary_alphas + env.primary_betas)
+        repeated_means = env.repeated_alphas / (env.repeated_alphas + env.repeated_betas)
+        demand = step_success(primary_means, arms) * REPEATED_MEAN * np.where(valid, repeated_means[arms], 0.)
+        demand[:, 0] += 1.
+
+        return arms, demand, required
+
+    def choose_cascades(self, n: int, top=5, reserve_all=False):
+        """ Choose cascade config ids for n payments at once by Thompson Sampling among TOP cascades.
+
+        All n decisions see the same statistics. Payments take capacity of arms as estimated by _demand,
+        so the batch does not need more capacity than arms have. If capacity is short for the sampled cascades,
+        payments in turn choose among the best ranked cascades which still fit the capacity left,
+        so lower ranked cascades take places of exhausted TOP ones. Lower ranked cascades are taken
+        from the registry only as they are needed.
+
+        :param n: number of payments
+        :param top: number of cascades with highest mean to choose from
+        :param reserve_all: a payment takes a unit of every arm of its cascade instead of the units
+            consumed by the payment model of TestEnvironment
+        :return: config id of each payment, -1 if there is no cascade with capacity left for it
+        """
+        env = self.env
+
+        # new configs are registered in order of first appearance, as by n calls of choose_cascade
+        built = self.cascade_builder_batch(n)
+        if n > 1:
+            _, first = np.unique(built, axis=0, return_index=True)
+            built = built[np.sort(first)]
+        for row in built:
+            arm_list = row[row >= 0]
+            if len(arm_list) != 0:
+                env.update_cascade_config(arm_list)
+
+        config_ids = np.full(n, -1, dtype=np.int64)
+        ranked = env.get_cascade_mean(top)
+        if len(ranked) == 0:
+            return config_ids
+
+        budget = np.maximum(env.constraints, 0).astype(float)
+
+        alphas, betas = env.cascades.posterior(ranked)
+        estimation = self.rng.beta(alphas, betas, size=(n, len(ranked)))
+        positions = estimation.argmax(axis=1)
+        arms, demand, required = self._demand(ranked, reserve_all)
+        chosen = arms[positions]
+        valid = chosen >= 0
+        if (np.bincount(chosen[valid], demand[positions][valid], env.n_arms) <= budget).all():
+            return ranked[positions]
+
+        # capacity is short: payments in turn take the best sampled of the best ranked cascades which still fit.
+        # candidates are positions in ranked, which is extended from the registry when too few of them fit
+        candidates = np.arange(len(ranked))
+        next_position = len(ranked)
+        exhausted = len(ranked) < top
+        for i in range(n):
+            # padding -1 looks at the last arm, but it is never required
+            fits = ((budget[arms[candidates]] >= 1) | ~required[candidates]).all(axis=1)
+            candidates = candidates[fits]
+
+            while len(candidates) < top and not (exhausted and next_position == len(ranked)):
+                if next_position == len(ranked):
+                    ranked = env.get_cascade_mean(2 * len(ranked))
+                    exhausted = len(ranked) < 2 * next_position
+                    alphas, betas = env.cascades.posterior(ranked)
+                    arms, demand, required = self._demand(ranked, reserve_all)
+                    continue
+
+                more = np.arange(next_position, min(len(ranked), next_position + top - len(candidates)))
+                fits = ((budget[arms[more]] >= 1) | ~required[more]).all(axis=1)
+                candidates = np.concatenate([candidates, more[fits]])
+                next_position = more[-1] + 1
+
+            if len(candidates) == 0:
+                break
+
+            best = candidates[np.argmax(self.rng.beta(alphas[candidates], betas[candidates]))]
+            config_ids[i] = ranked[best]
+
+            # arms of a config are distinct
+            taken = arms[best] >= 0
+            budget[arms[best, taken]] -= demand[best, taken]
+
+        return config_ids
 
-        return final_cascade_list[best_cascade_position]
 
 class Bandit:
     """Set up and launch bandit problem solver with current environment and strategy"""
@@ -71,6 +268,41 @@ class Bandit:
         self.strategy = strategy
         self.env = self.strategy.env
 
+    def simulate_failure(self):
+        """ Delete or return a bank if it is time to.
+
+        :return: failure message or None
+        """
+        failure_message = self.env.delete_bank()
+        if failure_message is None:
+            failure_message = self.env.add_bank()
+
+        return failure_message
+
     def action(self):
+        """ Choose a cascade and play it at environment.
+
+        :return: played cascade config id and its reward, (None, None) if there is no cascade to play
+        """
         cascade = self.strategy.choose_cascade()
-        self.env.play_cascade(cascade)
\ No newline at end of file
+        if cascade is None:
+            return None, None
+
+        reward = self.env.play_cascade(cascade)
+
+        return cascade, reward
+
+    def action_batch(self, n: int):
+        """ Choose cascades for n payments at once and play them at environment.
+
+        :param n: number of payments
+        :return: config id and reward of each of n payments, payments without cascade are not played,
+            their config id is -1 and reward is 0
+        """
+        config_ids = self.strategy.choose_cascades(n)
+        routed = config_ids >= 0
+
+        rewards = np.zeros(n, dtype=np.int64)
+        rewards[routed] = self.env.play_batch(config_ids[routed])
+
+        return config_ids, rewards
@@ -0,0 +1,303 @@
+"""
+Vectorized simulation of many independent replicas of the bandit at environment.
+Every replica is a row of 2-D arrays and all replicas make payments in lockstep.
+"""
+
+import numpy as np
+
+
+class BatchEnvironment:
+    """ R independent copies of TestEnvironment stored as arrays.
+
+    Cascade configs are shared between replicas: config ids index columns of the R x n_configs
+    cascade arrays, and `seen` marks configs which were built in the replica.
+    """
+
+    def __init__(self, n_replicas: int, primary_arms_proba: list, repeated_arms_proba: list, constraints: list,
+                 depth: int, rng=None):
+
+        self.n_replicas = n_replicas
+        self.n_arms = len(primary_arms_proba)
+        self.depth = depth
+
+        self.rng = np.random.default_rng(rng)
+
+        # test environment parameters
+        self.arms_proba = {'primary': np.asarray(primary_arms_proba, dtype=float),
+                           'repeated': np.asarray(repeated_arms_proba, dtype=float)}
+        self.basic_constraints = np.asarray(constraints)
+
+        self.n_payments = np.zeros(n_replicas, dtype=np.int64)
+        self.n_success = np.zeros(n_replicas, dtype=np.int64)
+
+        self.n_primary_payments = np.zeros(n_replicas, dtype=np.int64)
+        self.n_primary_success = np.zeros(n_replicas, dtype=np.int64)
+
+        self.n_repeated_payments = np.zeros(n_replicas, dtype=np.int64)
+        self.n_repeated_success = np.zeros(n_replicas, dtype=np.int64)
+
+        self.n_cascade_payments = np.zeros(n_replicas, dtype=np.int64)
+        self.n_cascade_success = np.zeros(n_replicas, dtype=np.int64)
+
+        self.constraints = np.tile(self.basic_constraints, (n_replicas, 1))
+
+        # real environment parameters
+        self.primary_alphas = np.ones((n_replicas, self.n_arms))
+        self.primary_betas = np.ones((n_replicas, self.n_arms))
+
+        self.repeated_alphas = np.ones((n_replicas, self.n_arms))
+        self.repeated_betas = np.ones((n_replicas, self.n_arms))
+
+        # shared cascade configs: arms padded with -1 and sorted keys for lookup
+        self.n_configs = 0
+        self.config_arms = np.full((0, depth), -1, dtype=np.int64)
+        self._sorted_keys = np.zeros(0, dtype=np.int64)
+        self._sorted_ids = np.zeros(0, dtype=np.int64)
+
+        self.cascade_alphas = np.ones((n_replicas, 0))
+        self.cascade_betas = np.ones((n_replicas, 0))
+        self.seen = np.zeros((n_replicas, 0), dtype=bool)
+
+    def config_keys(self, cascades):
+        """ Encode padded cascades (n x depth) into integer keys.
+
+        :param cascades:
+        :return:
+        """
+        base = self.n_arms + 1
+        return ((cascades + 1) * base ** np.arange(self.depth, dtype=np.int64)).sum(axis=1)
+
+    def update_cascade_config(self, cascades):
+        """ Register cascades built by replicas.
+
+        :param cascades: R x depth arms padded with -1, empty cascades are skipped
+        :return: config id for each replica, -1 for empty cascades
+        """
+        built = cascades[:, 0] >= 0
+        keys = self.config_keys(cascades[built])
+
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        position = np.searchsorted(self._sorted_keys, unique_keys)
+        known = position < len(self._sorted_keys)
+        known[known] = self._sorted_keys[position[known]] == unique_keys[known]
+
+        unique_ids = np.empty(len(unique_keys), dtype=np.int64)
+        unique_ids[known] = self._sorted_ids[position[known]]
+
+        n_new = int((~known).sum())
+        if n_new > 0:
+            new_ids = np.arange(self.n_configs, self.n_configs + n_new)
+            unique_ids[~known] = new_ids
+
+            self.config_arms = np.concatenate([self.config_arms, cascades[built][first[~known]]])
+
+            self._sorted_keys = np.concatenate([self._sorted_keys, unique_keys[~known]])
+            self._sorted_ids = np.concatenate([self._sorted_ids, new_ids])
+            order = np.argsort(self._sorted_keys)
+            self._sorted_keys = self._sorted_keys[order]
+            self._sorted_ids = self._sorted_ids[order]
+
+            self.n_configs += n_new
+            new_columns = np.ones((self.n_replicas, n_new))
+            self.cascade_alphas = np.concatenate([self.cascade_alphas, new_columns], axis=1)
+            self.cascade_betas = np.concatenate([self.cascade_betas, new_columns], axis=1)
+            self.seen = np.concatenate([self.seen, np.zeros((self.n_replicas, n_new), dtype=bool)], axis=1)
+
+        config_ids = np.full(self.n_replicas, -1, dtype=np.int64)
+        config_ids[built] = unique_ids[inverse]
+        self.seen[np.flatnonzero(built), config_ids[built]] = True
+
+        return config_ids
+
+    def get_cascade_config(self):
+        """ Return R x n_configs mask of configs available in each replica.
+
+        Config is available if it was built in the replica and all its arms have capacity.
+
+        :return:
+        """
+        # -1 pads shorter configs and points to the always available last column
+        available = np.ones((self.n_replicas, self.n_arms + 1), dtype=bool)
+        available[:, :-1] = self.constraints > 0
+
+        return self.seen & available[:, self.config_arms].all(axis=2)
+
+    def play_cascade(self, config_ids):
+        """ Cascade routing simulator for all replicas at once.
+
+        Same model as TestEnvironment.play_cascade: the first step updates primary statistics,
+        on success a gamma(1, 2) number of repeated payments is made through the successful arm.
+
+        :param config_ids: config id for each replica, -1 means no payment
+        :return: cascade reward of each replica
+        """
+        rows = np.flatnonzero(config_ids >= 0)
+        arms = self.config_arms[config_ids[rows]]
+        exists = arms >= 0
+
+        # Calculate probability for each step of cascade
+        proba = np.where(exists, self.arms_proba['primary'][arms], 0.)
+        step_proba = proba.copy()
+        step_proba[:, 1:] -= proba[:, :-1]
+
+        success = exists & (self.rng.random(arms.shape) < step_proba)
+        reward = success.any(axis=1).astype(np.int64)
+        success_step = success.argmax(axis=1)
+
+        # Update reward for first cascade step
+        first_arm = arms[:, 0]
+        first_reward = success[:, 0].astype(np.int64)
+        self.primary_alphas[rows, first_arm] += first_reward
+        self.primary_betas[rows, first_arm] += 1 - first_reward
+        self.n_primary_payments[rows] += 1
+        self.n_primary_success[rows] += first_reward
+        self.constraints[rows, first_arm] -= first_reward
+
+        # Oneclick payments simulator
+        paid = reward == 1
+        paid_rows = rows[paid]
+        paid_arms = arms[paid, success_step[paid]]
+        repeated_num = self.rng.gamma(1, 2, len(paid_rows)).astype(np.int64)
+        repeated_success = self.rng.binomial(repeated_num, self.arms_proba['repeated'][paid_arms])
+
+        self.repeated_alphas[paid_rows, paid_arms] += repeated_success
+        self.repeated_betas[paid_rows, paid_arms] += repeated_num - repeated_success
+        self.n_repeated_payments[paid_rows] += repeated_num
+        self.n_repeated_success[paid_rows] += repeated_success
+        self.n_payments[paid_rows] += repeated_num
+        self.n_success[paid_rows] += repeated_success
+        self.constraints[paid_rows, paid_arms] -= repeated_success
+
+        # Update cascade statistics
+        played = config_ids[rows]
+        self.cascade_alphas[rows, played] += reward
+        self.cascade_betas[rows, played] += 1 - reward
+        self.n_cascade_payments[rows] += 1
+        self.n_cascade_success[rows] += reward
+        self.n_payments[rows] += 1
+        self.n_success[rows] += reward
+
+        rewards = np.zeros(self.n_replicas, dtype=np.int64)
+        rewards[rows] = reward
+
+        return rewards
+
+
+class BatchStrategy:
+    """ Strategy for all replicas of BatchEnvironment, same decisions as Strategy made row by row.
+    """
+
+    def __init__(self, env: BatchEnvironment, cascade_params=['primary'], top=5):
+        self.env = env
+
+        self.cascade_params = cascade_params
+        self.top = top
+
+    def choose_step_arm(self, step_parameter, current_cascade):
+        """ Thompson Sampling of one cascade step in every replica.
+
+        :param step_parameter:
+        :param current_cascade: R x depth arms chosen so far, padded with -1
+        :return: chosen arm of each replica, -1 if there is no available arm
+        """
+        env = self.env
+        if step_parameter == 'repeated':
+            alphas, betas = env.repeated_alphas, env.repeated_betas
+        else:
+            alphas, betas = env.primary_alphas, env.primary_betas
+
+        mask = env.constraints > 0
+        rows, steps = np.nonzero(current_cascade >= 0)
+        mask[rows, current_cascade[rows, steps]] = False
+
+        estimation = np.where(mask, env.rng.beta(alphas, betas), -1.)
+        arm = estimation.argmax(axis=1)
+        arm[~mask.any(axis=1)] = -1
+
+        return arm
+
+    def cascade_builder(self):
+        """ Build a cascade in every replica.
+
+        :return: R x depth arms padded with -1
+        """
+        env = self.env
+        current_cascade = np.full((env.n_replicas, env.depth), -1, dtype=np.int64)
+        building = np.ones(env.n_replicas, dtype=bool)
+        for step, step_params in enumerate(self.cascade_params):
+            step_arm = self.choose_step_arm(step_params, current_cascade)
+            # replica stops building at the first step without available arm
+            building &= step_arm >= 0
+            current_cascade[building, step] = step_arm[building]
+
+        return current_cascade
+
+    def choose_cascade(self):
+        """ Choose config id for every replica by Thompson Sampling among TOP cascades by mean.
+
+        :return: config id of each replica, -1 if there is no cascade to choose from
+        """
+        env = self.env
+        env.update_cascade_config(self.cascade_builder())
+
+        available = env.get_cascade_config()
+        if env.n_configs == 0:
+            return np.full(env.n_replicas, -1, dtype=np.int64)
+
+        means = np.where(available, env.cascade_alphas / (env.cascade_alphas + env.cascade_betas), -1.)
+        k = min(self.top, env.n_configs)
+        if k < env.n_configs:
+            top = np.argpartition(-means, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), (env.n_replicas, k))
+
+        rows = np.arange(env.n_replicas)[:, None]
+        estimation = env.rng.beta(env.cascade_alphas[rows, top], env.cascade_betas[rows, top])
+        estimation[~available[rows, top]] = -1.
+
+        config_ids = top[rows[:, 0], estimation.argmax(axis=1)]
+        config_ids[~available.any(axis=1)] = -1
+
+        return config_ids
+
+
+class BatchSimulation:
+    """ Run all replicas in lockstep.
+    """
+
+    def __init__(self, strategy: BatchStrategy):
+        self.strategy = strategy
+        self.env = strategy.env
+
+        # first iteration when arm has no capacity left in the replica, -1 if never
+        self.exhaustion_iter = np.full((self.env.n_replicas, self.env.n_arms), -1, dtype=np.int64)
+
+    def run(self, n_iters: int):
+        """ Simulate n_iters payments in every replica.
+
+        :param n_iters:
+        :return: mean cascade reward over replicas for each iteration
+        """
+        mean_reward = np.zeros(n_iters)
+        for i in range(n_iters):
+            config_ids = self.strategy.choose_cascade()
+            if (config_ids < 0).all():
+                return mean_reward[:i]
+            mean_reward[i] = self.env.play_cascade(config_ids).mean()
+
+            exhausted = (self.env.constraints <= 0) & (self.exhaustion_iter < 0)
+            self.exhaustion_iter[exhausted] = i
+
+        return mean_reward
+
+    def conversion(self):
+        """ Conversion of every replica (cascade and repeated payments).
+        :return:
+        """
+        return self.env.n_success / np.maximum(self.env.n_payments, 1)
+
+    def cascade_conversion(self):
+        """ Conversion of cascade payments of every replica.
+        :return:
+        """
+        return self.env.n_cascade_success / np.maximum(self.env.n_cascade_payments, 1)
@@ -0,0 +1,457 @@
+"""
+Benchmarks of routing decision hot paths.
+"""
+
+import json
+import subprocess
+import sys
+import threading
+import tracemalloc
+from itertools import product
+from math import perm
+from timeit import default_timer as timer
+
+import numpy as np
+
+from bandit import Bandit, Strategy
+from concurrency import ConcurrentRoutingService
+from environment import TestEnvironment
+
+
+def make_environment(n_configs: int, n_arms=400, depth=2, seed=0):
+    """ Environment with n_configs registered cascades of random statistics.
+
+    Number of configs is limited by number of distinct cascades of the depth.
+
+    :param n_configs:
+    :param n_arms:
+    :param depth: number of steps in each cascade
+    :param seed:
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    env = TestEnvironment(list(rng.uniform(0.1, 0.9, n_arms)),
+                          list(rng.uniform(0.1, 0.9, n_arms)),
+                          [10 ** 9] * n_arms, rng=seed)
+
+    n_configs = min(n_configs, perm(n_arms, depth))
+    while len(env.cascades) < n_configs:
+        config_id = env.update_cascade_config(rng.choice(n_arms, depth, replace=False))
+        for reward in rng.integers(0, 2, 4):
+            env.update_cascade_reward(config_id, reward)
+
+    return env
+
+
+def bench_cascade_mean(sizes=(10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5), n_calls=2000, full_sort=True):
+    """ Cost of one cascade choice step: update of played cascade and TOP5 query.
+
+    TOP5 from the incremental index should stay flat while full sorting grows with number of configs.
+
+    :param sizes: numbers of historical configs
+    :param n_calls: number of measured payments for each size
+    :param full_sort: also measure sorting of all configs
+    :return: list of (n_configs, top5 microseconds, full sort microseconds)
+    """
+    rng = np.random.default_rng(1)
+    results = []
+    for n_configs in sizes:
+        env = make_environment(n_configs)
+        config_ids = rng.integers(0, n_configs, n_calls)
+        rewards = rng.integers(0, 2, n_calls)
+
+        start = timer()
+        for config_id, reward in zip(config_ids, rewards):
+            env.update_cascade_reward(config_id, reward)
+            env.get_cascade_mean(5)
+        top_time = (timer() - start) / n_calls * 1e6
+
+        sort_time = None
+        if full_sort:
+            n_sort_calls = max(1, n_calls // 10)
+            start = timer()
+            for config_id, reward in zip(config_ids[:n_sort_calls], rewards[:n_sort_calls]):
+                env.update_cascade_reward(config_id, reward)
+                env.get_cascade_mean()[:5]
+            sort_time = (timer() - start) / n_sort_calls * 1e6
+
+        results.append((n_configs, top_time, sort_time))
+
+    return results
+
+
+def _payment_worker(service: ConcurrentRoutingService, worker: int, n_payments: int):
+    """ Make payments through the service with the model of TestEnvironment.play_cascade.
+    """
+    rng = np.random.default_rng(worker)
+    arms_proba = service.env.arms_proba
+    for i in range(n_payments):
+        request_id = (worker, i)
+        cascade = service.decide(request_id)
+        if cascade is None:
+            continue
+
+        previous_proba = 0
+        for step, arm in enumerate(cascade):
+            reward = int(rng.random() < arms_proba['primary'][arm] - previous_proba)
+            previous_proba = arms_proba['primary'][arm]
+            service.report(request_id, step, reward)
+
+            if reward == 1:
+                for _ in range(int(rng.gamma(1, 2))):
+                    if service.reserve_repeated(arm):
+                        service.report_repeated(arm, int(rng.random() < arms_proba['repeated'][arm]))
+                break
+
+
+def bench_concurrent_updates(threads=(1, 2, 4, 8), n_payments=20000, batch_size=64):
+    """ Throughput of ConcurrentRoutingService used by several threads and check of its invariants.
+
+    Capacity is small enough to run out during the benchmark. After the run every unit of capacity
+    must be either left or consumed by exactly one successful first step or repeated payment,
+    and no update may be lost.
+
+    :param threads: numbers of worker threads
+    :param n_payments: total number of payments
+    :param batch_size: feedback commit batch size
+    :return: list of (n_threads, payments per second)
+    """
+    constraints = [n_payments // 20] * 5
+    results = []
+    for n_threads in threads:
+        env = TestEnvironment([0.2, 0.72, 0.83, 0.7, 0.75], [0.8, 0.7, 0.7, 0.4, 0.71], constraints, rng=0)
+        service = ConcurrentRoutingService(Strategy(env, cascade_params=['repeated', 'primary']), batch_size)
+
+        workers = [threading.Thread(target=_payment_worker, args=(service, w, n_payments // n_threads))
+                   for w in range(n_threads)]
+        start = timer()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        service.commit()
+        elapsed = timer() - start
+
+        assert len(service.pending) == 0
+        assert (env.constraints >= 0).all()
+        assert (env.constraints + service.consumed == constraints).all()
+        assert env.n_primary_success + env.n_repeated_success == service.consumed.sum()
+
+        results.append((n_threads, env.n_cascade_payments / elapsed))
+
+    return results
+
+
+def _rate(function, n_calls: int):
+    """ Calls of function per second.
+    """
+    start = timer()
+    for _ in range(n_calls):
+        function()
+
+    return n_calls / (timer() - start)
+
+
+def _frame_time(bandit: Bandit, n_frames: int):
+    """ Seconds to draw one DrawEnvironment frame of the bandit state with Agg backend.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    from simulation import Snapshot
+    from visualisation import DrawEnvironment
+
+    figure, ax = plt.subplots(2, 2, figsize=(20, 12), dpi=50)
+    drawer = DrawEnvironment(ax, arms_proba=bandit.env.arms_proba)
+    snapshot = Snapshot(bandit, 0)
+
+    # first frame lays out the figure
+    drawer.draw(snapshot)
+    figure.canvas.draw()
+
+    start = timer()
+    for _ in range(n_frames):
+        drawer.draw(snapshot)
+        figure.canvas.draw()
+    elapsed = (timer() - start) / n_frames
+    plt.close(figure)
+
+    return elapsed
+
+
+def bench_hot_paths(arms=(5, 50, 400), depths=(1, 2, 3), sizes=(10 ** 2, 10 ** 4), n_calls=2000,
+                    n_frames=0, seed=0):
+    """ Throughput of routing decision and payment simulation over grid of environment sizes.
+
+    Each case starts from environment with given number of accumulated cascade configs,
+    cascade_params of the strategy have the given depth.
+
+    :param arms: numbers of arms
+    :param depths: numbers of cascade steps
+    :param sizes: numbers of historical configs, limited by number of distinct cascades
+    :param n_calls: number of measured calls of each hot path
+    :param n_frames: number of measured DrawEnvironment frames, frames are not drawn if 0
+    :param seed:
+    :return: list of dictionaries, one for each case
+    """
+    results = []
+    for n_arms, depth, n_configs in product(arms, depths, sizes):
+        env = make_environment(n_configs, n_arms, depth, seed)
+        strategy = Strategy(env, cascade_params=['repeated'] + ['primary'] * (depth - 1))
+        config_ids = env.rng.integers(0, len(env.cascades), n_calls)
+
+        result = {'n_arms': n_arms,
+                  'depth': depth,
+                  'n_configs': len(env.cascades),
+                  'builds_per_s': _rate(strategy.cascade_builder, n_calls),
+                  'top5_per_s': _rate(lambda: env.get_cascade_mean(5), n_calls),
+                  'decisions_per_s': _rate(strategy.choose_cascade, n_calls)}
+
+        ids = iter(config_ids.tolist())
+        result['payments_per_s'] = _rate(lambda: env.play_cascade(next(ids)), n_calls)
+
+        # memory allocated while bandit makes payments, tracing slows them, so it is measured apart
+        bandit = Bandit(strategy)
+        tracemalloc.start()
+        _rate(bandit.action, n_calls)
+        result['peak_memory_kib'] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+        if n_frames > 0:
+            result['frame_s'] = _frame_time(bandit, n_frames)
+
+        results.append(result)
+
+    return results
+
+
+def bench_batch_decisions(batch_sizes=(1, 16, 256), n_payments=2 ** 14, n_arms=50, depth=2):
+    """ Amortized cost of one payment made by Bandit.action_batch against one by one Bandit.action.
+
+    :param batch_sizes:
+    :param n_payments: number of measured payments for each batch size
+    :param n_arms:
+    :param depth: number of steps in each cascade
+    :return: list of (batch size, batch microseconds per payment, one by one microseconds per payment)
+    """
+    results = []
+    for batch_size in batch_sizes:
+        times = []
+        for batched in (True, False):
+            env = make_environment(10 ** 3, n_arms, depth)
+            bandit = Bandit(Strategy(env, cascade_params=['repeated'] + ['primary'] * (depth - 1)))
+
+            start = timer()
+            if batched:
+                for _ in range(n_payments // batch_size):
+                    bandit.action_batch(batch_size)
+            else:
+                for _ in range(n_payments // batch_size * batch_size):
+                    bandit.action()
+            times.append((timer() - start) / (n_payments // batch_size * batch_size) * 1e6)
+
+        results.append((batch_size, times[0], times[1]))
+
+    return results
+
+
+def bench_bounded_pool(max_configs=(None, 1000), n_arms=60, depth=4, n_payments=50000, every=10000):
+    """ Cost of one payment and number of kept configs over a long run with deep cascades.
+
+    With bounded pool both should stay flat, without it the number of configs grows all the run.
+
+    :param max_configs: limits of the pool, None for unbounded
+    :param n_arms:
+    :param depth: number of steps in each cascade
+    :param n_payments:
+    :param every: number of payments in one measurement
+    :return: list of (max_configs, list of (payments made, microseconds per payment, number of configs))
+    """
+    results = []
+    for limit in max_configs:
+        rng = np.random.default_rng(0)
+        env = TestEnvironment(list(rng.uniform(0.1, 0.9, n_arms)), list(rng.uniform(0.1, 0.9, n_arms)),
+                              [10 ** 9] * n_arms, rng=0, max_configs=limit)
+        bandit = Bandit(Strategy(env, cascade_params=['repeated'] + ['primary'] * (depth - 1)))
+
+        points = []
+        for made in range(every, n_payments + 1, every):
+            start = timer()
+            for _ in range(every):
+                bandit.action()
+            points.append((made, (timer() - start) / every * 1e6, len(env.cascades)))
+
+        results.append((limit, points))
+
+    return results
+
+
+def bench_allocations(counts=(10 ** 3, 10 ** 4, 10 ** 5), n_configs=200, n_arms=50, depth=2):
+    """ Memory kept by the payment update path (play_cascade of known configs) for growing numbers of payments.
+
+    Retained memory and number of live blocks should not depend on number of payments.
+
+    :param counts: numbers of payments
+    :param n_configs:
+    :param n_arms:
+    :param depth: number of steps in each cascade
+    :return: list of (payments, retained bytes per payment, live blocks after the run, peak KiB)
+    """
+    results = []
+    for n_payments in counts:
+        env = make_environment(n_configs, n_arms, depth)
+        config_ids = env.rng.integers(0, len(env.cascades), n_payments).tolist()
+
+        # fill random blocks and heap before measuring
+        for config_id in config_ids[:1000]:
+            env.play_cascade(config_id)
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for config_id in config_ids:
+            env.play_cascade(config_id)
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        stats = after.compare_to(before, 'filename')
+        retained = sum(stat.size_diff for stat in stats)
+        blocks = sum(stat.count_diff for stat in stats)
+        results.append((n_payments, retained / n_payments, blocks, peak / 1024))
+
+    return results
+
+
+COLD_START_SCRIPT = """
+import sys
+import main
+main.main(['simulate', '--iters', '1'])
+assert 'matplotlib' not in sys.modules and 'scipy' not in sys.modules, 'plotting stack imported'
+"""
+
+
+def bench_cold_start(n_runs=5):
+    """ Wall time of a fresh interpreter importing main and simulating one payment.
+
+    Fails if the simulation path imports matplotlib or scipy. Compare with main.COLD_START_TARGET.
+
+    :param n_runs:
+    :return: median seconds
+    """
+    times = []
+    for _ in range(n_runs):
+        start = timer()
+        subprocess.run([sys.executable, '-c', COLD_START_SCRIPT], check=True, stdout=subprocess.DEVNULL)
+        times.append(timer() - start)
+
+    return float(np.median(times))
+
+
+# Metrics where smaller value is better, larger is better for others
+LOWER_IS_BETTER = ('peak_memory_kib', 'frame_s')
+
+
+def save_baseline(results, path):
+    """ Save results of bench_hot_paths as JSON baseline.
+
+    :param results:
+    :param path:
+    :return:
+    """
+    with open(path, 'w') as f:
+        json.dump({'version': 1, 'results': results}, f, indent=1)
+
+
+def compare(results, baseline_path, tolerance=0.2):
+    """ Find regressions of results against saved baseline.
+
+    Cases are matched by number of arms, depth and number of configs, cases absent
+    from the baseline are skipped.
+
+    :param results: results of bench_hot_paths
+    :param baseline_path:
+    :param tolerance: allowed relative worsening of each metric
+    :return: list of (case, metric, baseline value, value) for every regression
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+
+    def case(result):
+        return result['n_arms'], result['depth'], result['n_configs']
+
+    baseline = {case(result): result for result in baseline}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(case(result))
+        if previous is None:
+            continue
+
+        for metric, value in result.items():
+            if metric in ('n_arms', 'depth', 'n_configs') or metric not in previous:
+                continue
+
+            if metric in LOWER_IS_BETTER:
+                regressed = value > previous[metric] * (1 + tolerance)
+            else:
+                regressed = value < previous[metric] * (1 - tolerance)
+
+            if regressed:
+                regressions.append((case(result), metric, previous[metric], value))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark routing decision and simulation hot paths.')
+    parser.add_argument('--save', help='save results as JSON baseline to the path')
+    parser.add_argument('--compare', help='compare results with JSON baseline at the path')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative worsening')
+    parser.add_argument('--frames', type=int, default=0, help='number of measured frames for each case')
+    args = parser.parse_args()
+
+    print('arms depth configs  builds/s    top5/s  decisions/s  payments/s  peak, KiB')
+    results = bench_hot_paths(n_frames=args.frames)
+    for r in results:
+        print('%4d %5d %7d %9.0f %9.0f %12.0f %11.0f %10.1f' %
+              (r['n_arms'], r['depth'], r['n_configs'], r['builds_per_s'], r['top5_per_s'],
+               r['decisions_per_s'], r['payments_per_s'], r['peak_memory_kib']))
+
+    if args.save:
+        save_baseline(results, args.save)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for case, metric, previous, value in regressions:
+            print('regression %s %s: %.4g -> %.4g' % (case, metric, previous, value))
+        if regressions:
+            raise SystemExit(1)
+
+    print('\npayments    retained bytes/payment    live blocks    peak, KiB')
+    for n_payments, retained, blocks, peak in bench_allocations():
+        print('%8d %25.2f %14d %12.1f' % (n_payments, retained, blocks, peak))
+
+    from main import COLD_START_TARGET
+
+    cold_start = bench_cold_start()
+    print('\ncold start %.3f s, target %.3f s' % (cold_start, COLD_START_TARGET))
+
+    print('\nbatch    batch, us/payment    one by one, us/payment')
+    for batch_size, batch_time, single_time in bench_batch_decisions():
+        print('%5d %20.1f %25.1f' % (batch_size, batch_time, single_time))
+
+    for limit, points in bench_bounded_pool():
+        print('\nmax configs %s\npayments    us/payment    configs' % limit)
+        for made, payment_time, n_configs in points:
+            print('%8d %13.1f %10d' % (made, payment_time, n_configs))
+
+    print('\nconfigs    top5, us    full sort, us')
+    for n_configs, top_time, sort_time in bench_cascade_mean():
+        print('%7d %11.1f %16.1f' % (n_configs, top_time, sort_time))
+
+    print('\nthreads    payments/s')
+    for n_threads, throughput in bench_concurrent_updates():
+        print('%7d %13.0f' % (n_threads, throughput))
@@ -0,0 +1,602 @@
+"""
+Storage of cascade configs and their statistics.
+"""
+
+from collections import OrderedDict
+from heapq import heappop, heappush
+
+import numpy as np
+
+
+class CascadeRegistry:
+    """ Intern cascade configs (tuples of arms) into integer ids.
+
+    Beta distribution parameters and means of all configs are kept in growable arrays indexed by id.
+    String keys like '1 3' are only made for display.
+
+    Active configs are also kept in a heap ordered by mean for fast TOP-K queries.
+    Heap entries are never removed in place: every change of a config bumps its version
+    and entries with an old version are dropped when they reach the top.
+
+    A config is active while none of its arms is exhausted. Inverted index from arm to config ids
+    lets exhausting or returning an arm touch only configs containing it.
+
+    Payment counts only grow, so ids of the most paid configs are kept up to date on every update.
+
+    Evidence of configs may be discounted by gamma at every payment, as forgetting.DiscountedBeta does for arms.
+    Discount is applied lazily: evidence of a config is kept as of its last payment and is discounted up to now
+    when it is read (see posterior). Discounted means of configs drift back to the prior at different speeds,
+    so with gamma TOP configs are found by one pass over discounted means of active configs instead of the heap.
+
+    Number of configs may be limited by max_configs, which must leave room besides protected TOP and
+    most paid configs. When the pool is full, a part of it is evicted at once:
+    configs which can not compete with the TOP ones first, then least recently paid. Ids of evicted configs
+    are reused by new ones. Statistics of evicted configs are remembered (as many as max_configs), so a config
+    built again is admitted back with them.
+    """
+
+    __slots__ = ('n_configs', 'n_admitted', '_configs', '_ids',
+                 '_alphas', '_betas', '_means', '_active', '_versions', '_blocked', '_arms', '_last_used',
+                 '_paid', '_discounted', 'gamma',
+                 '_by_arm', 'exhausted', '_heap', 'n_most_paid', 'most_paid',
+                 'max_configs', 'evict_fraction', 'protect_top', 'clock', 'free', 'evicted', 'last_evicted')
+
+    def __init__(self, capacity=64, depth=1, n_most_paid=9, max_configs=None, evict_fraction=0.125,
+                 protect_top=5, gamma=None):
+        """
+        :param capacity: initial size of arrays
+        :param depth: initial number of arms in config
+        :param n_most_paid: length of most paid list
+        :param max_configs: limit of number of configs, not limited if None
+        :param evict_fraction: part of max_configs evicted when the pool is full
+        :param protect_top: number of active configs with highest mean which are never evicted
+        :param gamma: discount of evidence at every payment from 0 to 1, evidence is kept forever if None
+        """
+        # TOP and most paid configs are never evicted, a new config must find a place besides them
+        if max_configs is not None and max_configs <= protect_top + n_most_paid:
+            raise ValueError('max_configs must be greater than protect_top + n_most_paid = ' +
+                             str(protect_top + n_most_paid) + ', got ' + str(max_configs))
+
+        # number of used ids including free ones
+        self.n_configs = 0
+        # number of admitted configs including evicted ones
+        self.n_admitted = 0
+
+        # id -> tuple of arms and back, built from arms of configs on first use if None
+        self._configs = []
+        self._ids = {}
+
+        self._alphas = np.ones(capacity)
+        self._betas = np.ones(capacity)
+        self._means = np.full(capacity, 0.5)
+        self._active = np.zeros(capacity, dtype=bool)
+        self._versions = np.zeros(capacity, dtype=np.int64)
+        # number of exhausted arms in each config
+        self._blocked = np.zeros(capacity, dtype=np.int64)
+
+        # arm -> ids of configs containing it, built from arms of configs on first use if None
+        self._by_arm = {}
+        self.exhausted = set()
+
+        # (-mean, id, version) of active configs, built from means on first use if None
+        self._heap = []
+
+        # arms of each config padded with -1
+        self._arms = np.full((capacity, depth), -1, dtype=np.int64)
+
+        # ids of configs with most payments, ties in order of registration
+        self.n_most_paid = n_most_paid
+        self.most_paid = []
+
+        self.max_configs = max_configs
+        self.evict_fraction = evict_fraction
+        self.protect_top = protect_top
+
+        # number of payments made, clock value of the last payment of each config
+        self.clock = 0
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+
+        # payments of each config, ranks most paid ones whether evidence is discounted or not
+        self._paid = np.zeros(capacity)
+        # clock value evidence of each config is discounted up to
+        self.gamma = gamma
+        self._discounted = np.zeros(capacity, dtype=np.int64)
+
+        # ids of evicted configs to reuse, config -> (alpha, beta) of recently evicted configs
+        self.free = []
+        self.evicted = OrderedDict()
+        # (id, config) of configs evicted to admit the last new config
+        self.last_evicted = []
+
+    @property
+    def alphas(self):
+        return self._alphas[:self.n_configs]
+
+    @property
+    def betas(self):
+        return self._betas[:self.n_configs]
+
+    @property
+    def means(self):
+        return self._means[:self.n_configs]
+
+    @property
+    def active(self):
+        return self._active[:self.n_configs]
+
+    @property
+    def arms(self):
+        return self._arms[:self.n_configs]
+
+    @property
+    def configs(self):
+        """ Id -> tuple of arms, empty tuple for free ids.
+        """
+        if self._configs is None:
+            arms = self._arms[:self.n_configs]
+            lengths = (arms >= 0).sum(axis=1)
+            if (lengths == arms.shape[1]).all():
+                # columns are converted at once, tuples are made by zip
+                self._configs = list(zip(*arms.T.tolist()))
+            else:
+                self._configs = [tuple(row[:length]) for row, length in zip(arms.tolist(), lengths.tolist())]
+
+        return self._configs
+
+    @property
+    def ids(self):
+        """ Tuple of arms -> id of registered configs.
+        """
+        if self._ids is None:
+            self._ids = dict(zip(self.configs, range(self.n_configs)))
+            self._ids.pop((), None)
+
+        return self._ids
+
+    @property
+    def by_arm(self):
+        """ Arm -> set of ids of configs containing it.
+        """
+        if self._by_arm is None:
+            arms = self._arms[:self.n_configs]
+            present = arms >= 0
+            config_ids, _ = np.nonzero(present)
+            flat_arms = arms[present]
+            order = np.argsort(flat_arms, kind='stable')
+            arm_values, starts = np.unique(flat_arms[order], return_index=True)
+            self._by_arm = dict(zip(arm_values.tolist(),
+                                    [set(group.tolist()) for group in np.split(config_ids[order], starts[1:])]))
+
+        return self._by_arm
+
+    def __len__(self):
+        return self.n_configs - len(self.free)
+
+    def _grow(self, depth):
+        """ Enlarge arrays to fit one more config of the given depth.
+        :param depth:
+        :return:
+        """
+        capacity = len(self._alphas)
+        if self.n_configs == capacity and len(self.free) == 0:
+            self._alphas = np.concatenate([self._alphas, np.ones(capacity)])
+            self._betas = np.concatenate([self._betas, np.ones(capacity)])
+            self._means = np.concatenate([self._means, np.full(capacity, 0.5)])
+            self._active = np.concatenate([self._active, np.zeros(capacity, dtype=bool)])
+            self._versions = np.concatenate([self._versions, np.zeros(capacity, dtype=np.int64)])
+            self._blocked = np.concatenate([self._blocked, np.zeros(capacity, dtype=np.int64)])
+            self._arms = np.concatenate([self._arms, np.full_like(self._arms, -1)])
+            self._last_used = np.concatenate([self._last_used, np.zeros(capacity, dtype=np.int64)])
+            self._paid = np.concatenate([self._paid, np.zeros(capacity)])
+            self._discounted = np.concatenate([self._discounted, np.zeros(capacity, dtype=np.int64)])
+
+        if depth > self._arms.shape[1]:
+            padding = np.full((len(self._arms), depth - self._arms.shape[1]), -1, dtype=np.int64)
+            self._arms = np.concatenate([self._arms, padding], axis=1)
+
+    def intern(self, arms):
+        """ Return id of the config, register it if it is new.
+
+        New config is active unless it contains an exhausted arm.
+        If the pool is full, some configs are evicted first.
+
+        :param arms: sequence of arms
+        :return: config id
+        """
+        config = tuple(int(a) for a in arms)
+        config_id = self.ids.get(config)
+        if config_id is None:
+            self.last_evicted = []
+            if self.max_configs is not None and len(self) >= self.max_configs:
+                victims = self.evict(len(self) - self.max_configs + max(1, int(self.max_configs * self.evict_fraction)))
+                self.last_evicted = list(zip(self.free[len(self.free) - len(victims):], victims))
+
+            self._grow(len(config))
+
+            if len(self.free) > 0:
+                config_id = self.free.pop()
+                self.configs[config_id] = config
+            else:
+                config_id = self.n_configs
+                self.configs.append(config)
+                self.n_configs += 1
+
+            self.ids[config] = config_id
+            self._arms[config_id, :len(config)] = config
+            self._last_used[config_id] = self.clock
+            self._discounted[config_id] = self.clock
+            self.n_admitted += 1
+
+            alpha_beta = self.evicted.pop(config, None)
+            if alpha_beta is not None:
+                self._alphas[config_id], self._betas[config_id] = alpha_beta
+                self._means[config_id] = alpha_beta[0] / (alpha_beta[0] + alpha_beta[1])
+                self._paid[config_id] = alpha_beta[0] + alpha_beta[1] - 2
+
+            for arm in config:
+                if self._by_arm is not None:
+                    self._by_arm.setdefault(arm, set()).add(config_id)
+                if arm in self.exhausted:
+                    self._blocked[config_id] += 1
+
+            if self._blocked[config_id] == 0:
+                self.activate(config_id)
+
+            self._rank(config_id)
+
+        return config_id
+
+    def load(self, arms, alphas, betas, last_used=None, paid=None, discounted=None):
+        """ Fill empty registry with configs and their statistics at once, ids are given in order.
+
+        Only arrays are filled: tuples of configs, ids, the arm index and the TOP heap are built in bulk
+        when they are used first.
+
+        :param arms: n x depth arms of configs padded with -1, rows without arms are free ids
+        :param alphas:
+        :param betas:
+        :param last_used: clock value of the last payment of each config, 0 if None
+        :param paid: payments of each config, alphas + betas - 2 if None
+        :param discounted: clock value evidence of each config is discounted up to, last_used if None
+        :return:
+        """
+        arms = np.asarray(arms, dtype=np.int64)
+        n_configs = len(arms)
+        depth = max(arms.shape[1], 1) if arms.ndim == 2 else 1
+        capacity = max(64, 1 << int(np.ceil(np.log2(max(n_configs, 1)))))
+
+        self._alphas = np.ones(capacity)
+        self._betas = np.ones(capacity)
+        self._alphas[:n_configs] = alphas
+        self._betas[:n_configs] = betas
+        self._means = np.full(capacity, 0.5)
+        self._means[:n_configs] = self._alphas[:n_configs] / (self._alphas[:n_configs] + self._betas[:n_configs])
+        self._active = np.zeros(capacity, dtype=bool)
+        self._versions = np.zeros(capacity, dtype=np.int64)
+        self._blocked = np.zeros(capacity, dtype=np.int64)
+        self._arms = np.full((capacity, depth), -1, dtype=np.int64)
+        self._arms[:n_configs, :arms.shape[1]] = arms
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        if last_used is not None:
+            self._last_used[:n_configs] = last_used
+        self._paid = np.zeros(capacity)
+        self._paid[:n_configs] = paid if paid is not None else self._alphas[:n_configs] + self._betas[:n_configs] - 2
+        self._discounted = self._last_used.copy()
+        if discounted is not None:
+            self._discounted[:n_configs] = discounted
+
+        self.n_configs = n_configs
+        self._configs = None
+        self._ids = None
+        # inverted index is needed only when an arm is blocked or unblocked
+        self._by_arm = None
+        self._heap = None
+
+        # rows without arms are free ids of evicted configs
+        free = arms[:, 0] < 0 if arms.ndim == 2 and arms.shape[1] > 0 else np.ones(n_configs, dtype=bool)
+        self.free = np.flatnonzero(free).tolist()
+        self.n_admitted = n_configs - len(self.free)
+
+        if len(self.exhausted) > 0:
+            self._blocked[:n_configs] = np.isin(arms, list(self.exhausted)).sum(axis=1)
+        self._active[:n_configs] = (self._blocked[:n_configs] == 0) & ~free
+
+        payments = np.where(free, -1, self._paid[:n_configs])
+        n_most_paid = min(self.n_most_paid, len(self))
+        candidates = np.arange(n_configs)
+        if n_most_paid < n_configs:
+            # configs paid as many times as the n-th most paid one, ties are taken by id
+            threshold = np.partition(payments, n_configs - n_most_paid)[n_configs - n_most_paid]
+            candidates = np.flatnonzero(payments >= threshold)
+        order = np.argsort(-payments[candidates], kind='stable')
+        self.most_paid = candidates[order][:n_most_paid].tolist()
+
+    def update(self, config_id: int, reward: int):
+        """ Update alpha, beta and mean of the config.
+
+        :param config_id:
+        :param reward:
+        :return:
+        """
+        self.clock += 1
+        self._last_used[config_id] = self.clock
+        if self.gamma is not None:
+            self._discount(config_id)
+        self._discounted[config_id] = self.clock
+
+        self._alphas[config_id] += reward
+        self._betas[config_id] += 1 - reward
+        self._means[config_id] = self._alphas[config_id] / (self._alphas[config_id] + self._betas[config_id])
+        self._paid[config_id] += 1
+
+        if self._active[config_id]:
+            self._push(config_id)
+
+        self._rank(config_id)
+
+    def update_many(self, config_ids, rewards):
+        """ Update statistics of many payments at once, a config may be paid several times.
+
+        :param config_ids: sequence of config ids
+        :param rewards: sequence of rewards
+        :return:
+        """
+        config_ids = np.asarray(config_ids, dtype=np.int64)
+        rewards = np.asarray(rewards, dtype=np.int64)
+        changed = np.unique(config_ids)
+
+        # payments of the batch are made at once, evidence before them is discounted up to their end
+        self.clock += len(config_ids)
+        self._last_used[changed] = self.clock
+        if self.gamma is not None:
+            self._discount(changed)
+        self._discounted[changed] = self.clock
+
+        np.add.at(self._alphas, config_ids, rewards)
+        np.add.at(self._betas, config_ids, 1 - rewards)
+        np.add.at(self._paid, config_ids, 1)
+        self._means[changed] = self._alphas[changed] / (self._alphas[changed] + self._betas[changed])
+
+        for config_id in changed.tolist():
+            if self._active[config_id]:
+                self._push(config_id)
+            self._rank(config_id)
+
+    def _discount(self, config_ids):
+        """ Bring discounted evidence of configs to the current clock.
+
+        :param config_ids: id or array of ids
+        :return:
+        """
+        factor = self.gamma ** (self.clock - self._discounted[config_ids])
+        self._alphas[config_ids] = 1 + (self._alphas[config_ids] - 1) * factor
+        self._betas[config_ids] = 1 + (self._betas[config_ids] - 1) * factor
+        self._means[config_ids] = self._alphas[config_ids] / (self._alphas[config_ids] + self._betas[config_ids])
+        self._discounted[config_ids] = self.clock
+
+    def posterior(self, config_ids):
+        """ Alphas and betas of configs to sample from, evidence is discounted up to now.
+
+        :param config_ids: array of ids
+        :return:
+        """
+        alphas = self._alphas[config_ids]
+        betas = self._betas[config_ids]
+        if self.gamma is not None:
+            factor = self.gamma ** (self.clock - self._discounted[config_ids])
+            alphas = 1 + (alphas - 1) * factor
+            betas = 1 + (betas - 1) * factor
+
+        return alphas, betas
+
+    def discounted_means(self, config_ids):
+        """ Means of configs with evidence discounted up to now, same as means if evidence is kept forever.
+
+        :param config_ids: array of ids
+        :return:
+        """
+        if self.gamma is None:
+            return self._means[config_ids]
+
+        alphas, betas = self.posterior(config_ids)
+        return alphas / (alphas + betas)
+
+    def activate(self, config_id: int):
+        """ Make config available for choosing.
+
+        :param config_id:
+        :return:
+        """
+        if not self._active[config_id]:
+            self._active[config_id] = True
+            self._push(config_id)
+
+    def deactivate(self, config_id: int):
+        """ Exclude config from choosing, its statistics are kept.
+
+        :param config_id:
+        :return:
+        """
+        if self._active[config_id]:
+            self._active[config_id] = False
+            self._versions[config_id] += 1
+
+    def block_arm(self, arm: int):
+        """ Deactivate all configs containing exhausted arm.
+
+        :param arm:
+        :return:
+        """
+        if arm in self.exhausted:
+            return
+        self.exhausted.add(arm)
+
+        for config_id in self.by_arm.get(arm, ()):
+            self._blocked[config_id] += 1
+            if self._blocked[config_id] == 1:
+                self.deactivate(config_id)
+
+    def unblock_arm(self, arm: int):
+        """ Return configs which were deactivated only because of the arm.
+
+        :param arm:
+        :return:
+        """
+        if arm not in self.exhausted:
+            return
+        self.exhausted.remove(arm)
+
+        for config_id in self.by_arm.get(arm, ()):
+            self._blocked[config_id] -= 1
+            if self._blocked[config_id] == 0:
+                self.activate(config_id)
+
+    def evict(self, n: int):
+        """ Remove n configs and free their ids.
+
+        Configs whose posterior hardly reaches the lowest mean of TOP ones are evicted first,
+        then least recently paid ones. TOP and most paid configs are kept.
+
+        :param n:
+        :return: evicted configs
+        """
+        top_ids = self.top(self.protect_top)
+        candidates = np.flatnonzero(self._arms[:self.n_configs, 0] >= 0)
+        candidates = candidates[~np.isin(candidates, top_ids + self.most_paid)]
+        if len(candidates) == 0:
+            return []
+
+        alphas, betas = self.posterior(candidates)
+        total = alphas + betas
+        upper = alphas / total + 2 * np.sqrt(alphas * betas / (total * total * (total + 1)))
+        threshold = self.discounted_means(top_ids).min() if len(top_ids) > 0 else 0.
+        hopeless = upper < threshold
+
+        order = np.lexsort((self._last_used[candidates], ~hopeless))
+        victims = [self.configs[config_id] for config_id in candidates[order[:n]].tolist()]
+        for config in victims:
+            self._remove(self.ids[config])
+
+        return victims
+
+    def _remove(self, config_id: int):
+        """ Free id of the config, its statistics are remembered for admission back.
+
+        :param config_id:
+        :return:
+        """
+        config = self.configs[config_id]
+        del self.ids[config]
+        if self.gamma is not None:
+            self._discount(config_id)
+        self.evicted[config] = (float(self._alphas[config_id]), float(self._betas[config_id]))
+        while len(self.evicted) > (self.max_configs if self.max_configs is not None else len(self)):
+            self.evicted.popitem(last=False)
+
+        if self._by_arm is not None:
+            for arm in config:
+                self._by_arm[arm].discard(config_id)
+
+        self.deactivate(config_id)
+        self.configs[config_id] = ()
+        self._arms[config_id] = -1
+        self._alphas[config_id] = 1.
+        self._betas[config_id] = 1.
+        self._means[config_id] = 0.5
+        self._paid[config_id] = 0
+        self._blocked[config_id] = 0
+        self.free.append(config_id)
+
+    def _push(self, config_id: int):
+        """ Add actual heap entry of the config, rebuild heap if it is mostly made of outdated entries.
+
+        :param config_id:
+        :return:
+        """
+        self._versions[config_id] += 1
+        if self._heap is None:
+            # the heap is built with the current mean later
+            return
+        heappush(self._heap, (-float(self._means[config_id]), int(config_id), int(self._versions[config_id])))
+
+        if len(self._heap) > 2 * self.n_configs + 64:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        # entries sorted by mean and id already form a heap
+        active_ids = np.flatnonzero(self.active)
+        active_ids = active_ids[np.argsort(-self._means[active_ids], kind='stable')]
+        self._heap = list(zip((-self._means[active_ids]).tolist(),
+                              active_ids.tolist(),
+                              self._versions[active_ids].tolist()))
+
+    def _paid_order(self, config_id: int):
+        return -self._paid[config_id], config_id
+
+    def _rank(self, config_id: int):
+        """ Put the config into most paid list if its payment count is high enough.
+
+        :param config_id:
+        :return:
+        """
+        most_paid = self.most_paid
+        if config_id not in most_paid:
+            if len(most_paid) == self.n_most_paid and \
+                    self._paid_order(config_id) > self._paid_order(most_paid[-1]):
+                return
+            most_paid.append(config_id)
+
+        most_paid.sort(key=self._paid_order)
+        del most_paid[self.n_most_paid:]
+
+    def top(self, k: int):
+        """ Return ids of k active configs with highest mean, discounted mean if evidence is discounted.
+
+        Ties are resolved in order of registration.
+
+        :param k:
+        :return:
+        """
+        if self.gamma is not None:
+            active_ids = np.flatnonzero(self.active)
+            means = self.discounted_means(active_ids)
+            if k < len(active_ids):
+                # configs as good as the k-th one, ties are ordered by id below
+                threshold = -np.partition(-means, k - 1)[k - 1]
+                active_ids, means = active_ids[means >= threshold], means[means >= threshold]
+            return active_ids[np.lexsort((active_ids, -means))][:k].tolist()
+
+        if self._heap is None:
+            self._rebuild_heap()
+        heap = self._heap
+        top_entries = []
+        while len(heap) > 0 and len(top_entries) < k:
+            entry = heappop(heap)
+            config_id = entry[1]
+            if not self._active[config_id] or entry[2] != self._versions[config_id]:
+                # outdated entry
+                continue
+            top_entries.append(entry)
+
+        for entry in top_entries:
+            heappush(heap, entry)
+
+        return [entry[1] for entry in top_entries]
+
+    def key(self, config_id: int):
+        """ Display string of the config, e.g. '1 3'.
+
+        :param config_id:
+        :return:
+        """
+        return ' '.join([str(x) for x in self.configs[config_id]])
+
+    def keys(self, config_ids=None):
+        """ Display strings of the configs (all registered configs by default).
+
+        :param config_ids:
+        :return:
+        """
+        if config_ids is None:
+            config_ids = range(self.n_configs)
+        return [self.key(c) for c in config_ids]
@@ -0,0 +1,211 @@
+"""
+Checkpoint and restore of the learned bandit state.
+
+Checkpoint is an uncompressed versioned .npz file, written to a temporary file and atomically renamed.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from environment import TestEnvironment
+
+CHECKPOINT_VERSION = 2
+
+
+def checkpoint_state(env: TestEnvironment):
+    """ Copy full learned state of the environment into arrays.
+
+    Copying is cheap, so it can be done under the lock of a running service and written later.
+
+    :param env:
+    :return: dictionary of arrays
+    """
+    cascades = env.cascades
+    temp_constraints = dict(env.temp_constraints)
+
+    # statistics of evicted configs in order of eviction
+    evicted = list(cascades.evicted.items())
+    evicted_arms = np.full((len(evicted), max([len(config) for config, _ in evicted], default=1)), -1, dtype=np.int64)
+    for row, (config, _) in enumerate(evicted):
+        evicted_arms[row, :len(config)] = config
+    evicted_stats = np.array([alpha_beta for _, alpha_beta in evicted], dtype=float).reshape(-1, 2)
+
+    # forgetting posteriors of strategy steps: class names, then every slot as posterior_<kind>_<i>_<slot>
+    posteriors = {}
+    for kind, kind_posteriors in env.posteriors.items():
+        for i, posterior in enumerate(kind_posteriors):
+            for name in posterior.__slots__:
+                value = getattr(posterior, name)
+                posteriors['posterior_' + kind + '_' + str(i) + '_' + name] = np.array(value, copy=True)
+
+    return {
+        'version': np.array(CHECKPOINT_VERSION),
+        'primary_arms_proba': np.array(env.arms_proba['primary'], dtype=float),
+        'repeated_arms_proba': np.array(env.arms_proba['repeated'], dtype=float),
+        'basic_constraints': np.array(env.basic_constraints),
+        'failure': np.array(env.failure),
+        'constraints': env.constraints.copy(),
+        'primary_alphas': env.primary_alphas.copy(),
+        'primary_betas': env.primary_betas.copy(),
+        'repeated_alphas': env.repeated_alphas.copy(),
+        'repeated_betas': env.repeated_betas.copy(),
+        'counters': env.counts.copy(),
+        'temp_arms': np.array(list(temp_constraints.keys()), dtype=np.int64),
+        'temp_constraints': np.array(list(temp_constraints.values()), dtype=np.int64),
+        'temp_iteration': np.array(env.temp_iteration),
+        'cascade_arms': cascades.arms.copy(),
+        'cascade_alphas': cascades.alphas.copy(),
+        'cascade_betas': cascades.betas.copy(),
+        # -1 if the pool is not bounded
+        'max_configs': np.array(env.max_configs if env.max_configs is not None else -1),
+        'cascade_clock': np.array(cascades.clock),
+        'cascade_last_used': cascades._last_used[:cascades.n_configs].copy(),
+        'cascade_paid': cascades._paid[:cascades.n_configs].copy(),
+        'cascade_discounted': cascades._discounted[:cascades.n_configs].copy(),
+        # nan if evidence is not discounted
+        'cascade_gamma': np.array(env.cascade_gamma if env.cascade_gamma is not None else np.nan),
+        'cascade_free': np.array(cascades.free, dtype=np.int64),
+        'evicted_arms': evicted_arms,
+        'evicted_alphas': evicted_stats[:, 0],
+        'evicted_betas': evicted_stats[:, 1],
+        'rng_state': np.array(json.dumps(env.rng.bit_generator.state)),
+        # values drawn from the generator in blocks and not used yet
+        'uniforms': np.array(env.uniforms.remaining(), dtype=float),
+        'repeated_numbers': np.array(env.repeated_numbers.remaining(), dtype=np.int64),
+        'posterior_classes': np.array(json.dumps({kind: [type(posterior).__name__ for posterior in kind_posteriors]
+                                                  for kind, kind_posteriors in env.posteriors.items()})),
+        **posteriors,
+    }
+
+
+def write_checkpoint(state: dict, path):
+    """ Write state made by checkpoint_state.
+
+    :param state:
+    :param path: .npz file
+    :return:
+    """
+    temp_path = str(path) + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.savez(file, **state)
+    os.replace(temp_path, path)
+
+
+def save_checkpoint(env: TestEnvironment, path):
+    write_checkpoint(checkpoint_state(env), path)
+
+
+def load_checkpoint(path, rng=None):
+    """ Make environment with learned state from checkpoint.
+
+    :param path: .npz file
+    :param rng: generator for the restored environment, saved generator state and values drawn
+        from it are used by default, so the restored run continues exactly as the saved one would
+    :return: TestEnvironment, saved forgetting posteriors are given to posteriors added to it,
+        see TestEnvironment.add_posterior
+    """
+    with np.load(path) as data:
+        state = {key: data[key] for key in data.files}
+
+    version = int(state['version'])
+    if version != CHECKPOINT_VERSION:
+        raise ValueError('Unsupported checkpoint version: ' + str(version))
+
+    max_configs = int(state['max_configs'])
+    cascade_gamma = float(state['cascade_gamma'])
+    env = TestEnvironment(state['primary_arms_proba'].tolist(),
+                          state['repeated_arms_proba'].tolist(),
+                          state['basic_constraints'].tolist(),
+                          failure=bool(state['failure']),
+                          rng=rng,
+                          max_configs=max_configs if max_configs >= 0 else None,
+                          cascade_gamma=cascade_gamma if not np.isnan(cascade_gamma) else None)
+    if rng is None:
+        env.rng.bit_generator.state = json.loads(str(state['rng_state']))
+        env.uniforms.restore(state['uniforms'].tolist())
+        env.repeated_numbers.restore(state['repeated_numbers'].tolist())
+
+    env.primary_alphas = state['primary_alphas']
+    env.primary_betas = state['primary_betas']
+    env.repeated_alphas = state['repeated_alphas']
+    env.repeated_betas = state['repeated_betas']
+
+    env.counts[:] = state['counters']
+
+    env.temp_constraints = dict(zip(state['temp_arms'].tolist(), state['temp_constraints'].tolist()))
+    env.temp_iteration = int(state['temp_iteration'])
+
+    env.constraints = state['constraints']
+    env.block_exhausted_arms()
+    cascades = env.cascades
+    cascades.load(state['cascade_arms'], state['cascade_alphas'], state['cascade_betas'],
+                  last_used=state['cascade_last_used'],
+                  paid=state['cascade_paid'],
+                  discounted=state['cascade_discounted'])
+    cascades.clock = int(state['cascade_clock'])
+    # free ids are reused in the saved order
+    cascades.free = state['cascade_free'].tolist()
+
+    evicted_arms = state['evicted_arms'].tolist()
+    for arms, alpha, beta in zip(evicted_arms, state['evicted_alphas'].tolist(), state['evicted_betas'].tolist()):
+        cascades.evicted[tuple(arm for arm in arms if arm >= 0)] = (alpha, beta)
+
+    for kind, class_names in json.loads(str(state['posterior_classes'])).items():
+        for i, class_name in enumerate(class_names):
+            prefix = 'posterior_' + kind + '_' + str(i) + '_'
+            posterior_state = {key[len(prefix):]: state[key] if state[key].ndim > 0 else state[key].item()
+                               for key in state if key.startswith(prefix)}
+            env.restored_posteriors[kind].append((class_name, posterior_state))
+
+    return env
+
+
+class Checkpointer:
+    """ Save checkpoints periodically in a background thread.
+
+    Only copying of the state is done under the lock, writing to disk does not stall decisions.
+    """
+
+    def __init__(self, env: TestEnvironment, path, interval=60., lock=None):
+        """
+        :param env:
+        :param path: .npz file
+        :param interval: seconds between checkpoints
+        :param lock: lock guarding env updates, e.g. ConcurrentRoutingService.lock
+        """
+        self.env = env
+        self.path = path
+        self.interval = interval
+        self.lock = lock
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the thread and save the last checkpoint, nothing is done if the thread was not started.
+        :return:
+        """
+        if self._thread.ident is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self.checkpoint()
+
+    def checkpoint(self):
+        if self.lock is not None:
+            with self.lock:
+                state = checkpoint_state(self.env)
+        else:
+            state = checkpoint_state(self.env)
+        write_checkpoint(state, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.checkpoint()
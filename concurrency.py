@@ -0,0 +1,189 @@
+"""
+Routing service shared by many worker threads.
+"""
+
+import queue
+import threading
+
+import numpy as np
+
+from bandit import Strategy
+from service import RoutingService
+
+
+class ConcurrentRoutingService(RoutingService):
+    """ Thread-safe RoutingService.
+
+    A decision atomically reserves one unit of capacity on every arm of the chosen cascade, so capacity
+    is never oversold. Capacity is consumed as by TestEnvironment.play_cascade and RoutingService.report:
+    success at the first step keeps the reservation of the first arm, success at a later step consumes
+    nothing, so the same feedback leaves the same capacity whichever service applies it. Other reservations
+    are returned when the cascade is finished. Repeated payments reserve capacity with reserve_repeated
+    before they are made.
+
+    Feedback is queued without locking and committed to the environment in batches.
+    """
+
+    def __init__(self, strategy: Strategy, batch_size=64):
+        super().__init__(strategy)
+
+        self.batch_size = batch_size
+
+        self.lock = threading.Lock()
+        self.feedback = queue.SimpleQueue()
+
+        # capacity consumed by successful payments of each arm
+        self.consumed = np.zeros(self.env.n_arms, dtype=np.int64)
+
+    def _reserve(self, arm: int):
+        self.env.set_constraint(arm, self.env.constraints[arm] - 1)
+
+    def _release(self, arm: int):
+        self.env.set_constraint(arm, self.env.constraints[arm] + 1)
+
+    def decide(self, request_id):
+        """ Choose cascade for payment and reserve capacity of its arms.
+
+        :param request_id:
+        :return: tuple of arms to try one by one or None if there is no cascade available
+        """
+        with self.lock:
+            config_id = self.strategy.choose_cascade()
+            if config_id is None:
+                return None
+
+            arm_list = self.env.cascades.configs[config_id]
+            # all arms of an available cascade have capacity
+            for arm in arm_list:
+                self._reserve(arm)
+            self.pending[request_id] = arm_list
+
+        return arm_list
+
+    def decide_batch(self, request_ids):
+        """ Choose cascades for a micro-batch of payments and reserve capacity of their arms.
+
+        :param request_ids:
+        :return: list of tuples of arms, None for payments without available cascade
+        """
+        with self.lock:
+            cascades = super().decide_batch(request_ids)
+            # every arm of the chosen cascades has a unit left for the payment, see _choose_batch
+            arms = [arm for arm_list in cascades if arm_list is not None for arm in arm_list]
+            reserved = np.bincount(np.array(arms, dtype=np.int64), minlength=self.env.n_arms)
+            for arm in np.flatnonzero(reserved):
+                self.env.set_constraint(arm, self.env.constraints[arm] - reserved[arm])
+
+        return cascades
+
+    def _choose_batch(self, n: int):
+        # capacity of every arm is reserved until feedback, so the batch must fit it on every arm
+        return self.strategy.choose_cascades(n, reserve_all=True)
+
+    def report_batch(self, request_ids, steps, rewards):
+        """ Queue results of many cascade steps.
+
+        :param request_ids:
+        :param steps:
+        :param rewards:
+        :return:
+        """
+        for result in zip(request_ids, steps, rewards):
+            self.feedback.put(result)
+        if self.feedback.qsize() >= self.batch_size:
+            self.commit(blocking=False)
+
+    def report_repeated_batch(self, arms, rewards):
+        """ Queue results of many repeated payments reserved with reserve_repeated.
+
+        :param arms:
+        :param rewards:
+        :return:
+        """
+        for arm, reward in zip(arms, rewards):
+            self.report_repeated(arm, reward)
+
+    def reserve_repeated(self, arm: int):
+        """ Reserve capacity for a repeated payment.
+
+        :param arm:
+        :return: False if the arm has no capacity left and payment should not be made
+        """
+        with self.lock:
+            if self.env.constraints[arm] <= 0:
+                return False
+            self._reserve(arm)
+
+        return True
+
+    def report(self, request_id, step: int, reward: int):
+        """ Queue result of a cascade step.
+
+        :param request_id:
+        :param step: position of arm in the cascade
+        :param reward:
+        :return:
+        """
+        self.feedback.put((request_id, step, reward))
+        if self.feedback.qsize() >= self.batch_size:
+            self.commit(blocking=False)
+
+    def report_repeated(self, arm: int, reward: int):
+        """ Queue result of a repeated payment reserved with reserve_repeated.
+
+        :param arm:
+        :param reward:
+        :return:
+        """
+        self.feedback.put((None, arm, reward))
+        if self.feedback.qsize() >= self.batch_size:
+            self.commit(blocking=False)
+
+    def commit(self, blocking=True):
+        """ Apply all queued feedback.
+
+        :param blocking: wait for the lock, otherwise return if another thread holds it
+        :return: number of applied results
+        """
+        if not self.lock.acquire(blocking):
+            return 0
+
+        n_applied = 0
+        try:
+            while True:
+                try:
+                    request_id, step, reward = self.feedback.get_nowait()
+                except queue.Empty:
+                    break
+
+                if request_id is None:
+                    self._apply_repeated(step, reward)
+                else:
+                    self._apply(request_id, step, reward)
+                n_applied += 1
+        finally:
+            self.lock.release()
+
+        return n_applied
+
+    def _apply(self, request_id, step: int, reward: int):
+        arm_list = self.pending[request_id]
+
+        if step == 0:
+            self.env.update_primary_reward(arm_list[0], reward, consume=False)
+
+        if reward == 1 or step == len(arm_list) - 1:
+            del self.pending[request_id]
+            for position, arm in enumerate(arm_list):
+                if reward == 1 and position == step == 0:
+                    self.consumed[arm] += 1
+                else:
+                    self._release(arm)
+            self.env.update_cascade_reward(self.env.update_cascade_config(arm_list), reward)
+
+    def _apply_repeated(self, arm: int, reward: int):
+        self.env.update_repeated_reward(arm, reward, consume=False)
+        if reward == 1:
+            self.consumed[arm] += 1
+        else:
+            self._release(arm)
@@ -3,38 +3,148 @@ Module for communication with environment.
 Also designed to test the model.
 """
 
-from random import random, choice
+from time import perf_counter
+
 import numpy as np
 
+from cascades import CascadeRegistry
+
+
+class RandomBlocks:
+    """ Endless stream of random scalars drawn in blocks, take values with next().
+
+    Values of the current block not taken yet are part of the random state, see checkpoint.
+    """
+
+    __slots__ = ('sample', 'block_size', 'values', 'position')
+
+    def __init__(self, sample, block_size=4096):
+        """
+        :param sample: function of size returning array of random values
+        :param block_size:
+        """
+        self.sample = sample
+        self.block_size = block_size
+        self.values = []
+        self.position = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        position = self.position
+        if position == len(self.values):
+            self.values = self.sample(self.block_size).tolist()
+            position = 0
+        self.position = position + 1
+        return self.values[position]
+
+    def remaining(self):
+        """ Drawn values not taken yet.
+        :return:
+        """
+        return self.values[self.position:]
+
+    def restore(self, values):
+        """ Continue with the given drawn values, next block is drawn after them.
+
+        :param values:
+        :return:
+        """
+        self.values = list(values)
+        self.position = 0
+
+
+# payment counters of the environment, positions in TestEnvironment.counts
+COUNTERS = ('n_payments', 'n_success',
+            'n_primary_payments', 'n_primary_success',
+            'n_repeated_payments', 'n_repeated_success',
+            'n_cascade_payments', 'n_cascade_success')
+(N_PAYMENTS, N_SUCCESS,
+ N_PRIMARY_PAYMENTS, N_PRIMARY_SUCCESS,
+ N_REPEATED_PAYMENTS, N_REPEATED_SUCCESS,
+ N_CASCADE_PAYMENTS, N_CASCADE_SUCCESS) = range(len(COUNTERS))
+
+
+def _deltas(payments, successes):
+    """ Change of counters made by a failed (row 0) and a successful (row 1) payment.
+    """
+    deltas = np.zeros((2, len(COUNTERS)), dtype=np.int64)
+    deltas[:, payments] = 1
+    deltas[1, successes] = 1
+    return deltas
+
+
+PRIMARY_DELTAS = _deltas([N_PRIMARY_PAYMENTS], [N_PRIMARY_SUCCESS])
+REPEATED_DELTAS = _deltas([N_REPEATED_PAYMENTS, N_PAYMENTS], [N_REPEATED_SUCCESS, N_SUCCESS])
+CASCADE_DELTAS = _deltas([N_CASCADE_PAYMENTS, N_PAYMENTS], [N_CASCADE_SUCCESS, N_SUCCESS])
+
+
+def _counter(index):
+    """ Attribute view of one position of TestEnvironment.counts.
+    """
+    def get(self):
+        return int(self.counts[index])
+
+    def set(self, value):
+        self.counts[index] = value
+
+    return property(get, set)
+
 
 class TestEnvironment:
     """ Save and update all information about environment.
+
+    Payment counters are kept in one preallocated vector, a payment adds a precomputed row to it,
+    so updates make no Python objects which outlive them.
     """
 
-    def __init__(self, primary_arms_proba: list, repeated_arms_proba: list, constraints: list, failure = False):
+    __slots__ = ('n_arms', 'rng', 'uniforms', 'repeated_numbers', 'arms_proba', 'proba_version',
+                 'basic_constraints', 'failure', 'event_log', 'instruments', 'counts',
+                 'constraints', 'temp_constraints', 'temp_iteration',
+                 'primary_alphas', 'primary_betas', 'repeated_alphas', 'repeated_betas',
+                 'posteriors', 'restored_posteriors', 'max_configs', 'cascade_gamma', 'cascades')
+
+    n_payments = _counter(N_PAYMENTS)
+    n_success = _counter(N_SUCCESS)
+
+    n_primary_payments = _counter(N_PRIMARY_PAYMENTS)
+    n_primary_success = _counter(N_PRIMARY_SUCCESS)
+
+    n_repeated_payments = _counter(N_REPEATED_PAYMENTS)
+    n_repeated_success = _counter(N_REPEATED_SUCCESS)
+
+    n_cascade_payments = _counter(N_CASCADE_PAYMENTS)
+    n_cascade_success = _counter(N_CASCADE_SUCCESS)
+
+    def __init__(self, primary_arms_proba: list, repeated_arms_proba: list, constraints: list, failure = False,
+                 rng=None, max_configs=None, cascade_gamma=None):
 
         self.n_arms = len(primary_arms_proba)
 
+        # seed, SeedSequence or numpy Generator, all randomness of environment is drawn from it
+        self.rng = np.random.default_rng(rng)
+        self.uniforms = RandomBlocks(self.rng.random)
+        self.repeated_numbers = RandomBlocks(lambda size: self.rng.gamma(1, 2, size).astype(np.int64))
+
         # test environment parameters
         self.arms_proba = {'primary': primary_arms_proba,
                            'repeated': repeated_arms_proba}
+        # incremented on every change of arms_proba, see set_arm_proba
+        self.proba_version = 0
         self.basic_constraints = constraints
 
         self.failure = failure
 
-        self.n_payments = 0
-        self.n_success = 0
-
-        self.n_primary_payments = 0
-        self.n_primary_success = 0
+        # EventLog receiving every decision and reward
+        self.event_log = None
 
-        self.n_repeated_payments = 0
-        self.n_repeated_success = 0
+        # instrumentation.Instruments measuring hot path, nothing is measured if None
+        self.instruments = None
 
-        self.n_cascade_payments = 0
-        self.n_cascade_success = 0
+        self.counts = np.zeros(len(COUNTERS), dtype=np.int64)
 
-        self.constraints = self.basic_constraints
+        self.constraints = np.array(self.basic_constraints)
         self.temp_constraints = {}
         self.temp_iteration = 0
 
@@ -45,30 +155,26 @@ class TestEnvironment:
         self.repeated_alphas = np.ones(self.n_arms)
         self.repeated_betas = np.ones(self.n_arms)
 
-        self.cascade_config = []
-        self.historical_cascade_config = []
+        # forgetting posteriors of strategy steps updated along with alphas and betas, see add_posterior
+        self.posteriors = {'primary': [], 'repeated': []}
+        # saved states of posteriors of a checkpoint, given to posteriors added after restore
+        self.restored_posteriors = {'primary': [], 'repeated': []}
 
-        self.cascade_alphas = {}
-        self.cascade_betas = {}
-        self.cascade_mean = {}
+        # cascade configs played, active ones are available for choosing,
+        # at most max_configs are kept if it is given, evidence of configs is discounted by cascade_gamma
+        # at every cascade payment if it is given, e.g. to forget as fast as forgetting.DiscountedBeta steps
+        self.max_configs = max_configs
+        self.cascade_gamma = cascade_gamma
+        self.cascades = CascadeRegistry(max_configs=max_configs, gamma=cascade_gamma)
+        self.block_exhausted_arms()
 
     def flush(self):
         """Set to zero."""
 
         # test environment parameters
-        self.n_payments = 0
-        self.n_success = 0
-
-        self.n_primary_payments = 0
-        self.n_primary_success = 0
-
-        self.n_repeated_payments = 0
-        self.n_repeated_success = 0
+        self.counts[:] = 0
 
-        self.n_cascade_payments = 0
-        self.n_cascade_success = 0
-
-        self.constraints = self.basic_constraints
+        self.constraints = np.array(self.basic_constraints)
         self.temp_constraints = []
 
         # real environment parameters
@@ -78,10 +184,90 @@ class TestEnvironment:
         self.repeated_alphas = np.ones(self.n_arms)
         self.repeated_betas = np.ones(self.n_arms)
 
-        self.cascade_config = []
-        self.cascade_alphas = {}
-        self.cascade_betas = {}
-        self.cascade_mean = {}
+        self.cascades = CascadeRegistry(max_configs=self.max_configs, gamma=self.cascade_gamma)
+        self.block_exhausted_arms()
+
+    def block_exhausted_arms(self):
+        """ Mark arms without capacity in cascade registry.
+        :return:
+        """
+        for arm in np.flatnonzero(self.constraints <= 0):
+            self.cascades.block_arm(int(arm))
+
+    def set_constraint(self, arm: int, value):
+        """ Change arm capacity.
+
+        Cascades with the arm are excluded from choosing when capacity is over and returned when it is restored.
+
+        :param arm:
+        :param value:
+        :return:
+        """
+        was_available = self.constraints[arm] > 0
+        self.constraints[arm] = value
+
+        if was_available and value <= 0:
+            self.cascades.block_arm(int(arm))
+        elif not was_available and value > 0:
+            self.cascades.unblock_arm(int(arm))
+
+    def set_arm_proba(self, kind: str, arm: int, proba: float):
+        """ Change success probability of the arm.
+
+        :param kind: 'primary' or 'repeated'
+        :param arm:
+        :param proba:
+        :return:
+        """
+        self.arms_proba[kind][arm] = proba
+        self.proba_version += 1
+
+    def attach_event_log(self, event_log):
+        """ Start logging decisions and rewards.
+
+        Current constraints and cascade configs are logged first, so an event log attached
+        to a new environment is enough to replay it.
+
+        :param event_log: eventlog.EventLog
+        :return:
+        """
+        self.event_log = event_log
+        for arm in range(self.n_arms):
+            event_log.constraint(self.n_cascade_payments, arm, int(self.constraints[arm]))
+        for config_id, arm_list in enumerate(self.cascades.configs):
+            event_log.register(self.n_cascade_payments, config_id, arm_list)
+
+    def attach_instruments(self, instruments):
+        """ Start counting payments and timing cascade steps.
+
+        Strategy choosing cascades at the environment is measured too.
+
+        :param instruments: instrumentation.Instruments, None to stop measuring
+        :return:
+        """
+        self.instruments = instruments
+
+    def add_posterior(self, kind: str, posterior):
+        """ Update the posterior on every primary or repeated payment.
+
+        Posterior added to environment loaded from checkpoint takes the next saved state of its kind.
+
+        :param kind: 'primary' or 'repeated'
+        :param posterior: object with update(arm, reward), e.g. forgetting.DiscountedBeta
+        :return:
+        """
+        if posterior in self.posteriors[kind]:
+            return
+
+        if self.restored_posteriors[kind]:
+            class_name, state = self.restored_posteriors[kind].pop(0)
+            if type(posterior).__name__ != class_name:
+                raise ValueError('Saved ' + kind + ' posterior is ' + class_name + ', not ' + type(posterior).__name__)
+            for name, value in state.items():
+                setattr(posterior, name, value)
+
+        self.posteriors[kind].append(posterior)
+
 
     def get_bank_list(self):
         """ Get list of banks for malfunction_generator.
@@ -95,7 +281,7 @@ class TestEnvironment:
         """
         bank_list = self.get_bank_list()
         if self.n_cascade_payments == 139  and len(bank_list) > 1:
-            bank = choice(bank_list)
+            bank = bank_list[self.rng.integers(len(bank_list))]
             return bank, self.n_cascade_payments
         return None, None
 
@@ -107,7 +293,9 @@ class TestEnvironment:
         if bank is not None:
             self.temp_constraints = {bank: self.constraints[bank]}
             self.temp_iteration = iteration + 40
-            self.constraints[bank] = -100
+            self.set_constraint(bank, -100)
+            if self.event_log is not None:
+                self.event_log.constraint(self.n_cascade_payments, bank, -100)
             return 'Bank ' + str(bank) + ' was deleted at ' + str(iteration) + ' iteration!'
 
         return None
@@ -119,7 +307,9 @@ class TestEnvironment:
         if self.n_cascade_payments == self.temp_iteration and len(self.temp_constraints) > 0:
             bank, constraint = self.temp_constraints.popitem()
             self.temp_iteration = 0
-            self.constraints[bank] = constraint
+            self.set_constraint(bank, constraint)
+            if self.event_log is not None:
+                self.event_log.constraint(self.n_cascade_payments, bank, int(constraint))
             return 'Bank ' + str(bank) + ' was returned at ' + str(self.n_cascade_payments) + ' iteration!'
 
         return None
@@ -130,147 +320,288 @@ class TestEnvironment:
         Return feedback from automate {0,1}.
         """
 
-        if random() < probability:
+        if next(self.uniforms) < probability:
             return 1
         else:
             return 0
 
-    def update_cascade_mean(self, config):
-        self.cascade_mean.update({
-            config: self.cascade_alphas[config]/(self.cascade_alphas[config]+ self.cascade_betas[config])
-        })
+    def get_cascade_mean(self, k=None):
+        """ Return ids of available cascades sorted by mean of the beta distribution.
 
-    def get_cascade_mean(self):
-        """ Return dictionary of sorted cascade means filtered by cascade_list.
-
-        :param cascade_list:
+        :param k: return only TOP-k cascades, found without sorting all of them
         :return:
         """
+        if k is not None:
+            return np.array(self.cascades.top(k), dtype=np.int64)
 
-        cascade_mean_dict = self.cascade_mean
         cascade_list = self.get_cascade_config()
+        order = np.argsort(-self.cascades.discounted_means(cascade_list), kind='stable')
 
-        filtered_cascade_mean_dict = {k: v for k, v in cascade_mean_dict.items() if k in cascade_list}
-
-        sorted_cascade_list = sorted(filtered_cascade_mean_dict,
-                                          key=filtered_cascade_mean_dict.__getitem__,
-                                          reverse=True)
+        return cascade_list[order]
 
-        return sorted_cascade_list
+    def update_cascade_config(self, arm_list):
+        """ Register cascade config.
 
-    def update_cascade_config(self, config: str):
-        if config not in self.cascade_config:
-            self.cascade_config.append(config)
-            self.historical_cascade_config.append(config)
-            self.cascade_alphas.update({config: 1})
-            self.cascade_betas.update({config: 1})
-            self.update_cascade_mean(config)
+        :param arm_list: sequence of arms
+        :return: config id
+        """
+        cascades = self.cascades
+        n_admitted = cascades.n_admitted
+        config_id = cascades.intern(arm_list)
+        if self.event_log is not None and cascades.n_admitted > n_admitted:
+            iteration = self.n_cascade_payments
+            for evicted_id, _ in cascades.last_evicted:
+                self.event_log.evict(iteration, evicted_id)
+            self.event_log.register(iteration, config_id, cascades.configs[config_id])
+
+            # config admitted back starts with statistics remembered at its eviction
+            alpha, beta = cascades.alphas[config_id], cascades.betas[config_id]
+            if alpha != 1 or beta != 1:
+                self.event_log.admit(iteration, config_id, int(round(alpha - 1)), int(round(beta - 1)))
+
+        return config_id
 
     def get_cascade_config(self):
-        """ Return cascade config filtered by constraints
+        """ Return ids of cascade configs filtered by constraints
 
         :return:
         """
-        print(self.cascade_config)
-        cascade_list = self.cascade_config
-        for cascade in cascade_list:
-            for s in [int(x) for x in cascade.split()]:
-                if self.constraints[s] <= 0:
-                    cascade_list.remove(cascade)
-        print(cascade_list)
+        cascade_list = np.flatnonzero(self.cascades.active)
         # Check if cascade list is null
-        if len(cascade_list) == 0:
-            # Exception if cascade is null
-            print('Cascade list is empty!!!')
-        else:
-            return cascade_list
+        if len(cascade_list) == 0 and self.instruments is not None:
+            self.instruments.count('empty_cascade_list')
+
+        return cascade_list
 
-    def update_primary_reward(self, arm: int, reward: int):
+    def update_primary_reward(self, arm: int, reward: int, consume=True):
         """ Update first payments alphas and betas.
         Update constraints.
 
         :param arm:
         :param reward:
+        :param consume: decrease arm capacity by reward, False if capacity was reserved in advance
         :return:
         """
+        # rewards of a gateway may be bool, deltas are indexed by int
+        reward = int(reward)
 
         self.primary_alphas[arm] += reward
         self.primary_betas[arm] += 1 - reward
+        for posterior in self.posteriors['primary']:
+            posterior.update(arm, reward)
 
-        self.n_primary_payments += 1
-        self.n_primary_success += reward
+        self.counts += PRIMARY_DELTAS[reward]
 
-        self.constraints[arm] -= reward
+        if consume and reward != 0:
+            self.set_constraint(arm, self.constraints[arm] - reward)
 
-    def update_repeated_reward(self, arm: int, reward: int):
+    def update_repeated_reward(self, arm: int, reward: int, consume=True):
         """ Update token payments alphas and betas.
 
         :param arm:
         :param reward:
+        :param consume: decrease arm capacity by reward, False if capacity was reserved in advance
         :return:
         """
+        reward = int(reward)
 
         self.repeated_alphas[arm] += reward
         self.repeated_betas[arm] += 1 - reward
+        for posterior in self.posteriors['repeated']:
+            posterior.update(arm, reward)
+
+        self.counts += REPEATED_DELTAS[reward]
+
+        if consume and reward != 0:
+            self.set_constraint(arm, self.constraints[arm] - reward)
+
+    def _count_many(self, deltas, n_payments: int, n_success: int):
+        self.counts += deltas[0] * (n_payments - n_success) + deltas[1] * n_success
+
+    def _consume(self, success):
+        """ Decrease capacity of arms by their numbers of successful payments.
+
+        :param success: number of successful payments of each arm
+        :return:
+        """
+        for arm in np.flatnonzero(success):
+            self.set_constraint(arm, self.constraints[arm] - success[arm])
+
+    def update_primary_rewards(self, arms, rewards, consume=True):
+        """ Update first payments alphas and betas for many payments at once.
+
+        :param arms: sequence of arms
+        :param rewards: sequence of rewards
+        :param consume: decrease arm capacity by rewards, False if capacity was reserved in advance
+        :return:
+        """
+        arms = np.asarray(arms, dtype=np.int64)
+        rewards = np.asarray(rewards, dtype=np.int64)
+
+        success = np.bincount(arms, rewards, minlength=self.n_arms).astype(np.int64)
+        payments = np.bincount(arms, minlength=self.n_arms)
+
+        self.primary_alphas += success
+        self.primary_betas += payments - success
+        for posterior in self.posteriors['primary']:
+            for arm, reward in zip(arms.tolist(), rewards.tolist()):
+                posterior.update(arm, reward)
 
-        self.n_repeated_payments += 1
-        self.n_repeated_success += reward
+        self._count_many(PRIMARY_DELTAS, len(arms), int(success.sum()))
 
-        self.n_payments += 1
-        self.n_success += reward
+        if consume:
+            self._consume(success)
 
-        self.constraints[arm] -= reward
+    def update_repeated_rewards(self, arms, rewards, consume=True):
+        """ Update token payments alphas and betas for many payments at once.
 
-    def update_cascade_reward(self, config: str, reward: int):
+        :param arms: sequence of arms
+        :param rewards: sequence of rewards
+        :param consume: decrease arm capacity by rewards, False if capacity was reserved in advance
+        :return:
+        """
+        arms = np.asarray(arms, dtype=np.int64)
+        rewards = np.asarray(rewards, dtype=np.int64)
+
+        success = np.bincount(arms, rewards, minlength=self.n_arms).astype(np.int64)
+        payments = np.bincount(arms, minlength=self.n_arms)
+
+        self.repeated_alphas += success
+        self.repeated_betas += payments - success
+        for posterior in self.posteriors['repeated']:
+            for arm, reward in zip(arms.tolist(), rewards.tolist()):
+                posterior.update(arm, reward)
+
+        self._count_many(REPEATED_DELTAS, len(arms), int(success.sum()))
+
+        if consume:
+            self._consume(success)
+
+    def update_cascade_rewards(self, config_ids, rewards):
+        """ Update cascade alphas and betas for many payments at once.
+
+        :param config_ids: sequence of config ids
+        :param rewards: sequence of rewards
+        :return:
+        """
+        rewards = np.asarray(rewards, dtype=np.int64)
+        self.cascades.update_many(config_ids, rewards)
+
+        n_success = int(rewards.sum())
+        if self.instruments is not None:
+            self.instruments.count('cascade_payments', len(rewards))
+            self.instruments.count('cascade_success', n_success)
+
+        self._count_many(CASCADE_DELTAS, len(rewards), n_success)
+
+    def update_cascade_reward(self, config_id: int, reward: int):
         """ Update cascade alphas and betas for particular config.
 
-        :param config:
+        :param config_id:
         :param reward:
         :return:
         """
+        reward = int(reward)
 
-        self.cascade_alphas[config] += reward
-        self.cascade_betas[config] += 1 - reward
-        self.update_cascade_mean(config)
+        self.cascades.update(config_id, reward)
 
-        self.n_cascade_payments += 1
-        self.n_cascade_success += reward
+        if self.instruments is not None:
+            self.instruments.count('cascade_payments')
+            self.instruments.count('cascade_success', reward)
 
-        self.n_payments += 1
-        self.n_success += reward
+        self.counts += CASCADE_DELTAS[reward]
 
-    def play_cascade(self, arm_list: list):
+    def play_cascade(self, config_id: int):
         """ Cascade routing simulator.
 
-        :param arm_list:
-        :return:
+        :param config_id:
+        :return: cascade reward
         """
-        arm_list = [int(x) for x in arm_list.split()]
+        arm_list = self.cascades.configs[config_id]
+        log = self.event_log
+        if log is not None:
+            iteration = self.n_cascade_payments
+            log.decision(iteration, config_id, arm_list)
+
+        instruments = self.instruments
+        if instruments is not None:
+            start = step_start = perf_counter()
+
         # Calculate probability for each step of cascade
         proba_list = self.arms_proba['primary']
-        cascade_proba = {arm_list[0]: proba_list[arm_list[0]]}
-        cascade_proba.update({arm_list[i + 1]: proba_list[arm_list[i + 1]] - proba_list[arm_list[i]]
-                              for i in range(len(arm_list) - 1)})
 
-        check_step = 0
-        for k, v in cascade_proba.items():
+        previous_proba = 0
+        for check_step, k in enumerate(arm_list):
 
-            reward = self.pull_arm(v)
+            reward = self.pull_arm(proba_list[k] - previous_proba)
+            previous_proba = proba_list[k]
+            if log is not None:
+                log.step(iteration, config_id, k, check_step, reward)
 
             if check_step == 0:
                 """Update reward for first cascade step"""
                 self.update_primary_reward(k, reward)
 
+            if instruments is not None:
+                step_end = perf_counter()
+                instruments.observe('cascade_step_seconds', step_end - step_start, step=check_step)
+                instruments.count('cascade_steps', step=check_step)
+                step_start = step_end
+
             if reward == 1:
                 """Oneclick payments simulator"""
 
-                repeated_num = int(np.random.gamma(1, 2))
+                repeated_num = next(self.repeated_numbers)
                 for i in range(repeated_num):
                     repeated_reward = self.pull_arm(self.arms_proba['repeated'][k])
                     self.update_repeated_reward(k, repeated_reward)
+                    if log is not None:
+                        log.repeated(iteration, config_id, k, repeated_reward)
 
                 break
 
-            check_step += 1
-        config_string = ' '.join([str(x) for x in arm_list])
-        self.update_cascade_reward(config_string, reward)
+        self.update_cascade_reward(config_id, reward)
+        if log is not None:
+            log.cascade(iteration, config_id, reward)
+        if instruments is not None:
+            instruments.observe('play_seconds', perf_counter() - start)
+
+        return reward
+
+    def play_batch(self, config_ids):
+        """ Cascade routing simulator for a batch of payments made at once.
+
+        Same model as play_cascade, but outcomes of all payments are drawn together and statistics
+        are updated in bulk after them. Payments are played one by one if an event log is attached.
+
+        :param config_ids: sequence of config ids
+        :return: cascade reward of each payment
+        """
+        config_ids = np.asarray(config_ids, dtype=np.int64)
+        if self.event_log is not None:
+            return np.array([self.play_cascade(c) for c in config_ids.tolist()], dtype=np.int64)
+
+        n = len(config_ids)
+        arms = self.cascades.arms[config_ids]
+        valid = arms >= 0
+
+        proba_list = np.asarray(self.arms_proba['primary'])
+        step_proba = np.where(valid, proba_list[arms], 0.)
+        previous_proba = np.zeros_like(step_proba)
+        previous_proba[:, 1:] = step_proba[:, :-1]
+
+        # steps after the first successful one are not tried
+        success = (self.rng.random(arms.shape) < step_proba - previous_proba) & valid
+        rewards = success.any(axis=1).astype(np.int64)
+        paid_arms = arms[np.arange(n), success.argmax(axis=1)][rewards == 1]
+
+        self.update_primary_rewards(arms[:, 0], success[:, 0])
+
+        repeated_nums = self.rng.gamma(1, 2, len(paid_arms)).astype(np.int64)
+        repeated_arms = np.repeat(paid_arms, repeated_nums)
+        repeated_proba = np.asarray(self.arms_proba['repeated'])[repeated_arms]
+        self.update_repeated_rewards(repeated_arms, self.rng.random(len(repeated_arms)) < repeated_proba)
+
+        self.update_cascade_rewards(config_ids, rewards)
+
+        return rewards
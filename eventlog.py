@@ -0,0 +1,306 @@
+"""
+Compact binary log of decisions and rewards and replay of environment state from it.
+
+Log file is a 16 bytes header followed by fixed-width records, so it can be read with np.memmap without copying.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from cascades import CascadeRegistry
+from environment import TestEnvironment
+
+MAGIC = b'CASCLOG'
+# version 2 adds EVICT and ADMIT records, logs of version 1 are read as well
+VERSION = 2
+HEADER_SIZE = 16
+
+# reward types
+DECISION = 0
+STEP = 1
+REPEATED = 2
+CASCADE = 3
+CONSTRAINT = 4
+REGISTER = 5
+EVICT = 6
+ADMIT = 7
+
+EVENT_DTYPE = np.dtype([('iteration', '<u4'),
+                        ('cascade', '<i4'),
+                        ('arm', '<i2'),
+                        ('step', 'u1'),
+                        ('kind', 'u1'),
+                        ('reward', '<i4')])
+
+
+class EventLog:
+    """ Append-only writer of the event log.
+
+    Iteration is the number of cascade payments made before the event.
+    Register records hold every arm of a new cascade config (ids are given in order of registration,
+    ids of configs evicted from a bounded pool are reused by later registrations),
+    evict records free the id of a config evicted from a bounded pool, admit records follow registration
+    of a config admitted back with remembered statistics and hold its successes (step 0) and failures (step 1),
+    step records hold every pulled arm, constraint records hold new capacity of the arm in reward field.
+    """
+
+    def __init__(self, path, n_arms: int, buffer_size=65536):
+        self.path = path
+        self.n_arms = n_arms
+        self.buffer_size = buffer_size
+
+        self._records = []
+
+        self._file = open(path, 'wb')
+        header = np.zeros(HEADER_SIZE, dtype=np.uint8)
+        header[:len(MAGIC)] = np.frombuffer(MAGIC, dtype=np.uint8)
+        header[len(MAGIC)] = VERSION
+        header[8:12] = np.frombuffer(np.uint32(n_arms).tobytes(), dtype=np.uint8)
+        header.tofile(self._file)
+
+    def append(self, iteration: int, cascade: int, arm: int, step: int, kind: int, reward: int):
+        self._records.append((iteration, cascade, arm, step, kind, reward))
+        if len(self._records) >= self.buffer_size:
+            self.flush()
+
+    def register(self, iteration: int, cascade: int, arm_list):
+        for step, arm in enumerate(arm_list):
+            self.append(iteration, cascade, arm, step, REGISTER, 0)
+
+    def evict(self, iteration: int, cascade: int):
+        self.append(iteration, cascade, -1, 0, EVICT, 0)
+
+    def admit(self, iteration: int, cascade: int, successes: int, failures: int):
+        self.append(iteration, cascade, -1, 0, ADMIT, successes)
+        self.append(iteration, cascade, -1, 1, ADMIT, failures)
+
+    def decision(self, iteration: int, cascade: int, arm_list):
+        self.append(iteration, cascade, arm_list[0], 0, DECISION, 0)
+
+    def step(self, iteration: int, cascade: int, arm: int, step: int, reward: int):
+        self.append(iteration, cascade, arm, step, STEP, reward)
+
+    def repeated(self, iteration: int, cascade: int, arm: int, reward: int):
+        self.append(iteration, cascade, arm, 0, REPEATED, reward)
+
+    def cascade(self, iteration: int, cascade: int, reward: int):
+        self.append(iteration, cascade, -1, 0, CASCADE, reward)
+
+    def constraint(self, iteration: int, arm: int, value: int):
+        self.append(iteration, -1, arm, 0, CONSTRAINT, value)
+
+    def flush(self):
+        if len(self._records) > 0:
+            np.array(self._records, dtype=EVENT_DTYPE).tofile(self._file)
+            self._records = []
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_log(path):
+    """ Memory-map records of the event log.
+
+    :param path:
+    :return: number of arms and structured array of records
+    """
+    header = np.fromfile(path, dtype=np.uint8, count=HEADER_SIZE)
+    if header[:len(MAGIC)].tobytes() != MAGIC:
+        raise ValueError('Not an event log: ' + str(path))
+    if not 1 <= header[len(MAGIC)] <= VERSION:
+        raise ValueError('Unsupported event log version: ' + str(header[len(MAGIC)]))
+    n_arms = int(header[8:12].view('<u4')[0])
+
+    records = np.memmap(path, dtype=EVENT_DTYPE, mode='r', offset=HEADER_SIZE)
+
+    return n_arms, records
+
+
+class Replay:
+    """ Rebuild environment state at any iteration from the event log without simulation.
+    """
+
+    def __init__(self, path):
+        self.n_arms, self.records = read_log(path)
+
+    def n_iters(self):
+        if len(self.records) == 0:
+            return 0
+        return int(self.records['iteration'][-1]) + 1
+
+    def events(self, iteration: int):
+        """ Records made before the iteration (zero-copy slice).
+
+        :param iteration:
+        :return:
+        """
+        end = np.searchsorted(self.records['iteration'], iteration, side='left')
+        return self.records[:end]
+
+    def restore(self, env: TestEnvironment, iteration: int):
+        """ Set env posteriors, cascades, constraints and counters to their values before the iteration.
+
+        Forgetting is not replayed: posteriors added to env keep their own state, and env discounting
+        evidence of cascade configs is rejected, as full sums of the logged payments would not match it.
+
+        :param env: environment with the same arms as the logged one, made without cascade_gamma
+        :param iteration:
+        :return: env
+        """
+        if env.cascade_gamma is not None:
+            raise ValueError('Replay does not discount cascade statistics, env must be made without cascade_gamma')
+
+        events = self.events(iteration)
+        kind = events['kind']
+        arm = events['arm'].astype(np.int64)
+        reward = events['reward'].astype(np.int64)
+        n_arms = self.n_arms
+
+        primary = (kind == STEP) & (events['step'] == 0)
+        repeated = kind == REPEATED
+        cascade = kind == CASCADE
+
+        def count(mask, weights=None):
+            return np.bincount(arm[mask], weights=weights, minlength=n_arms)
+
+        primary_success = count(primary, reward[primary])
+        primary_payments = count(primary)
+        env.primary_alphas = 1 + primary_success
+        env.primary_betas = 1 + primary_payments - primary_success
+
+        repeated_success = count(repeated, reward[repeated])
+        repeated_payments = count(repeated)
+        env.repeated_alphas = 1 + repeated_success
+        env.repeated_betas = 1 + repeated_payments - repeated_success
+
+        # capacity is the last logged value minus successes after it
+        index = np.arange(len(events))
+        set_constraint = kind == CONSTRAINT
+        last = np.full(n_arms, -1)
+        np.maximum.at(last, arm[set_constraint], index[set_constraint])
+        consumed = (primary | repeated) & (index > last[arm])
+        constraints = np.array(env.basic_constraints, dtype=np.int64)
+        constraints[last >= 0] = reward[last[last >= 0]]
+        env.constraints = constraints - count(consumed, reward[consumed]).astype(np.int64)
+
+        # cascade configs: a life of a config lasts from its registration to its eviction,
+        # an id of evicted config is reused by a later registration
+        cascade_id = events['cascade'].astype(np.int64)
+        step = events['step'].astype(np.int64)
+        register = kind == REGISTER
+        start = register & (step == 0)
+        evict = kind == EVICT
+        admit = kind == ADMIT
+
+        life_starts = index[start]
+        n_lives = len(life_starts)
+        n_configs = int(cascade_id[start].max()) + 1 if n_lives > 0 else 0
+        # position of the life every record of a config belongs to
+        life = np.searchsorted(life_starts, _lives(cascade_id, start))
+
+        def life_sum(mask, weights=None):
+            return np.bincount(life[mask], weights=weights, minlength=n_lives)
+
+        depth = int(step[register].max()) + 1 if n_lives > 0 else 1
+        life_arms = np.full((n_lives, depth), -1, dtype=np.int64)
+        life_arms[life[register], step[register]] = arm[register]
+
+        # statistics of every life: remembered ones it was admitted with and payments made in it
+        successes = life_sum(cascade, reward[cascade])
+        failures = life_sum(cascade) - successes
+        first_admit = admit & (step == 0)
+        successes += life_sum(first_admit, reward[first_admit])
+        second_admit = admit & (step == 1)
+        failures += life_sum(second_admit, reward[second_admit])
+
+        # clock of the registry counts cascade payments, the last payment (or registration) of each life
+        clock = np.cumsum(cascade)
+        last_used = clock[life_starts]
+        np.maximum.at(last_used, life[cascade], clock[cascade])
+
+        ended = np.zeros(n_lives, dtype=bool)
+        ended[life[evict]] = True
+
+        # the last life of every id, ids whose last life has ended are free
+        current = np.full(n_configs, -1)
+        np.maximum.at(current, cascade_id[start], np.arange(n_lives))
+        live = ~ended[current]
+
+        configs = np.where(live[:, None], life_arms[current], -1)
+        env.cascades = CascadeRegistry(max_configs=env.max_configs)
+        env.block_exhausted_arms()
+        env.cascades.load(configs,
+                          1 + successes[current],
+                          1 + failures[current],
+                          last_used=last_used[current])
+        env.cascades.clock = int(clock[-1]) if len(clock) > 0 else 0
+        env.cascades.n_admitted = n_lives
+
+        # free ids are reused in reverse order of eviction
+        evict_index = np.zeros(n_configs, dtype=np.int64)
+        evict_index[cascade_id[evict]] = index[evict]
+        free = np.flatnonzero(~live)
+        env.cascades.free = free[np.argsort(evict_index[free], kind='stable')].tolist()
+
+        # statistics of evicted configs as remembered by the registry: in order of eviction,
+        # forgotten on admission back and beyond the limit of remembered configs
+        remembered = OrderedDict()
+        n_kept = 0
+        for i in np.flatnonzero(start | evict).tolist():
+            config = tuple(a for a in life_arms[life[i]].tolist() if a >= 0)
+            if start[i]:
+                remembered.pop(config, None)
+                n_kept += 1
+            else:
+                remembered[config] = (1. + successes[life[i]], 1. + failures[life[i]])
+                limit = env.max_configs if env.max_configs is not None else n_kept
+                while len(remembered) > limit:
+                    remembered.popitem(last=False)
+                n_kept -= 1
+        env.cascades.evicted = remembered
+
+        env.n_primary_payments = int(primary_payments.sum())
+        env.n_primary_success = int(primary_success.sum())
+        env.n_repeated_payments = int(repeated_payments.sum())
+        env.n_repeated_success = int(repeated_success.sum())
+        env.n_cascade_payments = int(cascade.sum())
+        env.n_cascade_success = int(reward[cascade].sum())
+        env.n_payments = env.n_repeated_payments + env.n_cascade_payments
+        env.n_success = env.n_repeated_success + env.n_cascade_success
+
+        return env
+
+
+def _lives(cascade_id, start):
+    """ Index of the registration record starting the config life each record belongs to.
+
+    Records of an id before its first registration and records without id get -1.
+
+    :param cascade_id: config id of every record, -1 if none
+    :param start: mask of first records of registrations
+    :return:
+    """
+    n = len(cascade_id)
+    index = np.arange(n)
+    lives = np.full(n, -1)
+
+    has_id = np.flatnonzero(cascade_id >= 0)
+    ids = cascade_id[has_id]
+    order = np.lexsort((has_id, ids))
+
+    # running maximum of registrations over records sorted by id, registrations are shifted by id
+    # so the maximum never passes from one id to the next
+    shift = ids[order] * (n + 1)
+    running = np.maximum.accumulate(np.where(start[has_id][order], shift + index[has_id][order], shift - 1))
+    lives[has_id[order]] = np.maximum(running - shift, -1)
+
+    return lives
@@ -0,0 +1,198 @@
+"""
+Monte Carlo experiments over grid of environment and strategy configurations.
+Replications are run in a process pool with independent reproducible random streams.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from math import ceil
+from os import cpu_count
+
+import numpy as np
+
+from bandit import Bandit, Strategy
+from environment import TestEnvironment
+from simulation import Simulation
+
+
+def make_grid(base: dict, **variants):
+    """ Make list of configurations from base configuration and all combinations of variants.
+
+    make_grid(base, cascade_params=[['primary'], ['repeated', 'primary']])
+
+    :param base: environment and strategy parameters: primary_arms_proba, repeated_arms_proba,
+        constraints, cascade_params and optional failure
+    :param variants: lists of values for parameters to vary
+    :return:
+    """
+    names = list(variants)
+    grid = []
+    for values in product(*[variants[name] for name in names]):
+        config = dict(base)
+        config.update(zip(names, values))
+        grid.append(config)
+
+    return grid
+
+
+def run_replication(config: dict, n_iters: int, seed_seq: np.random.SeedSequence):
+    """ Simulate one run of the configuration.
+
+    :param config: see make_grid
+    :param n_iters: number of payments
+    :param seed_seq: seed of the replication
+    :return: dictionary of run statistics
+    """
+    env_seed, strategy_seed = seed_seq.spawn(2)
+
+    env = TestEnvironment(list(config['primary_arms_proba']),
+                          list(config['repeated_arms_proba']),
+                          list(config['constraints']),
+                          failure=config.get('failure', False),
+                          rng=env_seed)
+    strategy = Strategy(env, cascade_params=list(config['cascade_params']), rng=strategy_seed)
+    trace = Simulation(Bandit(strategy)).run(n_iters, record_constraints=True)
+
+    # First iteration when arm has no capacity left, -1 if never
+    exhausted = trace.constraints <= 0
+    exhaustion_iter = np.where(exhausted.any(axis=0), exhausted.argmax(axis=0), -1)
+
+    best_proba = max(config['primary_arms_proba'])
+
+    return {
+        'n_iters': trace.n_iters,
+        'conversion': env.n_success / env.n_payments if env.n_payments > 0 else 0.,
+        'cascade_conversion': env.n_cascade_success / env.n_cascade_payments if env.n_cascade_payments > 0 else 0.,
+        'primary_conversion': env.n_primary_success / env.n_primary_payments if env.n_primary_payments > 0 else 0.,
+        # regret against always paying through the best bank
+        'regret': trace.n_iters * best_proba - env.n_cascade_success,
+        'exhaustion_iter': exhaustion_iter,
+    }
+
+
+def run_batch(config: dict, n_replicas: int, n_iters: int, seed_seq: np.random.SeedSequence):
+    """ Simulate all replications of the configuration at once by batch.BatchSimulation.
+
+    Replicas of a batch do not simulate bank failures. A replica stops paying when it has no cascade left,
+    its number of iterations is the number of its cascade payments.
+
+    :param config: see make_grid
+    :param n_replicas: number of replications
+    :param n_iters: number of payments
+    :param seed_seq: seed of the batch
+    :return: list of dictionaries of run statistics, same as results of run_replication
+    """
+    from batch import BatchEnvironment, BatchSimulation, BatchStrategy
+
+    if config.get('failure', False):
+        raise ValueError('Bank failures are not simulated by batch replicas')
+
+    cascade_params = list(config['cascade_params'])
+    env = BatchEnvironment(n_replicas,
+                           list(config['primary_arms_proba']),
+                           list(config['repeated_arms_proba']),
+                           list(config['constraints']),
+                           depth=len(cascade_params),
+                           rng=seed_seq)
+    simulation = BatchSimulation(BatchStrategy(env, cascade_params=cascade_params))
+    simulation.run(n_iters)
+
+    best_proba = max(config['primary_arms_proba'])
+    conversion = simulation.conversion()
+    cascade_conversion = simulation.cascade_conversion()
+    primary_conversion = env.n_primary_success / np.maximum(env.n_primary_payments, 1)
+
+    return [{
+        'n_iters': int(env.n_cascade_payments[r]),
+        'conversion': float(conversion[r]),
+        'cascade_conversion': float(cascade_conversion[r]),
+        'primary_conversion': float(primary_conversion[r]),
+        'regret': env.n_cascade_payments[r] * best_proba - env.n_cascade_success[r],
+        'exhaustion_iter': simulation.exhaustion_iter[r],
+    } for r in range(n_replicas)]
+
+
+def _run_task(task):
+    config, n_iters, seed_seq = task
+    return run_replication(config, n_iters, seed_seq)
+
+
+def summarize(values):
+    """ Mean, standard deviation and 95% confidence interval half width.
+
+    :param values:
+    :return:
+    """
+    values = np.asarray(values, dtype=float)
+    std = values.std(ddof=1) if len(values) > 1 else 0.
+    return {'mean': float(values.mean()), 'std': float(std), 'ci95': float(1.96 * std / np.sqrt(len(values)))}
+
+
+class Experiment:
+    """ Run every configuration of the grid n_replications times and aggregate results.
+    """
+
+    metrics = ['conversion', 'cascade_conversion', 'primary_conversion', 'regret']
+
+    def __init__(self, grid: list, n_replications: int, n_iters: int, seed=None):
+        self.grid = grid
+        self.n_replications = n_replications
+        self.n_iters = n_iters
+
+        self.seed_seq = np.random.SeedSequence(seed)
+
+    def tasks(self):
+        """ One task per replication, seeds do not depend on number of workers.
+        :return:
+        """
+        seeds = self.seed_seq.spawn(len(self.grid) * self.n_replications)
+        return [(config, self.n_iters, seeds[i * self.n_replications + r])
+                for i, config in enumerate(self.grid)
+                for r in range(self.n_replications)]
+
+    def run(self, n_workers=None, vectorized=False):
+        """ Run all replications.
+
+        :param n_workers: number of processes, all cores by default, 1 runs in current process
+        :param vectorized: run replications of each configuration in lockstep in current process,
+            see run_batch, n_workers is not used then
+        :return: list of aggregated results for each configuration
+        """
+        if vectorized:
+            seeds = self.seed_seq.spawn(len(self.grid))
+            return [self.aggregate(config, run_batch(config, self.n_replications, self.n_iters, seed))
+                    for config, seed in zip(self.grid, seeds)]
+
+        tasks = self.tasks()
+        if n_workers is None:
+            n_workers = cpu_count() or 1
+
+        if n_workers == 1:
+            runs = [_run_task(task) for task in tasks]
+        else:
+            chunksize = max(1, ceil(len(tasks) / (4 * n_workers)))
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                runs = list(executor.map(_run_task, tasks, chunksize=chunksize))
+
+        return [self.aggregate(config, runs[i * self.n_replications:(i + 1) * self.n_replications])
+                for i, config in enumerate(self.grid)]
+
+    def aggregate(self, config: dict, runs: list):
+        """ Aggregate replications of one configuration.
+
+        :param config:
+        :param runs: results of run_replication
+        :return:
+        """
+        result = {'config': config, 'runs': runs}
+        for metric in self.metrics:
+            result[metric] = summarize([run[metric] for run in runs])
+
+        exhaustion_iter = np.array([run['exhaustion_iter'] for run in runs])
+        exhausted = exhaustion_iter >= 0
+        result['exhaustion_rate'] = exhausted.mean(axis=0)
+        result['exhaustion_iter'] = np.array([exhaustion_iter[exhausted[:, arm], arm].mean()
+                                              if exhausted[:, arm].any() else np.nan
+                                              for arm in range(exhaustion_iter.shape[1])])
+
+        return result
@@ -0,0 +1,111 @@
+"""
+Beta posteriors of arms forgetting old evidence, for Thompson sampling at non-stationary banks.
+
+Both kinds are updated in O(1) per payment: discounting keeps a lazy global scale factor
+instead of decaying every arm, sliding window keeps a ring buffer of the last payments.
+"""
+
+import numpy as np
+
+# raw sums are folded into the scale before it underflows
+MIN_SCALE = 1e-100
+
+
+class DiscountedBeta:
+    """ Discounted Thompson sampling posteriors.
+
+    At every payment evidence of all arms is multiplied by gamma and the reward is added to the paid arm.
+    Evidence is kept as raw sums divided by gamma ** t, so only the paid arm is touched.
+    """
+
+    __slots__ = ('n_arms', 'gamma', 'prior_alpha', 'prior_beta', 'scale', '_success', '_failure')
+
+    def __init__(self, n_arms: int, gamma=0.99, prior_alpha=1., prior_beta=1.):
+        """
+        :param n_arms:
+        :param gamma: discount factor from 0 to 1, weight of payment made n payments ago is gamma ** n
+        :param prior_alpha:
+        :param prior_beta:
+        """
+        self.n_arms = n_arms
+        self.gamma = gamma
+        self.prior_alpha = prior_alpha
+        self.prior_beta = prior_beta
+
+        self.scale = 1.
+        self._success = np.zeros(n_arms)
+        self._failure = np.zeros(n_arms)
+
+    def update(self, arm: int, reward: int):
+        self.scale *= self.gamma
+        if self.scale < MIN_SCALE:
+            self._success *= self.scale
+            self._failure *= self.scale
+            self.scale = 1.
+
+        if reward:
+            self._success[arm] += 1. / self.scale
+        else:
+            self._failure[arm] += 1. / self.scale
+
+    @property
+    def alphas(self):
+        return self.prior_alpha + self._success * self.scale
+
+    @property
+    def betas(self):
+        return self.prior_beta + self._failure * self.scale
+
+
+class SlidingWindowBeta:
+    """ Posteriors from the last window payments over all arms.
+    """
+
+    __slots__ = ('n_arms', 'window', 'prior_alpha', 'prior_beta', '_success', '_failure',
+                 '_arms', '_rewards', '_position')
+
+    def __init__(self, n_arms: int, window=1000, prior_alpha=1., prior_beta=1.):
+        """
+        :param n_arms:
+        :param window: number of remembered payments
+        :param prior_alpha:
+        :param prior_beta:
+        """
+        self.n_arms = n_arms
+        self.window = window
+        self.prior_alpha = prior_alpha
+        self.prior_beta = prior_beta
+
+        self._success = np.zeros(n_arms)
+        self._failure = np.zeros(n_arms)
+
+        # ring buffer of paid arms and rewards, arm -1 marks empty place
+        self._arms = np.full(window, -1, dtype=np.int64)
+        self._rewards = np.zeros(window, dtype=np.int8)
+        self._position = 0
+
+    def update(self, arm: int, reward: int):
+        position = self._position
+        old_arm = self._arms[position]
+        if old_arm >= 0:
+            if self._rewards[position]:
+                self._success[old_arm] -= 1
+            else:
+                self._failure[old_arm] -= 1
+
+        self._arms[position] = arm
+        self._rewards[position] = reward
+        self._position = (position + 1) % self.window
+
+        if reward:
+            self._success[arm] += 1
+        else:
+            self._failure[arm] += 1
+
+    @property
+    def alphas(self):
+        return self.prior_alpha + self._success
+
+    @property
+    def betas(self):
+        return self.prior_beta + self._failure
@@ -0,0 +1,284 @@
+"""
+Counters, latency histograms and profiling hooks of the routing hot path.
+
+Instruments are attached to TestEnvironment like an event log. While nothing is attached
+the hot path only checks that the attribute is None.
+"""
+
+import cProfile
+import json
+import sys
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from time import perf_counter, time
+
+# Upper bounds of latency buckets in seconds, from 1 microsecond to 1 second
+LATENCY_BUCKETS = tuple(float('%se%d' % (m, e)) for e in range(-6, 0) for m in (1, 2.5, 5)) + (1.0,)
+
+
+class Histogram:
+    """ Counts of observed values in fixed buckets with their sum, Prometheus style.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # last count is for values above the largest bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Upper bound of the bucket containing q-quantile, inf if it is above all buckets.
+
+        :param q: from 0 to 1
+        :return:
+        """
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+
+        return float('inf')
+
+    def as_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+class Timer:
+    """ Context manager observing elapsed time in a histogram.
+    """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.start)
+
+
+class Instruments:
+    """ Named counters and histograms with sinks receiving all of them on flush.
+
+    Metric name may have labels: instruments.observe('cascade_step_seconds', t, step=1).
+    """
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+
+        # (name, sorted labels) -> value
+        self.counters = Counter()
+        self.histograms = defaultdict(Histogram)
+
+    def count(self, name: str, value=1, **labels):
+        self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def observe(self, name: str, value, **labels):
+        self.histograms[name, tuple(sorted(labels.items()))].observe(value)
+
+    def histogram(self, name: str, **labels):
+        return self.histograms[name, tuple(sorted(labels.items()))]
+
+    def timer(self, name: str, **labels):
+        """ Time the with block.
+
+        :param name: histogram name
+        :param labels:
+        :return: Timer
+        """
+        return Timer(self.histogram(name, **labels))
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+    def flush(self):
+        """ Send current values to every sink.
+
+        :return:
+        """
+        for sink in self.sinks:
+            sink.write(self)
+
+
+def _labels_text(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, value) for key, value in labels) + '}'
+
+
+def prometheus_text(instruments: Instruments):
+    """ Metrics in Prometheus text exposition format.
+
+    :param instruments:
+    :return: str
+    """
+    lines = []
+
+    names = sorted({name for name, _ in instruments.counters})
+    for name in names:
+        lines.append('# TYPE %s_total counter' % name)
+        for (metric, labels), value in sorted(instruments.counters.items()):
+            if metric == name:
+                lines.append('%s_total%s %s' % (name, _labels_text(labels), value))
+
+    names = sorted({name for name, _ in instruments.histograms})
+    for name in names:
+        lines.append('# TYPE %s histogram' % name)
+        for (metric, labels), histogram in sorted(instruments.histograms.items(), key=lambda item: item[0]):
+            if metric != name:
+                continue
+
+            total = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+                lines.append('%s_bucket%s %d' % (name, _labels_text(labels, [('le', repr(bound))]), total))
+            lines.append('%s_bucket%s %d' % (name, _labels_text(labels, [('le', '+Inf')]), histogram.count))
+            lines.append('%s_sum%s %r' % (name, _labels_text(labels), histogram.sum))
+            lines.append('%s_count%s %d' % (name, _labels_text(labels), histogram.count))
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_dict(instruments: Instruments):
+    """ Metrics as JSON serializable dictionary, labels are joined to name as in Prometheus.
+
+    :param instruments:
+    :return:
+    """
+    return {'counters': {name + _labels_text(labels): value
+                         for (name, labels), value in instruments.counters.items()},
+            'histograms': {name + _labels_text(labels): histogram.as_dict()
+                           for (name, labels), histogram in instruments.histograms.items()}}
+
+
+class MemorySink:
+    """ Keep every flushed state in memory.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, instruments: Instruments):
+        self.records.append(metrics_dict(instruments))
+
+
+class PrometheusFileSink:
+    """ Rewrite the file in Prometheus text format on every flush, for node exporter textfile collector.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, instruments: Instruments):
+        with open(self.path, 'w') as f:
+            f.write(prometheus_text(instruments))
+
+
+class JsonLinesSink:
+    """ Append one JSON line with time stamp on every flush.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, instruments: Instruments):
+        record = metrics_dict(instruments)
+        record['time'] = time()
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+class CProfiler:
+    """ Deterministic profiler of a run, stats are dumped to the path if it is given.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        if self.path is not None:
+            self.profile.dump_stats(self.path)
+
+    def stats(self):
+        import pstats
+        return pstats.Stats(self.profile)
+
+
+class SamplingProfiler:
+    """ Statistical profiler sampling stack of the thread which started it.
+
+    Background thread takes a stack every interval seconds, so overhead does not depend on call rate.
+    Samples are counted by stacks of (file, line, function) from outermost frame.
+    """
+
+    def __init__(self, interval=0.001, path=None):
+        self.interval = interval
+        self.path = path
+        self.samples = Counter()
+
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, frame.f_lineno, code.co_name))
+                frame = frame.f_back
+            self.samples[tuple(reversed(stack))] += 1
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        if self.path is not None:
+            self.save(self.path)
+
+    def functions(self):
+        """ Number of samples with each function on the stack, most frequent first.
+
+        :return: list of ((file, function), samples)
+        """
+        totals = Counter()
+        for stack, count in self.samples.items():
+            for function in {(filename, name) for filename, _, name in stack}:
+                totals[function] += count
+
+        return totals.most_common()
+
+    def save(self, path):
+        """ Save samples in collapsed stack format of flame graph tools.
+
+        :param path:
+        :return:
+        """
+        with open(path, 'w') as f:
+            for stack, count in self.samples.items():
+                f.write(';'.join('%s (%s:%d)' % (name, filename, line) for filename, line, name in stack))
+                f.write(' %d\n' % count)
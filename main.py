@@ -1,52 +1,144 @@
-import matplotlib
-matplotlib.use("TkAgg")
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-from matplotlib.animation import FFMpegFileWriter
+"""
+Command line entry point.
+
+    python main.py simulate [--iters 400] [--seed 0] [--checkpoint state.npz]
+    python main.py experiment [--iters 400] [--replications 20] [--workers 4] [--vectorized]
+    python main.py render [--iters 400] [--output test.mpeg] [--fps 20]
+
+Only render imports the plotting stack (matplotlib, scipy), simulate and experiment need NumPy alone,
+so they start fast and run on servers without display. Cold start of simulate is expected to stay
+under COLD_START_TARGET seconds, see benchmark.bench_cold_start.
+"""
+
+import argparse
 
 import bandit
-from visualisation import DrawEnvironment
-
-def main():
-    arms_primary_prob = [0.2, 0.72, 0.83, 0.7, 0.75]
-    # setup payment by token probability of each arm in environment
-    arms_repeated_prob = [0.8, 0.7, 0.7, 0.4, 0.71]
-    # setup capacity of success payments for each arm
-    constraints = [1000, 100, 75, 120, 50]
-    # setup number of iterations (payments) in simulation
-    n_max_iters = 400
-    # cascade config
-    #cascade_params = ['primary']
-    #cascade_params = ['repeated']
-    #cascade_params = ['primary', 'primary']
-    cascade_params = ['repeated', 'primary']
+from simulation import Simulation
+
+# seconds from interpreter start to the end of a one payment simulation
+COLD_START_TARGET = 0.3
+
+# setup payment probability of each arm in environment
+ARMS_PRIMARY_PROB = [0.2, 0.72, 0.83, 0.7, 0.75]
+# setup payment by token probability of each arm in environment
+ARMS_REPEATED_PROB = [0.8, 0.7, 0.7, 0.4, 0.71]
+# setup capacity of success payments for each arm
+CONSTRAINTS = [1000, 100, 75, 120, 50]
+# cascade config
+#CASCADE_PARAMS = ['primary']
+#CASCADE_PARAMS = ['repeated']
+#CASCADE_PARAMS = ['primary', 'primary']
+CASCADE_PARAMS = ['repeated', 'primary']
+
 
+def make_bandit(args):
     # setup environment
-    testenv = bandit.TestEnvironment(arms_primary_prob, arms_repeated_prob, constraints, failure=False)
+    testenv = bandit.TestEnvironment(ARMS_PRIMARY_PROB, ARMS_REPEATED_PROB, CONSTRAINTS, failure=args.failure,
+                                     rng=args.seed)
 
     # setup strategy
-    strategy = bandit.Strategy(testenv, cascade_params = cascade_params)
+    strategy = bandit.Strategy(testenv, cascade_params=args.cascade_params or CASCADE_PARAMS)
+
+    return bandit.Bandit(strategy)
+
+
+def simulate(args):
+    """ Simulate without drawing and print conversion.
+    """
+    cascade_bandit = make_bandit(args)
+    trace = Simulation(cascade_bandit).run(args.iters)
+
+    env = cascade_bandit.env
+    print('iterations = %d' % trace.n_iters)
+    print('payments = %d\nsuccess = %d' % (env.n_payments, env.n_success))
+    if env.n_payments > 0:
+        print('conversion = %.2f%%' % (env.n_success / env.n_payments * 100))
+
+    if args.checkpoint is not None:
+        from checkpoint import save_checkpoint
+        save_checkpoint(env, args.checkpoint)
+
+
+def experiment(args):
+    """ Compare cascade configurations by Monte Carlo replications.
+
+    Only the configuration of --cascade-params is run if it is given.
+    """
+    from experiment import Experiment, make_grid
+
+    base = {'primary_arms_proba': ARMS_PRIMARY_PROB,
+            'repeated_arms_proba': ARMS_REPEATED_PROB,
+            'constraints': CONSTRAINTS,
+            'cascade_params': CASCADE_PARAMS,
+            'failure': args.failure}
+    if args.cascade_params is not None:
+        variants = [args.cascade_params]
+    else:
+        variants = [['primary'], ['repeated'], ['primary', 'primary'], ['repeated', 'primary']]
+    grid = make_grid(base, cascade_params=variants)
+
+    experiment = Experiment(grid, args.replications, args.iters, seed=args.seed)
+    for result in experiment.run(args.workers, vectorized=args.vectorized):
+        print('%-24s conversion = %.4f +- %.4f   regret = %.1f +- %.1f' %
+              (' '.join(result['config']['cascade_params']),
+               result['conversion']['mean'], result['conversion']['ci95'],
+               result['regret']['mean'], result['regret']['ci95']))
+
+
+def render(args):
+    """ Simulate keeping state of every iteration and render it to video.
+    """
+    from render import export
+
+    cascade_bandit = make_bandit(args)
+    trace = Simulation(cascade_bandit).run(args.iters, snapshot_every=1)
+
+    # render frames in parallel, ffmpeg is taken from PATH or FFMPEG_PATH,
+    # PNG frames are saved to <output>_frames/ if there is no ffmpeg
+    env = cascade_bandit.env
+    export(trace.snapshots, env.arms_proba, env.failure, args.output, fps=args.fps, n_workers=args.workers)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Cascade bandit for payment routing.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    common = argparse.ArgumentParser(add_help=False)
+    # setup number of iterations (payments) in simulation
+    common.add_argument('--iters', type=int, default=400, help='number of payments')
+    common.add_argument('--seed', type=int, default=None)
+    common.add_argument('--failure', action='store_true', help='simulate bank failure')
+    common.add_argument('--cascade-params', nargs='+', default=None, choices=['primary', 'repeated'],
+                        help='statistics used at each cascade step, ' + ' '.join(CASCADE_PARAMS) +
+                             ' by default, experiment compares several configurations by default')
+    common.add_argument('--workers', type=int, default=None, help='number of processes, all cores by default')
 
-    cascade_bandit = bandit.Bandit(strategy)
+    command = subparsers.add_parser('simulate', parents=[common], help='run bandit without drawing')
+    command.add_argument('--checkpoint', default=None, help='save learned state to the path')
+    command.set_defaults(run=simulate)
 
-    fig, ax = plt.subplots(2, 2, figsize = (20, 12))
+    command = subparsers.add_parser('experiment', parents=[common], help='compare cascade configurations')
+    command.add_argument('--replications', type=int, default=20)
+    command.add_argument('--vectorized', action='store_true',
+                         help='run replications of a configuration in lockstep as arrays, without failures')
+    command.set_defaults(run=experiment)
 
-    draw_env = DrawEnvironment(ax, cascade_bandit)
+    command = subparsers.add_parser('render', parents=[common], help='render simulation to video')
+    command.add_argument('--output', default='test.mpeg')
+    command.add_argument('--fps', type=int, default=20)
+    command.set_defaults(run=render)
 
-    # call the animator.  blit=True means only re-draw the parts that have changed.
-    anim = FuncAnimation(fig,
-                         draw_env,
-                         frames=range(n_max_iters),
-                         interval=100,
-                         repeat=False,
-                         blit=True)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # video of the default configuration, as before subcommands
+        args = parser.parse_args(['render'])
 
-    plt.rcParams['animation.ffmpeg_path'] = '/Users/anton/Documents/ffmpeg'
-    mywriter = FFMpegFileWriter(fps=20)
-    anim.save("test.mpeg", writer=mywriter)
+    return args
 
-    #plt.show()
 
+def main(argv=None):
+    args = parse_args(argv)
+    args.run(args)
 
 
 if __name__ == '__main__':
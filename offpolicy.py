@@ -0,0 +1,422 @@
+"""
+Offline (counterfactual) evaluation of strategies from logged routing data.
+
+Log is a .npy array of LOG records, one per payment: context, arms of the chosen cascade padded with -1,
+propensity of the logging policy to choose it, reward of each tried step (-1 if the step was not tried)
+and cascade reward. Logs are memory mapped and processed in chunks, so memory does not depend on log size.
+
+Evaluated policy is a Strategy with frozen state (e.g. restored by checkpoint.load_checkpoint).
+Thompson sampling has no closed form propensities, they are estimated by batched Monte Carlo of its decisions.
+"""
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from bandit import Strategy
+
+# key of "no cascade" decisions
+NO_CASCADE = -1
+
+
+def log_dtype(depth: int):
+    """ Record of one logged payment with cascades of at most depth steps.
+
+    :param depth:
+    :return: numpy dtype
+    """
+    return np.dtype([('context', '<i4'),
+                     ('arms', '<i2', (depth,)),
+                     ('propensity', '<f8'),
+                     ('step_rewards', 'i1', (depth,)),
+                     ('reward', 'i1')])
+
+
+def create_log(path, n_payments: int, depth: int):
+    """ Make memory mapped log file to be filled with records.
+
+    :param path: .npy file
+    :param n_payments:
+    :param depth: maximal number of cascade steps
+    :return: writable array of records
+    """
+    return open_memmap(path, mode='w+', dtype=log_dtype(depth), shape=(n_payments,))
+
+
+def open_log(path):
+    """ Memory map log file for reading.
+
+    :param path:
+    :return: array of records
+    """
+    return np.load(path, mmap_mode='r')
+
+
+def chunks(log, chunk_size: int):
+    """ Consecutive slices of the log, read from disk only when used.
+
+    :param log: array of records
+    :param chunk_size:
+    :return: generator of record arrays
+    """
+    for start in range(0, len(log), chunk_size):
+        yield log[start:start + chunk_size]
+
+
+def config_keys(arms, n_arms: int):
+    """ Encode padded cascades (n x depth) into integer keys, cascade without arms is NO_CASCADE.
+
+    :param arms:
+    :param n_arms:
+    :return:
+    """
+    arms = np.asarray(arms, dtype=np.int64)
+    keys = ((arms + 1) * (n_arms + 1) ** np.arange(arms.shape[1], dtype=np.int64)).sum(axis=1)
+    keys[arms[:, 0] < 0] = NO_CASCADE
+
+    return keys
+
+
+class ThompsonPolicy:
+    """ Distribution of cascades chosen by Strategy.choose_cascade with current statistics.
+
+    Every Monte Carlo sample repeats the decision: a cascade is built step by step, it joins TOP cascades
+    by mean if it is new and good enough, and the config is chosen by Thompson sampling among TOP.
+    The environment is not changed.
+    """
+
+    def __init__(self, strategy: Strategy, n_samples=2 ** 18, batch_size=2 ** 14, top=5, rng=None):
+        """
+        :param strategy:
+        :param n_samples: number of Monte Carlo decisions
+        :param batch_size: number of decisions sampled at once
+        :param top: number of cascades with highest mean to choose from, as at Strategy.choose_cascade
+        :param rng: seed or numpy Generator of Monte Carlo, random stream of the strategy is left untouched
+        """
+        self.strategy = strategy
+        self.env = strategy.env
+        self.top = top
+        self.n_samples = n_samples
+        self.depth = max(len(strategy.cascade_params), self.env.cascades.arms.shape[1])
+
+        strategy_rng = strategy.rng
+        strategy.rng = np.random.default_rng(rng)
+        counts = {}
+        try:
+            for start in range(0, n_samples, batch_size):
+                keys, key_counts = np.unique(self._decisions(min(batch_size, n_samples - start)),
+                                             return_counts=True)
+                for key, count in zip(keys.tolist(), key_counts.tolist()):
+                    counts[key] = counts.get(key, 0) + count
+        finally:
+            strategy.rng = strategy_rng
+
+        # sorted keys of chosen cascades and their probabilities
+        self.keys = np.array(sorted(counts), dtype=np.int64)
+        self.probs = np.array([counts[key] for key in self.keys.tolist()], dtype=float) / n_samples
+
+    def _pad(self, arms):
+        padded = np.full((len(arms), self.depth), -1, dtype=np.int64)
+        padded[:, :arms.shape[1]] = arms
+        return padded
+
+    def _decisions(self, n: int):
+        """ Sample n decisions of the strategy.
+
+        :param n:
+        :return: keys of chosen cascades
+        """
+        strategy, cascades = self.strategy, self.env.cascades
+        n_arms = self.env.n_arms
+
+        top_ids = np.array(cascades.top(self.top), dtype=np.int64)
+        top_keys = config_keys(self._pad(cascades.arms[top_ids]), n_arms)
+        k = len(top_ids)
+
+        built = self._pad(strategy.cascade_builder_batch(n))
+        built_keys = config_keys(built, n_arms)
+
+        # statistics of built cascades: unknown ones are registered with prior or remembered statistics
+        unique_keys, first, inverse = np.unique(built_keys, return_index=True, return_inverse=True)
+        new = np.zeros(len(unique_keys), dtype=bool)
+        alphas, betas = np.ones(len(unique_keys)), np.ones(len(unique_keys))
+        for i, row in enumerate(built[first].tolist()):
+            config = tuple(arm for arm in row if arm >= 0)
+            if len(config) > 0 and config not in cascades.ids:
+                new[i] = True
+                alphas[i], betas[i] = cascades.evicted.get(config, (1., 1.))
+        new, alphas, betas = new[inverse.reshape(-1)], alphas[inverse.reshape(-1)], betas[inverse.reshape(-1)]
+
+        # new cascade joins TOP only if its mean is higher than the lowest one of TOP
+        top_alphas, top_betas = cascades.posterior(top_ids)
+        if k == 0:
+            joins = new
+        else:
+            lowest_mean = top_alphas[-1] / (top_alphas[-1] + top_betas[-1])
+            joins = new & ((k < self.top) | (alphas / (alphas + betas) > lowest_mean))
+
+        candidate_keys = np.concatenate([np.broadcast_to(top_keys, (n, k)), built_keys[:, None]], axis=1)
+        candidate_alphas = np.concatenate([np.broadcast_to(top_alphas, (n, k)), alphas[:, None]], axis=1)
+        candidate_betas = np.concatenate([np.broadcast_to(top_betas, (n, k)), betas[:, None]], axis=1)
+
+        valid = np.ones((n, k + 1), dtype=bool)
+        valid[:, k] = joins
+        if k == self.top:
+            # the last of TOP is pushed out by the joining cascade
+            valid[:, k - 1] = ~joins
+
+        estimation = np.where(valid, strategy.rng.beta(candidate_alphas, candidate_betas), -1.)
+        chosen = candidate_keys[np.arange(n), estimation.argmax(axis=1)]
+        chosen[~valid.any(axis=1)] = NO_CASCADE
+
+        return chosen
+
+    def propensity(self, keys):
+        """ Probability to choose each cascade.
+
+        :param keys: config keys
+        :return: probabilities, 0 for cascades never chosen in Monte Carlo
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        position = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[position] == keys, self.probs[position], 0.)
+
+    def sample(self, n: int, rng):
+        """ Draw n decisions from the estimated distribution.
+
+        :param n:
+        :param rng: numpy Generator
+        :return: keys of chosen cascades
+        """
+        return self.keys[rng.choice(len(self.keys), n, p=self.probs)]
+
+
+def _add_by_context(values, totals, context, columns):
+    """ Add columns grouped by context to accumulators of the contexts seen so far.
+
+    Contexts are opaque ids (any, also negative, integers), they are mapped to positions with np.unique,
+    so memory grows with the number of distinct contexts only.
+
+    :param values: sorted contexts seen so far
+    :param totals: len(values) x len(columns) sums
+    :param context: context of every record of the chunk
+    :param columns: list of weights of records, None counts records
+    :return: updated values and totals
+    """
+    chunk_values, inverse = np.unique(context, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    sums = np.stack([np.bincount(inverse, weights=column, minlength=len(chunk_values)) for column in columns],
+                    axis=1)
+
+    merged = np.union1d(values, chunk_values)
+    if len(merged) > len(values):
+        grown = np.zeros((len(merged), len(columns)))
+        grown[np.searchsorted(merged, values)] = totals
+        values, totals = merged, grown
+    totals[np.searchsorted(values, chunk_values)] += sums
+
+    return values, totals
+
+
+def evaluate(log, policy: ThompsonPolicy, chunk_size=2 ** 20, max_weight=None, rng=None, by_context=False):
+    """ Estimate mean cascade reward of the policy at logged traffic.
+
+    Replay keeps payments where a decision drawn from the policy equals the logged one. Logging policy
+    is not uniform (logs are made by Thompson sampling), so kept payments are weighted by inverse logged
+    propensity and normalized by the sum of these weights, which makes replay consistent for any logging policy.
+    IPS weights logged rewards by policy / logging propensity, SNIPS normalizes the weights.
+    Direct method uses mean logged reward of each cascade as reward model, doubly robust corrects
+    it by weighted residuals. The log is read twice: reward model first, then estimates.
+
+    :param log: array of LOG records, e.g. open_log(path)
+    :param policy:
+    :param chunk_size: number of records processed at once
+    :param max_weight: clip importance weights, not clipped if None
+    :param rng: seed or numpy Generator of replay decisions
+    :param by_context: also estimate for every context (IPS, SNIPS and doubly robust)
+    :return: dictionary of estimates, estimates of contexts are given in order of sorted context values
+    """
+    rng = np.random.default_rng(rng)
+    n_arms = policy.env.n_arms
+
+    # reward model: mean logged reward of each cascade
+    model_sum, model_count = {}, {}
+    for chunk in chunks(log, chunk_size):
+        keys = config_keys(chunk['arms'], n_arms)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inverse.reshape(-1), weights=chunk['reward'].astype(float))
+        counts = np.bincount(inverse.reshape(-1))
+        for key, reward_sum, count in zip(unique_keys.tolist(), sums.tolist(), counts.tolist()):
+            model_sum[key] = model_sum.get(key, 0.) + reward_sum
+            model_count[key] = model_count.get(key, 0) + count
+
+    model_keys = np.array(sorted(model_sum), dtype=np.int64)
+    model_rewards = np.array([model_sum[key] / model_count[key] for key in model_keys.tolist()])
+
+    def reward_model(keys):
+        if len(model_keys) == 0:
+            return np.zeros(len(keys))
+        position = np.minimum(np.searchsorted(model_keys, keys), len(model_keys) - 1)
+        return np.where(model_keys[position] == keys, model_rewards[position], 0.)
+
+    # policy value by reward model does not depend on context
+    direct = float((policy.probs * reward_model(policy.keys)).sum())
+
+    n = replay_count = 0
+    replay_sum = replay_weight = 0.
+    ips_sum = weight_sum = weight_square_sum = dr_sum = 0.
+    # per context sums of records, IPS, weights and doubly robust terms
+    context_values = np.zeros(0, dtype=np.int64)
+    context_sums = np.zeros((0, 4))
+    step_sums = np.zeros(log.dtype['arms'].shape[0])
+
+    for chunk in chunks(log, chunk_size):
+        keys = config_keys(chunk['arms'], n_arms)
+        rewards = chunk['reward'].astype(float)
+
+        matched = policy.sample(len(chunk), rng) == keys
+        replay_weights = 1. / chunk['propensity'][matched]
+        replay_sum += (replay_weights * rewards[matched]).sum()
+        replay_weight += replay_weights.sum()
+        replay_count += int(matched.sum())
+
+        weights = policy.propensity(keys) / chunk['propensity']
+        if max_weight is not None:
+            weights = np.minimum(weights, max_weight)
+
+        ips = weights * rewards
+        dr = direct + weights * (rewards - reward_model(keys))
+
+        n += len(chunk)
+        ips_sum += ips.sum()
+        weight_sum += weights.sum()
+        weight_square_sum += (weights * weights).sum()
+        dr_sum += dr.sum()
+        step_sums += (weights[:, None] * (chunk['step_rewards'] == 1)).sum(axis=0)
+
+        if by_context:
+            context_values, context_sums = _add_by_context(context_values, context_sums,
+                                                           chunk['context'].astype(np.int64),
+                                                           [None, ips, weights, dr])
+
+    result = {'n': n,
+              'replay': replay_sum / replay_weight if replay_weight > 0 else np.nan,
+              'replay_matched': replay_count,
+              'ips': ips_sum / n if n > 0 else np.nan,
+              'snips': ips_sum / weight_sum if weight_sum > 0 else np.nan,
+              'direct': direct,
+              'dr': dr_sum / n if n > 0 else np.nan,
+              # effective sample size of importance weights
+              'ess': weight_sum ** 2 / weight_square_sum if weight_square_sum > 0 else 0.,
+              # IPS estimate of success probability at each cascade step
+              'step_success': step_sums / n if n > 0 else step_sums}
+
+    if by_context:
+        counts, ips, weights, dr = context_sums.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result['context'] = {'values': context_values,
+                                 'n': counts.astype(np.int64),
+                                 'ips': ips / counts,
+                                 'snips': ips / weights,
+                                 'dr': dr / counts}
+
+    return result
+
+
+class _StepRecorder:
+    """ Event log hook keeping rewards of cascade steps of the last payment, other events go to the attached log.
+    """
+
+    def __init__(self, event_log, depth: int):
+        self.event_log = event_log
+        self.step_rewards = np.full(depth, -1, dtype=np.int8)
+
+    def constraint(self, *args):
+        if self.event_log is not None:
+            self.event_log.constraint(*args)
+
+    def register(self, *args):
+        if self.event_log is not None:
+            self.event_log.register(*args)
+
+    def decision(self, *args):
+        self.step_rewards[:] = -1
+        if self.event_log is not None:
+            self.event_log.decision(*args)
+
+    def step(self, iteration, config_id, arm, check_step, reward):
+        self.step_rewards[check_step] = reward
+        if self.event_log is not None:
+            self.event_log.step(iteration, config_id, arm, check_step, reward)
+
+    def repeated(self, *args):
+        if self.event_log is not None:
+            self.event_log.repeated(*args)
+
+    def evict(self, *args):
+        if self.event_log is not None:
+            self.event_log.evict(*args)
+
+    def admit(self, *args):
+        if self.event_log is not None:
+            self.event_log.admit(*args)
+
+    def cascade(self, *args):
+        if self.event_log is not None:
+            self.event_log.cascade(*args)
+
+
+def log_simulation(path, bandit, n_payments: int, policy_every=1, context=0, n_samples=2 ** 12, **policy_kwargs):
+    """ Run bandit at its test environment and log payments with Monte Carlo propensities.
+
+    Propensities are estimated for the strategy state before payments, so the log can be used to check
+    estimators against known simulated conversion. The strategy learns from every payment, propensities
+    estimated less often than every payment are stale and bias the estimators, so by default they are
+    estimated at every payment by fewer Monte Carlo samples than ThompsonPolicy takes for evaluation:
+    about 10 ms per payment instead of about a second.
+
+    :param path: .npy file
+    :param bandit: Bandit of TestEnvironment
+    :param n_payments:
+    :param policy_every: payments between propensity estimates, 1 for exact logging propensities
+    :param context: context written to every record
+    :param n_samples: number of Monte Carlo decisions of each propensity estimate,
+        propensities are known up to 1 / n_samples
+    :param policy_kwargs: see ThompsonPolicy
+    :return: memory mapped log
+    """
+    env = bandit.env
+    depth = len(bandit.strategy.cascade_params)
+    log = create_log(path, n_payments, depth)
+    log['context'] = context
+    log['arms'] = -1
+    log['step_rewards'] = -1
+    log['reward'] = 0
+
+    recorder = _StepRecorder(env.event_log, depth)
+    env.event_log = recorder
+    try:
+        policy = None
+        arms = np.full((1, depth), -1, dtype=np.int64)
+        for i in range(n_payments):
+            if i % policy_every == 0:
+                policy = ThompsonPolicy(bandit.strategy, n_samples=n_samples, **policy_kwargs)
+
+            cascade, reward = bandit.action()
+
+            arms[:] = -1
+            if cascade is not None:
+                arm_list = env.cascades.configs[cascade]
+                arms[0, :len(arm_list)] = arm_list
+                log['arms'][i] = arms[0]
+                log['step_rewards'][i] = recorder.step_rewards
+                log['reward'][i] = reward
+
+            # cascades missed by Monte Carlo get the smallest propensity it can tell
+            log['propensity'][i] = max(float(policy.propensity(config_keys(arms, env.n_arms))[0]),
+                                       1. / policy.n_samples)
+    finally:
+        env.event_log = recorder.event_log
+
+    log.flush()
+
+    return log
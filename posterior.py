@@ -0,0 +1,69 @@
+"""
+Beta posterior curves for plotting.
+
+PDFs of all arms are evaluated at once in log space over a shared grid and memoized by (alpha, beta).
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from scipy.special import gammaln, xlog1py, xlogy
+
+
+class BetaCurves:
+    """ LRU cache of beta PDFs over a fixed grid.
+
+    Posterior of an arm changes only when it is paid, so most curves are taken from the cache between frames.
+    """
+
+    def __init__(self, x, max_size=1024):
+        """
+        :param x: grid on [0, 1]
+        :param max_size: number of cached curves
+        """
+        self.x = np.asarray(x, dtype=float)
+        self.max_size = max_size
+
+        self._curves = OrderedDict()
+
+    def __len__(self):
+        return len(self._curves)
+
+    def evaluate(self, alphas, betas):
+        """ Beta PDFs over the grid without caching.
+
+        :param alphas:
+        :param betas:
+        :return: len(alphas) x len(x) array
+        """
+        a = np.asarray(alphas, dtype=float)[:, None]
+        b = np.asarray(betas, dtype=float)[:, None]
+        log_norm = gammaln(a + b) - gammaln(a) - gammaln(b)
+
+        return np.exp(xlogy(a - 1, self.x) + xlog1py(b - 1, -self.x) + log_norm)
+
+    def pdf(self, alphas, betas):
+        """ Beta PDFs of all arms, only new (alpha, beta) pairs are evaluated.
+
+        :param alphas:
+        :param betas:
+        :return: list of curves and array of their maximums
+        """
+        keys = list(zip(np.asarray(alphas, dtype=float).tolist(), np.asarray(betas, dtype=float).tolist()))
+
+        missing = [key for key in dict.fromkeys(keys) if key not in self._curves]
+        if len(missing) > 0:
+            curves = self.evaluate(*zip(*missing))
+            curves.flags.writeable = False
+            for key, y, y_max in zip(missing, curves, curves.max(axis=1).tolist()):
+                self._curves[key] = (y, y_max)
+
+        result = []
+        for key in keys:
+            self._curves.move_to_end(key)
+            result.append(self._curves[key])
+
+        while len(self._curves) > self.max_size:
+            self._curves.popitem(last=False)
+
+        return [y for y, _ in result], np.array([y_max for _, y_max in result])
@@ -0,0 +1,180 @@
+"""
+Offline rendering of recorded simulation snapshots.
+
+Frames are drawn with Agg backend in a process pool and either piped as raw RGB to ffmpeg
+or saved as PNG image sequence, so no display is needed. Plotting stack is imported only when rendering starts.
+"""
+
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from os import cpu_count
+
+import numpy as np
+
+# Drawing objects of the worker process
+_figure = None
+_drawer = None
+
+
+def running_y_max(snapshots, x, y_max=5):
+    """ Height of posterior plots at each frame, same as DrawEnvironment grows it frame by frame.
+
+    Frames are drawn by independent processes, so the height is found in advance.
+
+    :param snapshots:
+    :param x: grid of DrawEnvironment
+    :param y_max: initial height
+    :return: list of heights
+    """
+    from posterior import BetaCurves
+
+    curves = BetaCurves(x)
+
+    heights = []
+    for snapshot in snapshots:
+        _, maximums = curves.pdf(np.concatenate([snapshot.primary_alphas, snapshot.repeated_alphas]),
+                                 np.concatenate([snapshot.primary_betas, snapshot.repeated_betas]))
+        for y in maximums:
+            if y > y_max:
+                y_max = y + 5
+        heights.append(y_max)
+
+    return heights
+
+
+def _init_worker(arms_proba, failure, figsize, dpi):
+    global _figure, _drawer
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    from visualisation import DrawEnvironment
+
+    _figure, ax = plt.subplots(2, 2, figsize=figsize, dpi=dpi)
+    _drawer = DrawEnvironment(ax, arms_proba=arms_proba, failure=failure)
+
+
+def _draw_frame(snapshot, y_max):
+    _drawer.y_max = y_max
+    _drawer.draw(snapshot)
+    _figure.canvas.draw()
+
+    return np.asarray(_figure.canvas.buffer_rgba())[:, :, :3]
+
+
+def _render_chunk(chunk):
+    """ Draw frames and return them as one raw RGB byte string.
+    """
+    return b''.join([_draw_frame(snapshot, y_max).tobytes() for snapshot, y_max in chunk])
+
+
+def _save_chunk(chunk):
+    """ Draw frames and save them as PNG files.
+    """
+    for snapshot, y_max, path in chunk:
+        _drawer.y_max = y_max
+        _drawer.draw(snapshot)
+        _figure.savefig(path)
+
+    return len(chunk)
+
+
+def _frame_size(figsize, dpi):
+    return int(round(figsize[0] * dpi)), int(round(figsize[1] * dpi))
+
+
+def _chunks(items, n_workers, chunk_size):
+    if chunk_size is None:
+        chunk_size = max(1, min(64, ceil(len(items) / (4 * n_workers))))
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def render_png_sequence(snapshots, arms_proba, failure, frames_dir, n_workers=None, figsize=(20, 12), dpi=50,
+                        chunk_size=None):
+    """ Save every snapshot as frames_dir/frame_000000.png.
+
+    :param snapshots: SimulationTrace.snapshots
+    :param arms_proba: TestEnvironment.arms_proba
+    :param failure: TestEnvironment.failure
+    :param frames_dir:
+    :param n_workers: number of processes, all cores by default
+    :param figsize:
+    :param dpi:
+    :param chunk_size: frames per task
+    :return: list of frame paths
+    """
+    n_workers = n_workers or cpu_count() or 1
+    os.makedirs(frames_dir, exist_ok=True)
+
+    heights = running_y_max(snapshots, np.linspace(0, 1, 500))
+    paths = [os.path.join(frames_dir, 'frame_%06d.png' % i) for i in range(len(snapshots))]
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(arms_proba, failure, figsize, dpi)) as executor:
+        for _ in executor.map(_save_chunk, _chunks(list(zip(snapshots, heights, paths)), n_workers, chunk_size)):
+            pass
+
+    return paths
+
+
+def render_video(snapshots, arms_proba, failure, output, ffmpeg=None, fps=20, n_workers=None, figsize=(20, 12),
+                 dpi=50, chunk_size=None):
+    """ Pipe frames drawn in parallel as raw RGB to ffmpeg in order.
+
+    :param snapshots: SimulationTrace.snapshots
+    :param arms_proba: TestEnvironment.arms_proba
+    :param failure: TestEnvironment.failure
+    :param output: video file, codec is chosen by ffmpeg from extension
+    :param ffmpeg: path of ffmpeg executable
+    :param fps:
+    :param n_workers: number of processes, all cores by default
+    :param figsize:
+    :param dpi:
+    :param chunk_size: frames per task
+    :return: output
+    """
+    n_workers = n_workers or cpu_count() or 1
+    width, height = _frame_size(figsize, dpi)
+
+    heights = running_y_max(snapshots, np.linspace(0, 1, 500))
+
+    command = [ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height), '-r', str(fps),
+               '-i', '-', '-pix_fmt', 'yuv420p', output]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(arms_proba, failure, figsize, dpi)) as executor:
+            for frames in executor.map(_render_chunk, _chunks(list(zip(snapshots, heights)), n_workers, chunk_size)):
+                process.stdin.write(frames)
+    finally:
+        process.stdin.close()
+        process.wait()
+
+    if process.returncode != 0:
+        raise RuntimeError('ffmpeg failed with code ' + str(process.returncode))
+
+    return output
+
+
+def export(snapshots, arms_proba, failure, output, ffmpeg=None, **kwargs):
+    """ Render video with ffmpeg if it is available, PNG image sequence otherwise.
+
+    :param snapshots: SimulationTrace.snapshots
+    :param arms_proba: TestEnvironment.arms_proba
+    :param failure: TestEnvironment.failure
+    :param output: video file, image sequence is saved to directory named after it
+    :param ffmpeg: path of ffmpeg executable, found in PATH by default
+    :param kwargs: see render_video
+    :return: output file or list of frame paths
+    """
+    ffmpeg = ffmpeg or os.environ.get('FFMPEG_PATH') or shutil.which('ffmpeg')
+    if ffmpeg is not None:
+        return render_video(snapshots, arms_proba, failure, output, ffmpeg=ffmpeg, **kwargs)
+
+    kwargs.pop('fps', None)
+    return render_png_sequence(snapshots, arms_proba, failure, os.path.splitext(output)[0] + '_frames', **kwargs)
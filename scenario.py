@@ -0,0 +1,305 @@
+"""
+Non-stationary scenarios of bank behaviour streamed into the environment.
+
+Scenario is an iterable of events sorted by iteration. Events are taken one by one when
+their iteration comes, so endless generators and large scenario files run in constant memory.
+
+Event is a dictionary with iteration 'at', 'type' and parameters of the type:
+    proba     arm, primary and/or repeated success probability
+    outage    arm, duration: capacity is taken away and returned after duration iterations
+    refill    arm, amount added to capacity
+    capacity  arm, value of capacity
+    traffic   rate: number of payments in each following iteration
+"""
+
+import json
+from heapq import heappop, heappush, merge as heap_merge
+from itertools import count
+
+import numpy as np
+
+from bandit import Bandit
+
+# capacity of the bank during outage, same as at TestEnvironment.delete_bank
+OUTAGE_CAPACITY = -100
+
+
+def read_scenario(path):
+    """ Stream events from JSON lines file, blank lines and lines starting with # are skipped.
+
+    :param path:
+    :return: generator of events
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) > 0 and not line.startswith('#'):
+                yield json.loads(line)
+
+
+def write_scenario(events, path):
+    """ Save events as JSON lines file.
+
+    :param events: iterable of events, must be finite
+    :param path:
+    :return:
+    """
+    with open(path, 'w') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+
+def merge(*scenarios):
+    """ Merge sorted scenarios into one sorted scenario lazily.
+
+    :param scenarios:
+    :return: generator of events
+    """
+    return heap_merge(*scenarios, key=lambda event: event['at'])
+
+
+def linear_drift(arm: int, start: int, end: int, begin_proba: float, end_proba: float, every=100,
+                 kind='primary'):
+    """ Success probability of the arm changing linearly from start to end iteration.
+
+    :param arm:
+    :param start:
+    :param end:
+    :param begin_proba:
+    :param end_proba:
+    :param every: iterations between changes
+    :param kind: 'primary' or 'repeated'
+    :return: generator of events
+    """
+    for at in range(start, end, every):
+        proba = begin_proba + (end_proba - begin_proba) * (at - start) / (end - start)
+        yield {'at': at, 'type': 'proba', 'arm': arm, kind: proba}
+    yield {'at': end, 'type': 'proba', 'arm': arm, kind: end_proba}
+
+
+def daily_cycle(arm: int, mean: float, amplitude: float, period=86400, every=600, start=0, stop=None,
+                kind='primary'):
+    """ Success probability of the arm following sine wave, endless if stop is not given.
+
+    :param arm:
+    :param mean:
+    :param amplitude:
+    :param period: iterations in one cycle
+    :param every: iterations between changes
+    :param start:
+    :param stop:
+    :param kind: 'primary' or 'repeated'
+    :return: generator of events
+    """
+    at = start
+    while stop is None or at < stop:
+        proba = mean + amplitude * np.sin(2 * np.pi * (at - start) / period)
+        yield {'at': at, 'type': 'proba', 'arm': arm, kind: float(min(max(proba, 0.), 1.))}
+        at += every
+
+
+def random_outages(n_arms: int, mean_interval: float, mean_duration: float, start=0, stop=None, rng=None):
+    """ Outages of random arms at exponentially distributed intervals, endless if stop is not given.
+
+    :param n_arms:
+    :param mean_interval: mean iterations between outages
+    :param mean_duration: mean duration of an outage
+    :param start:
+    :param stop:
+    :param rng: seed, SeedSequence or numpy Generator
+    :return: generator of events
+    """
+    rng = np.random.default_rng(rng)
+    at = start
+    while True:
+        at += 1 + int(rng.exponential(mean_interval))
+        if stop is not None and at >= stop:
+            return
+        yield {'at': at, 'type': 'outage', 'arm': int(rng.integers(n_arms)),
+               'duration': 1 + int(rng.exponential(mean_duration))}
+
+
+def periodic_refills(arm: int, every: int, amount: int, start=0, stop=None):
+    """ Capacity of the arm increased every given number of iterations, endless if stop is not given.
+
+    :param arm:
+    :param every:
+    :param amount:
+    :param start:
+    :param stop:
+    :return: generator of events
+    """
+    at = start
+    while stop is None or at < stop:
+        yield {'at': at, 'type': 'refill', 'arm': arm, 'amount': amount}
+        at += every
+
+
+def bursts(every: int, duration: int, rate: int, base_rate=1, start=0, stop=None):
+    """ Traffic rising to rate payments per iteration for duration iterations, endless if stop is not given.
+
+    :param every: iterations between burst starts
+    :param duration: not longer than every, so a burst ends before the next one starts
+    :param rate: payments per iteration during burst
+    :param base_rate: payments per iteration between bursts
+    :param start:
+    :param stop:
+    :return: generator of events
+    """
+    # overlapping bursts would return base rate in the middle of the next burst and break order of events
+    if duration > every:
+        raise ValueError('Burst duration ' + str(duration) + ' is longer than interval between bursts ' + str(every))
+
+    return _bursts(every, duration, rate, base_rate, start, stop)
+
+
+def _bursts(every: int, duration: int, rate: int, base_rate: int, start: int, stop):
+    at = start
+    while stop is None or at < stop:
+        yield {'at': at, 'type': 'traffic', 'rate': rate}
+        yield {'at': at + duration, 'type': 'traffic', 'rate': base_rate}
+        at += every
+
+
+class ScenarioDriver:
+    """ Run bandit at environment changing by scenario.
+
+    Built-in failure simulation of the environment is not used, outages come from the scenario.
+    Nothing is kept per payment, statistics are summed over windows of iterations.
+    """
+
+    def __init__(self, bandit: Bandit, scenario):
+        self.bandit = bandit
+        self.env = bandit.env
+
+        # probabilities are changed by the scenario, lists given to the environment are left as they were
+        self.env.arms_proba = {kind: list(proba) for kind, proba in self.env.arms_proba.items()}
+
+        self.events = iter(scenario)
+        self._next_event = next(self.events, None)
+
+        # heap of (iteration, order, arm, capacity) of banks to return after outage
+        self._restores = []
+        self._order = count()
+
+        self.iteration = 0
+        self.rate = 1
+
+    def _set_constraint(self, arm: int, value):
+        env = self.env
+        env.set_constraint(arm, value)
+        if env.event_log is not None:
+            env.event_log.constraint(env.n_cascade_payments, arm, int(value))
+
+    def apply(self, event: dict):
+        """ Change environment by the event.
+
+        :param event:
+        :return:
+        """
+        env = self.env
+        kind = event['type']
+
+        if kind == 'proba':
+            for step_kind in ('primary', 'repeated'):
+                if step_kind in event:
+                    env.set_arm_proba(step_kind, event['arm'], event[step_kind])
+        elif kind == 'outage':
+            arm = event['arm']
+            if env.constraints[arm] > OUTAGE_CAPACITY:
+                heappush(self._restores, (self.iteration + event['duration'], next(self._order),
+                                          arm, int(env.constraints[arm])))
+                self._set_constraint(arm, OUTAGE_CAPACITY)
+        elif kind == 'refill':
+            self._refill(event['arm'], event['amount'])
+        elif kind == 'capacity':
+            self._set_constraint(event['arm'], event['value'])
+        elif kind == 'traffic':
+            self.rate = event['rate']
+        else:
+            raise ValueError('Unknown scenario event type: ' + str(kind))
+
+    def _refill(self, arm: int, amount: int):
+        """ Add capacity, capacity of bank under outage is added to the one it returns with.
+        """
+        for i, (at, order, restore_arm, capacity) in enumerate(self._restores):
+            if restore_arm == arm:
+                self._restores[i] = (at, order, arm, capacity + amount)
+                return
+
+        self._set_constraint(arm, self.env.constraints[arm] + amount)
+
+    def step(self):
+        """ Apply events of current iteration.
+
+        :return:
+        """
+        while len(self._restores) > 0 and self._restores[0][0] <= self.iteration:
+            _, _, arm, capacity = heappop(self._restores)
+            self._set_constraint(arm, capacity)
+
+        while self._next_event is not None and self._next_event['at'] <= self.iteration:
+            self.apply(self._next_event)
+            self._next_event = next(self.events, None)
+
+    def finished(self):
+        """ True if no cascade can be played any more.
+
+        :return:
+        """
+        return len(self.env.get_cascade_config()) == 0 and len(self._restores) == 0 and self._next_event is None
+
+    def best_proba(self):
+        """ Success probability of the best available bank at the first step.
+
+        :return:
+        """
+        available = self.env.constraints > 0
+        if not available.any():
+            return 0.
+        return float(np.max(np.asarray(self.env.arms_proba['primary'])[available]))
+
+    def run(self, n_iters: int, window=1000):
+        """ Simulate n_iters iterations, each makes number of payments given by traffic rate.
+
+        Stops early if there is no cascade to play and the scenario is over.
+
+        :param n_iters: number of iterations
+        :param window: number of iterations in one summary
+        :return: generator of window summaries: first iteration, number of payments, successes,
+            conversion and expected conversion of always paying through the best available bank
+        """
+        env = self.env
+        stop = self.iteration + n_iters
+
+        while self.iteration < stop:
+            first = self.iteration
+            n_payments = n_success = 0
+            best_success = 0.
+
+            for _ in range(min(window, stop - first)):
+                self.step()
+
+                best_proba = self.best_proba()
+                cascade = None
+                for _ in range(self.rate):
+                    cascade, reward = self.bandit.action()
+                    if cascade is None:
+                        break
+
+                    n_payments += 1
+                    n_success += reward
+                    best_success += best_proba
+
+                self.iteration += 1
+
+                if cascade is None and self.finished():
+                    stop = self.iteration
+                    break
+
+            yield {'iteration': first,
+                   'n_payments': n_payments,
+                   'n_success': n_success,
+                   'conversion': n_success / n_payments if n_payments > 0 else 0.,
+                   'best_conversion': best_success / n_payments if n_payments > 0 else 0.,
+                   'n_cascade_payments': env.n_cascade_payments}
@@ -0,0 +1,278 @@
+"""
+Online routing service: decisions and asynchronous feedback from payment gateway.
+"""
+
+import asyncio
+from time import perf_counter
+
+import numpy as np
+
+from bandit import Strategy
+
+
+class RoutingService:
+    """ Split of Bandit.action into decision and feedback.
+
+    Feedback of a cascade step updates the same Thompson Sampling state as TestEnvironment.play_cascade:
+    the first step updates primary statistics, the cascade statistics are updated after success
+    or after the last step.
+
+    Pending cascades are kept as arms, not config ids: a config may be evicted from a bounded pool and its id
+    reused before feedback comes, such config is admitted back with its remembered statistics.
+    """
+
+    def __init__(self, strategy: Strategy):
+        self.strategy = strategy
+        self.env = strategy.env
+
+        # request id -> tuple of arms of cascades waiting for feedback
+        self.pending = {}
+
+    def decide(self, request_id):
+        """ Choose cascade for payment.
+
+        :param request_id:
+        :return: tuple of arms to try one by one or None if there is no cascade available
+        """
+        config_id = self.strategy.choose_cascade()
+        if config_id is None:
+            return None
+
+        arm_list = self.pending[request_id] = self.env.cascades.configs[config_id]
+
+        return arm_list
+
+    def report(self, request_id, step: int, reward: int):
+        """ Apply result of a cascade step.
+
+        :param request_id:
+        :param step: position of arm in the cascade
+        :param reward:
+        :return: True if the cascade is finished
+        """
+        arm_list = self.pending[request_id]
+
+        if step == 0:
+            self.env.update_primary_reward(arm_list[0], reward)
+
+        if reward == 1 or step == len(arm_list) - 1:
+            del self.pending[request_id]
+            self.env.update_cascade_reward(self.env.update_cascade_config(arm_list), reward)
+            return True
+
+        return False
+
+    def report_repeated(self, arm: int, reward: int):
+        """ Apply result of a repeated (token) payment.
+
+        :param arm:
+        :param reward:
+        :return:
+        """
+        self.env.update_repeated_reward(arm, reward)
+
+    def decide_batch(self, request_ids):
+        """ Choose cascades for a micro-batch of payments in one call.
+
+        :param request_ids:
+        :return: list of tuples of arms, None for payments without available cascade
+        """
+        config_ids = self._choose_batch(len(request_ids))
+
+        cascades = []
+        for request_id, config_id in zip(request_ids, config_ids.tolist()):
+            if config_id < 0:
+                cascades.append(None)
+            else:
+                arm_list = self.pending[request_id] = self.env.cascades.configs[config_id]
+                cascades.append(arm_list)
+
+        return cascades
+
+    def _choose_batch(self, n: int):
+        return self.strategy.choose_cascades(n)
+
+    def report_batch(self, request_ids, steps, rewards):
+        """ Apply results of many cascade steps with one bulk update of statistics.
+
+        :param request_ids:
+        :param steps: position of arm in the cascade of each result
+        :param rewards:
+        :return: list of True for results which finished their cascades
+        """
+        primary_arms, primary_rewards = [], []
+        finished_configs, finished_rewards = [], []
+        finished = []
+        for request_id, step, reward in zip(request_ids, steps, rewards):
+            arm_list = self.pending[request_id]
+
+            if step == 0:
+                primary_arms.append(arm_list[0])
+                primary_rewards.append(reward)
+
+            done = reward == 1 or step == len(arm_list) - 1
+            if done:
+                del self.pending[request_id]
+                finished_configs.append(arm_list)
+                finished_rewards.append(reward)
+            finished.append(done)
+
+        self.env.update_primary_rewards(primary_arms, primary_rewards)
+        self._update_cascades(finished_configs, finished_rewards)
+
+        return finished
+
+    def _update_cascades(self, configs, rewards):
+        """ Update statistics of finished cascades given by arms.
+
+        :param configs: tuples of arms
+        :param rewards:
+        :return:
+        """
+        ids = self.env.cascades.ids
+        if all(config in ids for config in configs):
+            self.env.update_cascade_rewards([ids[config] for config in configs], rewards)
+        else:
+            # admitting evicted configs back may evict others, so ids are taken one by one
+            for config, reward in zip(configs, rewards):
+                self.env.update_cascade_reward(self.env.update_cascade_config(config), reward)
+
+    def report_repeated_batch(self, arms, rewards):
+        """ Apply results of many repeated (token) payments at once.
+
+        :param arms:
+        :param rewards:
+        :return:
+        """
+        self.env.update_repeated_rewards(arms, rewards)
+
+
+class AsyncRoutingService:
+    """ Asyncio front end of RoutingService.
+
+    Decisions are answered immediately, feedback is queued and applied in batches by a background task.
+    A result which fails to apply does not stop the task, the first error is raised by stop.
+    """
+
+    def __init__(self, service: RoutingService):
+        self.service = service
+
+        self.feedback = asyncio.Queue()
+        self._worker = None
+        self.error = None
+
+    async def start(self):
+        self._worker = asyncio.create_task(self._apply_feedback())
+
+    async def stop(self):
+        """ Apply remaining feedback and stop background task.
+
+        Raises the first error of applying feedback, if any.
+        :return:
+        """
+        await self.feedback.join()
+        self._worker.cancel()
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    async def decide(self, request_id):
+        return self.service.decide(request_id)
+
+    def report(self, request_id, step: int, reward: int):
+        self.feedback.put_nowait((request_id, step, reward))
+
+    def report_repeated(self, arm: int, reward: int):
+        self.feedback.put_nowait((None, arm, reward))
+
+    async def _apply_feedback(self):
+        queue = self.feedback
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+
+            for request_id, step, reward in batch:
+                try:
+                    if request_id is None:
+                        self.service.report_repeated(step, reward)
+                    else:
+                        self.service.report(request_id, step, reward)
+                except Exception as error:
+                    if self.error is None:
+                        self.error = error
+                finally:
+                    # stop waits for every queued result to be marked done
+                    queue.task_done()
+
+
+class FakeGateway:
+    """ Local payment gateway answering with the model of TestEnvironment.play_cascade.
+    """
+
+    def __init__(self, primary_arms_proba: list, repeated_arms_proba: list, delay=0.001, rng=None):
+        self.arms_proba = {'primary': primary_arms_proba,
+                           'repeated': repeated_arms_proba}
+        self.delay = delay
+
+        self.rng = np.random.default_rng(rng)
+
+    async def pay(self, front: AsyncRoutingService, request_id, cascade):
+        """ Try cascade arms one by one and report every result.
+
+        :param front:
+        :param request_id:
+        :param cascade: tuple of arms
+        :return: cascade reward
+        """
+        proba_list = self.arms_proba['primary']
+
+        previous_proba = 0
+        reward = 0
+        for step, arm in enumerate(cascade):
+            await asyncio.sleep(self.delay)
+
+            reward = int(self.rng.random() < proba_list[arm] - previous_proba)
+            previous_proba = proba_list[arm]
+            front.report(request_id, step, reward)
+
+            if reward == 1:
+                for _ in range(int(self.rng.gamma(1, 2))):
+                    front.report_repeated(arm, int(self.rng.random() < self.arms_proba['repeated'][arm]))
+                break
+
+        return reward
+
+
+async def run_fake_traffic(front: AsyncRoutingService, gateway: FakeGateway, n_requests: int, rate: float):
+    """ Send n_requests payments with given rate (per second) through the service.
+
+    :param front:
+    :param gateway:
+    :param n_requests:
+    :param rate:
+    :return: decision latencies in seconds
+    """
+    latencies = np.zeros(n_requests)
+    payments = []
+    interval = 1. / rate
+
+    await front.start()
+    start = perf_counter()
+    for request_id in range(n_requests):
+        delay = start + request_id * interval - perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        decision_start = perf_counter()
+        cascade = await front.decide(request_id)
+        latencies[request_id] = perf_counter() - decision_start
+
+        if cascade is not None:
+            payments.append(asyncio.create_task(gateway.pay(front, request_id, cascade)))
+
+    await asyncio.gather(*payments)
+    await front.stop()
+
+    return latencies
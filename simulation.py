@@ -0,0 +1,188 @@
+"""
+Headless simulation of the bandit at environment.
+Runs payments without any plotting and keeps a compact trace of the run.
+"""
+
+import numpy as np
+
+from bandit import Bandit
+
+
+class Snapshot:
+    """ Copy of the bandit state used to draw one visualisation frame.
+    """
+
+    def __init__(self, bandit: Bandit, iteration: int, failure_message=None):
+        env = bandit.env
+
+        self.iteration = iteration
+        self.cascade_params = list(bandit.strategy.cascade_params)
+        self.failure_message = failure_message
+
+        self.n_payments = env.n_payments
+        self.n_success = env.n_success
+
+        self.n_primary_payments = env.n_primary_payments
+        self.n_primary_success = env.n_primary_success
+
+        self.n_repeated_payments = env.n_repeated_payments
+        self.n_repeated_success = env.n_repeated_success
+
+        self.n_cascade_payments = env.n_cascade_payments
+        self.n_cascade_success = env.n_cascade_success
+
+        self.constraints = np.array(env.constraints)
+
+        self.primary_alphas = env.primary_alphas.copy()
+        self.primary_betas = env.primary_betas.copy()
+
+        self.repeated_alphas = env.repeated_alphas.copy()
+        self.repeated_betas = env.repeated_betas.copy()
+
+        cascades = env.cascades
+        self.top_cascades = cascades.keys(env.get_cascade_mean(5))
+
+        self.table = [[cascades.key(c),
+                       str(round(cascades.means[c] * 100, 1)) + '%',
+                       int(cascades.alphas[c]),
+                       int(cascades.betas[c]),
+                       int(cascades.alphas[c] + cascades.betas[c])]
+                      for c in cascades.most_paid]
+
+
+class SimulationTrace:
+    """ Compact per-iteration record of a simulation run.
+
+    Cascades are stored as positions in `configs`, arms of every played config in order of its first play,
+    -1 means no cascade was available. Arms are taken when the cascade is played, because ids of
+    the environment CascadeRegistry are reused after eviction from a bounded pool.
+    """
+
+    def __init__(self, n_iters: int, n_arms: int, record_constraints=False):
+        self.n_iters = 0
+        self.configs = []
+        # config -> position in configs
+        self._positions = {}
+
+        self.cascade = np.full(n_iters, -1, dtype=np.int32)
+        self.reward = np.zeros(n_iters, dtype=np.int8)
+        self.repeated_payments = np.zeros(n_iters, dtype=np.int32)
+        self.repeated_success = np.zeros(n_iters, dtype=np.int32)
+
+        if record_constraints:
+            self.constraints = np.zeros((n_iters, n_arms), dtype=np.int32)
+        else:
+            self.constraints = None
+
+        self.snapshots = []
+
+    def record(self, i, cascade, reward, repeated_payments, repeated_success, constraints):
+        """ Save result of the i-th payment.
+
+        :param i: iteration number
+        :param cascade: tuple of arms of played cascade or None
+        :param reward: cascade reward
+        :param repeated_payments: number of repeated payments made during the iteration
+        :param repeated_success: number of successful repeated payments
+        :param constraints: constraints after the payment
+        :return:
+        """
+        if cascade is not None:
+            position = self._positions.get(cascade)
+            if position is None:
+                position = self._positions[cascade] = len(self.configs)
+                self.configs.append(cascade)
+            self.cascade[i] = position
+            self.reward[i] = reward
+
+        self.repeated_payments[i] = repeated_payments
+        self.repeated_success[i] = repeated_success
+
+        if self.constraints is not None:
+            self.constraints[i] = constraints
+
+        self.n_iters = i + 1
+
+    def truncate(self):
+        """ Drop unused tail of the preallocated arrays.
+        :return:
+        """
+        n = self.n_iters
+        self.cascade = self.cascade[:n]
+        self.reward = self.reward[:n]
+        self.repeated_payments = self.repeated_payments[:n]
+        self.repeated_success = self.repeated_success[:n]
+        if self.constraints is not None:
+            self.constraints = self.constraints[:n]
+
+    def cascade_configs(self):
+        """ Return played cascade config string for each iteration (None if nothing was played).
+        :return:
+        """
+        return [' '.join([str(x) for x in self.configs[c]]) if c >= 0 else None for c in self.cascade]
+
+
+class Simulation:
+    """ Run bandit at environment without drawing.
+    """
+
+    def __init__(self, bandit: Bandit):
+        self.bandit = bandit
+        self.env = bandit.env
+
+        self.failure_message = None
+
+    def run(self, n_iters: int, snapshot_every=None, record_constraints=False, profiler=None):
+        """ Simulate n_iters payments.
+
+        Stops early if there is no cascade left to play.
+
+        :param n_iters: number of payments
+        :param snapshot_every: take a Snapshot for visualisation every snapshot_every iterations
+        :param record_constraints: keep constraints after each payment in the trace, n_iters x n_arms values,
+            needed by analytic.CascadeEvaluator.expected_regret to know arms available at each iteration
+        :param profiler: instrumentation.CProfiler or SamplingProfiler running during the simulation
+        :return: SimulationTrace
+        """
+        if profiler is None:
+            return self._run(n_iters, snapshot_every, record_constraints)
+
+        profiler.start()
+        try:
+            return self._run(n_iters, snapshot_every, record_constraints)
+        finally:
+            profiler.stop()
+
+    def _run(self, n_iters: int, snapshot_every, record_constraints):
+        env = self.env
+        trace = SimulationTrace(n_iters, env.n_arms, record_constraints)
+
+        for i in range(n_iters):
+            if env.failure is True:
+                failure_message = self.bandit.simulate_failure()
+                if failure_message is not None:
+                    self.failure_message = failure_message
+
+            if snapshot_every is not None and i % snapshot_every == 0:
+                trace.snapshots.append(Snapshot(self.bandit, i, self.failure_message))
+
+            n_repeated_payments = env.n_repeated_payments
+            n_repeated_success = env.n_repeated_success
+
+            cascade, reward = self.bandit.action()
+
+            trace.record(i, env.cascades.configs[cascade] if cascade is not None else None, reward,
+                         env.n_repeated_payments - n_repeated_payments,
+                         env.n_repeated_success - n_repeated_success,
+                         env.constraints)
+
+            if cascade is None and len(env.temp_constraints) == 0:
+                # No capacity left and no bank is going to return
+                break
+
+        trace.truncate()
+
+        if env.instruments is not None:
+            env.instruments.flush()
+
+        return trace
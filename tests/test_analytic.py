@@ -0,0 +1,65 @@
+from itertools import permutations
+
+import numpy as np
+import pytest
+
+import environment
+from analytic import CascadeEvaluator, cascade_value
+from bandit import Bandit, Strategy
+from simulation import Simulation
+
+
+def make_env(n_arms, seed, constraints=None):
+    rng = np.random.default_rng(seed)
+    if constraints is None:
+        constraints = [10] * n_arms
+    return environment.TestEnvironment(rng.uniform(.1, .9, n_arms).tolist(), rng.uniform(.1, .9, n_arms).tolist(),
+                                       constraints, rng=seed)
+
+
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('repeated_weight', [0., 2.])
+def test_oracle_finds_best_of_all_cascades(seed, repeated_weight):
+    env = make_env(7, seed)
+    # equal probabilities make ties
+    env.arms_proba['primary'][seed] = env.arms_proba['primary'][0]
+    depth = 1 + seed % 4
+
+    config, value = CascadeEvaluator(env, repeated_weight).oracle(depth)
+
+    _, _, values = cascade_value(env.arms_proba, list(permutations(range(7), depth)), repeated_weight)
+    assert len(config) == depth
+    assert value == pytest.approx(values.max(), abs=1e-12)
+    assert value == cascade_value(env.arms_proba, [config], repeated_weight)[2][0]
+
+
+def test_oracle_searches_deep_cascades_over_many_arms():
+    env = make_env(60, 0)
+    available = env.constraints > 0
+    available[::7] = False
+
+    evaluator = CascadeEvaluator(env)
+    config, value = evaluator.oracle(5, available)
+
+    assert len(set(config)) == 5 and available[list(config)].all()
+    rng = np.random.default_rng(0)
+    random_configs = [rng.permutation(np.flatnonzero(available))[:5] for _ in range(1000)]
+    assert value >= cascade_value(env.arms_proba, random_configs)[2].max()
+    assert evaluator.oracle(5, np.zeros(60, dtype=bool)) == (None, 0.)
+
+
+def test_expected_regret_evaluates_played_configs_once():
+    env = make_env(6, 1, [40, 30, 20, 10, 5, 5])
+    trace = Simulation(Bandit(Strategy(env, cascade_params=['primary', 'primary']))).run(300,
+                                                                                         record_constraints=True)
+    evaluator = CascadeEvaluator(env)
+    regret = evaluator.expected_regret(trace, depth=2)
+
+    played = trace.cascade >= 0
+    assert regret.shape == (trace.n_iters,) and (regret >= -1e-12).all()
+    assert set(trace.configs) <= set(evaluator._values)
+
+    iteration = int(np.flatnonzero(played)[-1])
+    available = trace.constraints[iteration - 1] > 0
+    best = evaluator.oracle(2, available)[1]
+    assert regret[iteration] == best - evaluator.evaluate(trace.configs[trace.cascade[iteration]])[2]
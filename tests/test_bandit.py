@@ -0,0 +1,74 @@
+import numpy as np
+
+import environment
+from bandit import Bandit, Strategy
+
+
+def make_env(constraints):
+    n_arms = len(constraints)
+    return environment.TestEnvironment([0.9] * n_arms, [0.5] * n_arms, constraints, rng=3)
+
+
+def test_batch_routing_falls_back_to_configs_with_capacity():
+    env = make_env([3, 2, 1, 2, 1])
+    strategy = Strategy(env, cascade_params=['primary', 'primary'])
+    for _ in range(20):
+        config_id = strategy.choose_cascade()
+        env.update_cascade_reward(config_id, 0)
+
+    config_ids = strategy.choose_cascades(50)
+    routed = config_ids[config_ids >= 0]
+    assert len(routed) > 3
+
+    # payments in order reserve the first arm of their cascades
+    first_arms = env.cascades.arms[routed, 0]
+    assert (np.bincount(first_arms, minlength=env.n_arms) <= env.constraints).all()
+
+
+def test_action_batch_returns_every_payment():
+    env = make_env([3, 2, 1, 2, 1])
+    bandit = Bandit(Strategy(env, cascade_params=['primary', 'primary']))
+    config_ids, rewards = bandit.action_batch(50)
+
+    assert len(config_ids) == len(rewards) == 50
+    assert (rewards[config_ids < 0] == 0).all()
+    assert (env.constraints >= 0).all()
+
+
+def route_over_whole_registry(strategy, n, top=5):
+    """ Fallback of choose_cascades as if every config were ranked up front. """
+    env = strategy.env
+    ranked = env.get_cascade_mean()
+    arms, demand, required = strategy._demand(ranked)
+    alphas, betas = env.cascades.posterior(ranked)
+    budget = np.maximum(env.constraints, 0).astype(float)
+    config_ids = np.full(n, -1, dtype=np.int64)
+    for i in range(n):
+        fits = [position for position in range(len(ranked))
+                if (budget[arms[position, required[position]]] >= 1).all()][:top]
+        if len(fits) == 0:
+            break
+        best = fits[np.argmax(strategy.rng.beta(alphas[fits], betas[fits]))]
+        config_ids[i] = ranked[best]
+        taken = arms[best] >= 0
+        budget[arms[best, taken]] -= demand[best, taken]
+    return config_ids
+
+
+def test_batch_routing_takes_lower_ranked_configs_as_ranking_all_would():
+    def make_strategy():
+        env = make_env([2] * 12)
+        rng = np.random.default_rng(0)
+        arms = np.stack([rng.permutation(env.n_arms)[:2] for _ in range(300)])
+        env.cascades.load(arms, 1 + rng.integers(0, 20, len(arms)), 1 + rng.integers(0, 20, len(arms)))
+        return Strategy(env, cascade_params=['primary', 'primary'], rng=7)
+
+    strategy = make_strategy()
+    strategy.cascade_builder_batch = lambda n: np.full((n, 2), -1, dtype=np.int64)
+    # the batch is larger than capacity of TOP cascades and takes capacity of every arm
+    config_ids = strategy.choose_cascades(30)
+
+    reference = make_strategy()
+    reference.rng.beta(*reference.env.cascades.posterior(reference.env.get_cascade_mean(5)), size=(30, 5))
+    assert config_ids.tolist() == route_over_whole_registry(reference, 30).tolist()
+    assert (config_ids >= 0).sum() > 5
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from batch import BatchEnvironment, BatchSimulation, BatchStrategy
+from experiment import Experiment, make_grid
+
+PRIMARY = [0.2, 0.72, 0.83, 0.7, 0.75]
+REPEATED = [0.8, 0.7, 0.7, 0.4, 0.71]
+CONSTRAINTS = [1000, 100, 75, 120, 50]
+
+
+def make_simulation(n_replicas, cascade_params, seed=0, constraints=CONSTRAINTS):
+    env = BatchEnvironment(n_replicas, PRIMARY, REPEATED, constraints, depth=len(cascade_params), rng=seed)
+    return BatchSimulation(BatchStrategy(env, cascade_params=cascade_params))
+
+
+def test_replicas_keep_counters_consistent():
+    simulation = make_simulation(64, ['repeated', 'primary'])
+    simulation.run(200)
+    env = simulation.env
+
+    assert (env.n_payments == env.n_cascade_payments + env.n_repeated_payments).all()
+    assert (env.n_success == env.n_cascade_success + env.n_repeated_success).all()
+    assert (env.n_primary_payments == env.n_cascade_payments).all()
+
+    # every cascade payment is a primary payment through the first arm of its config
+    cascade_payments = env.cascade_alphas + env.cascade_betas - 2
+    first_arm_payments = np.stack([np.bincount(env.config_arms[:, 0], weights=row, minlength=env.n_arms)
+                                   for row in cascade_payments])
+    assert np.array_equal(env.primary_alphas + env.primary_betas - 2, first_arm_payments)
+    assert (env.cascade_alphas[~env.seen] == 1).all()
+
+
+def test_replicas_are_reproducible_and_independent():
+    first = make_simulation(16, ['primary', 'primary'], seed=3)
+    second = make_simulation(16, ['primary', 'primary'], seed=3)
+    assert np.array_equal(first.run(100), second.run(100))
+    assert np.array_equal(first.env.n_success, second.env.n_success)
+    assert len(np.unique(first.env.n_success)) > 1
+
+
+def test_exhausted_replicas_stop_paying():
+    simulation = make_simulation(8, ['primary'], constraints=[3, 2, 0, 1, 2])
+    simulation.run(500)
+    env = simulation.env
+
+    assert (env.n_primary_success <= 8).all()
+    assert (env.constraints[:, :1] + env.n_primary_success[:, None] >= 0).all()
+    exhausted = env.constraints <= 0
+    assert np.array_equal(simulation.exhaustion_iter >= 0, exhausted)
+
+
+def test_vectorized_experiment_agrees_with_replications():
+    base = {'primary_arms_proba': PRIMARY, 'repeated_arms_proba': REPEATED, 'constraints': CONSTRAINTS,
+            'cascade_params': ['repeated', 'primary']}
+    grid = make_grid(base)
+
+    vectorized = Experiment(grid, 200, 200, seed=1).run(vectorized=True)[0]
+    replications = Experiment(grid, 40, 200, seed=1).run(n_workers=1)[0]
+
+    assert len(vectorized['runs']) == 200
+    difference = abs(vectorized['conversion']['mean'] - replications['conversion']['mean'])
+    assert difference < 3 * (vectorized['conversion']['ci95'] + replications['conversion']['ci95'])
+
+
+def test_vectorized_experiment_rejects_failures():
+    base = {'primary_arms_proba': PRIMARY, 'repeated_arms_proba': REPEATED, 'constraints': CONSTRAINTS,
+            'cascade_params': ['primary'], 'failure': True}
+    with pytest.raises(ValueError):
+        Experiment(make_grid(base), 2, 10).run(vectorized=True)
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+from cascades import CascadeRegistry
+
+
+def check_consistency(registry: CascadeRegistry):
+    """ Ids, inverted index, TOP and most paid configs agree with the arrays of the registry.
+    """
+    n_configs = registry.n_configs
+    live = [config_id for config_id in range(n_configs) if len(registry.configs[config_id]) > 0]
+
+    assert registry.ids == {registry.configs[config_id]: config_id for config_id in live}
+    assert sorted(registry.free) == [config_id for config_id in range(n_configs) if config_id not in live]
+    for config_id in live:
+        config = registry.configs[config_id]
+        assert registry.arms[config_id, :len(config)].tolist() == list(config)
+        assert (registry.arms[config_id, len(config):] == -1).all()
+
+    by_arm = {}
+    for config_id in live:
+        for arm in registry.configs[config_id]:
+            by_arm.setdefault(arm, set()).add(config_id)
+    assert {arm: ids for arm, ids in registry.by_arm.items() if ids} == by_arm
+
+    for config_id in live:
+        blocked = sum(arm in registry.exhausted for arm in registry.configs[config_id])
+        assert registry.active[config_id] == (blocked == 0)
+
+    active = [config_id for config_id in live if registry.active[config_id]]
+    means = registry.discounted_means(np.arange(n_configs))
+    expected_top = sorted(active, key=lambda config_id: (-means[config_id], config_id))[:5]
+    assert registry.top(5) == expected_top
+
+    paid = registry._paid
+    expected_most_paid = sorted(live, key=lambda config_id: (-paid[config_id], config_id))[:registry.n_most_paid]
+    assert sorted(paid[registry.most_paid].tolist()) == sorted(paid[expected_most_paid].tolist())
+
+    if registry.max_configs is not None:
+        assert len(live) <= registry.max_configs
+        assert len(registry.evicted) <= registry.max_configs
+
+
+@pytest.mark.parametrize('gamma', [None, 0.95])
+def test_eviction_keeps_registry_consistent(gamma):
+    rng = np.random.default_rng(1)
+    registry = CascadeRegistry(depth=3, max_configs=24, gamma=gamma)
+    n_arms = 8
+
+    for i in range(3000):
+        config = tuple(rng.permutation(n_arms)[:rng.integers(1, 4)].tolist())
+        config_id = registry.intern(config)
+        assert registry.configs[config_id] == config
+        assert config not in registry.evicted
+        for _, evicted_config in registry.last_evicted:
+            assert evicted_config not in registry.ids
+
+        registry.update(config_id, int(rng.random() < 0.3 + 0.05 * config[0]))
+        if i % 7 == 0:
+            registry.update_many(rng.choice(registry.top(5) or [config_id], 3), rng.integers(0, 2, 3))
+        if i % 50 == 0:
+            arm = int(rng.integers(n_arms))
+            if arm in registry.exhausted:
+                registry.unblock_arm(arm)
+            else:
+                registry.block_arm(arm)
+        if i % 100 == 0:
+            check_consistency(registry)
+
+    check_consistency(registry)
+    assert registry.n_admitted > registry.max_configs
+
+
+def test_evicted_config_comes_back_with_its_statistics():
+    registry = CascadeRegistry(max_configs=15, protect_top=2, n_most_paid=2, evict_fraction=0.25)
+    first = registry.intern((0,))
+    for _ in range(3):
+        registry.update(first, 0)
+
+    # later configs are paid more, so the first one is neither TOP nor most paid
+    for arm in range(1, 100):
+        config_id = registry.intern((arm,))
+        for _ in range(4):
+            registry.update(config_id, arm % 2)
+        if (0,) not in registry.ids:
+            break
+
+    assert registry.evicted[(0,)] == (1., 4.)
+    config_id = registry.intern((0,))
+    assert (registry.alphas[config_id], registry.betas[config_id]) == (1., 4.)
+    assert (0,) not in registry.evicted
+    check_consistency(registry)
+
+
+def test_load_matches_interned_registry():
+    rng = np.random.default_rng(2)
+    registry = CascadeRegistry(depth=2, max_configs=20)
+    for _ in range(500):
+        config_id = registry.intern(tuple(rng.permutation(6)[:rng.integers(1, 3)].tolist()))
+        registry.update(config_id, int(rng.integers(2)))
+    registry.block_arm(3)
+
+    loaded = CascadeRegistry(max_configs=20)
+    loaded.block_arm(3)
+    loaded.load(registry.arms, registry.alphas, registry.betas, last_used=registry._last_used[:registry.n_configs],
+                paid=registry._paid[:registry.n_configs])
+    loaded.free = list(registry.free)
+
+    assert loaded.configs == registry.configs
+    assert loaded.ids == registry.ids
+    assert loaded.top(5) == registry.top(5)
+    check_consistency(loaded)
+
+    loaded.unblock_arm(3)
+    registry.unblock_arm(3)
+    assert loaded.top(5) == registry.top(5)
+    check_consistency(loaded)
+
+
+def test_config_not_paid_for_long_leaves_top_when_evidence_is_discounted():
+    registry = CascadeRegistry(gamma=0.9)
+    stale = registry.intern((0,))
+    for _ in range(20):
+        registry.update(stale, 1)
+    fresh = registry.intern((1,))
+    for _ in range(40):
+        registry.update(fresh, int(registry.clock % 4 != 0))
+
+    # the stored mean of the stale config is still the highest one
+    assert registry.means[stale] > registry.means[fresh]
+    assert registry.discounted_means(np.array([stale]))[0] < registry.discounted_means(np.array([fresh]))[0]
+    assert registry.top(1) == [fresh]
+
+
+def test_max_configs_must_leave_room_besides_protected_configs():
+    with pytest.raises(ValueError):
+        CascadeRegistry(max_configs=5)
+    with pytest.raises(ValueError):
+        CascadeRegistry(max_configs=14, protect_top=5, n_most_paid=9)
+    CascadeRegistry(max_configs=15, protect_top=5, n_most_paid=9)
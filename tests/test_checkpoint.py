@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+import environment
+from bandit import Bandit, Strategy
+from checkpoint import Checkpointer, load_checkpoint, save_checkpoint
+from forgetting import DiscountedBeta, SlidingWindowBeta
+
+N_ARMS = 12
+
+
+def make_env(max_configs, cascade_gamma=None):
+    rng = np.random.default_rng(0)
+    return environment.TestEnvironment(rng.uniform(.1, .9, N_ARMS).tolist(), rng.uniform(.1, .9, N_ARMS).tolist(),
+                                       [400] * N_ARMS, rng=5, max_configs=max_configs, cascade_gamma=cascade_gamma)
+
+
+def make_bandit(env, forgetting):
+    step_posteriors = [DiscountedBeta(N_ARMS, 0.98), SlidingWindowBeta(N_ARMS, 50), None] if forgetting else None
+    return Bandit(Strategy(env, cascade_params=['repeated', 'primary', 'primary'], step_posteriors=step_posteriors))
+
+
+def run(bandit, n_iters):
+    configs = bandit.strategy.env.cascades.configs
+    decisions = []
+    for _ in range(n_iters):
+        config_id, reward = bandit.action()
+        decisions.append((configs[config_id] if config_id is not None else None, reward))
+    return decisions
+
+
+@pytest.mark.parametrize('max_configs', [None, 20])
+@pytest.mark.parametrize('forgetting', [False, True])
+def test_restored_run_continues_as_saved_one(tmp_path, max_configs, forgetting):
+    cascade_gamma = 0.98 if forgetting else None
+    reference_env = make_env(max_configs, cascade_gamma)
+    reference = run(make_bandit(reference_env, forgetting), 2000)
+
+    env = make_env(max_configs, cascade_gamma)
+    first = run(make_bandit(env, forgetting), 800)
+    save_checkpoint(env, tmp_path / 'state.npz')
+
+    restored_env = load_checkpoint(tmp_path / 'state.npz')
+    assert restored_env.max_configs == max_configs
+    assert restored_env.cascade_gamma == cascade_gamma
+    assert list(restored_env.cascades.evicted.items()) == list(env.cascades.evicted.items())
+    rest = run(make_bandit(restored_env, forgetting), 1200)
+
+    assert first + rest == reference
+    assert np.array_equal(restored_env.counts, reference_env.counts)
+    restored, expected = restored_env.cascades, reference_env.cascades
+    assert restored.configs == expected.configs
+    assert restored.free == expected.free
+    assert restored.most_paid == expected.most_paid
+    assert np.allclose(restored.alphas, expected.alphas) and np.allclose(restored.betas, expected.betas)
+
+
+def test_saved_posterior_must_match_added_one(tmp_path):
+    env = make_env(None)
+    run(make_bandit(env, True), 10)
+    save_checkpoint(env, tmp_path / 'state.npz')
+
+    restored_env = load_checkpoint(tmp_path / 'state.npz')
+    with pytest.raises(ValueError):
+        Strategy(restored_env, cascade_params=['repeated'], step_posteriors=[SlidingWindowBeta(N_ARMS, 50)])
+
+
+def test_checkpointer_saves_on_stop(tmp_path):
+    env = make_env(None)
+    run(make_bandit(env, False), 50)
+    checkpointer = Checkpointer(env, tmp_path / 'state.npz', interval=60.)
+
+    checkpointer.stop()
+    assert not (tmp_path / 'state.npz').exists()
+
+    checkpointer.start()
+    checkpointer.stop()
+    restored_env = load_checkpoint(tmp_path / 'state.npz')
+    assert np.array_equal(restored_env.counts, env.counts)
+    assert restored_env.cascades.configs == env.cascades.configs
+    assert restored_env.cascades.top(5) == env.cascades.top(5)
@@ -0,0 +1,93 @@
+import threading
+
+import numpy as np
+
+import environment
+from bandit import Strategy
+from benchmark import _payment_worker
+from concurrency import ConcurrentRoutingService
+from service import RoutingService
+
+PRIMARY = [0.2, 0.72, 0.83, 0.7, 0.75]
+REPEATED = [0.8, 0.7, 0.7, 0.4, 0.71]
+
+
+def make_strategy(constraints, seed=0):
+    env = environment.TestEnvironment(PRIMARY, REPEATED, constraints, rng=seed)
+    return Strategy(env, cascade_params=['repeated', 'primary'])
+
+
+def feed(service, n_requests, seed):
+    """ Decide and report the same scripted outcomes, success may come at any step.
+    """
+    rng = np.random.default_rng(seed)
+    for request_id in range(n_requests):
+        cascade = service.decide(request_id)
+        success_step = rng.integers(len(cascade) + 1)
+        for step in range(len(cascade)):
+            reward = int(step == success_step)
+            service.report(request_id, step, reward)
+            if reward:
+                # concurrent service needs capacity of a repeated payment reserved before it is made
+                if not isinstance(service, ConcurrentRoutingService) or service.reserve_repeated(cascade[step]):
+                    service.report_repeated(cascade[step], int(rng.integers(2)))
+                break
+
+
+def test_services_consume_the_same_capacity():
+    constraints = [500] * 5
+    plain = RoutingService(make_strategy(constraints))
+    # feedback committed at once, so both services see the same statistics and make the same decisions
+    concurrent = ConcurrentRoutingService(make_strategy(constraints), batch_size=1)
+
+    feed(plain, 200, seed=1)
+    feed(concurrent, 200, seed=1)
+    concurrent.commit()
+
+    assert len(concurrent.pending) == 0
+    assert np.array_equal(plain.env.constraints, concurrent.env.constraints)
+    assert np.array_equal(plain.env.counts, concurrent.env.counts)
+    assert (concurrent.env.constraints + concurrent.consumed == constraints).all()
+
+
+def test_success_at_later_step_returns_every_reservation():
+    service = ConcurrentRoutingService(make_strategy([10, 10, 10, 10, 10]))
+    cascade = service.decide('payment')
+    assert len(cascade) == 2
+    assert (service.env.constraints[list(cascade)] == 9).all()
+
+    service.report('payment', 0, 0)
+    service.report('payment', 1, 1)
+    service.commit()
+
+    assert (service.env.constraints == 10).all()
+    assert service.consumed.sum() == 0
+
+
+def test_batch_decisions_reserve_capacity():
+    service = ConcurrentRoutingService(make_strategy([3, 2, 1, 2, 1]))
+    cascades = service.decide_batch(list(range(20)))
+
+    reserved = np.zeros(5, dtype=np.int64)
+    for cascade in cascades:
+        if cascade is not None:
+            reserved[list(cascade)] += 1
+    assert (service.env.constraints >= 0).all()
+    assert np.array_equal(service.env.constraints + reserved, [3, 2, 1, 2, 1])
+
+
+def test_threads_never_oversell_capacity():
+    constraints = [100] * 5
+    service = ConcurrentRoutingService(make_strategy(constraints), batch_size=16)
+    workers = [threading.Thread(target=_payment_worker, args=(service, w, 500)) for w in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    service.commit()
+
+    env = service.env
+    assert len(service.pending) == 0
+    assert (env.constraints >= 0).all()
+    assert (env.constraints + service.consumed == constraints).all()
+    assert env.n_primary_success + env.n_repeated_success == service.consumed.sum()
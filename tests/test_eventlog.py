@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+import environment
+from bandit import Bandit, Strategy
+from eventlog import EventLog, Replay
+
+N_ARMS = 12
+
+
+def make_env(max_configs):
+    rng = np.random.default_rng(0)
+    return environment.TestEnvironment(rng.uniform(.1, .9, N_ARMS).tolist(), rng.uniform(.1, .9, N_ARMS).tolist(),
+                                       [300] * N_ARMS, rng=0, max_configs=max_configs)
+
+
+def registry_state(env):
+    cascades = env.cascades
+    return {'configs': list(cascades.configs),
+            'alphas': cascades.alphas.tolist(),
+            'betas': cascades.betas.tolist(),
+            'free': list(cascades.free),
+            'evicted': list(cascades.evicted.items()),
+            'top': cascades.top(5),
+            'most_paid': list(cascades.most_paid),
+            'clock': cascades.clock,
+            'last_used': cascades._last_used[:cascades.n_configs].tolist(),
+            'constraints': env.constraints.tolist(),
+            'counts': env.counts.tolist()}
+
+
+@pytest.mark.parametrize('max_configs', [None, 20])
+def test_replay_restores_logged_state(tmp_path, max_configs):
+    env = make_env(max_configs)
+    log = EventLog(tmp_path / 'events.bin', N_ARMS)
+    env.attach_event_log(log)
+    bandit = Bandit(Strategy(env, cascade_params=['repeated', 'primary', 'primary']))
+
+    states = {}
+    for i in range(3000):
+        if i % 500 == 0:
+            states[env.n_cascade_payments] = registry_state(env)
+        if bandit.action()[0] is None:
+            break
+    log.close()
+
+    if max_configs is not None:
+        assert env.cascades.n_admitted > max_configs
+
+    replay = Replay(tmp_path / 'events.bin')
+    for iteration, state in states.items():
+        restored = replay.restore(make_env(max_configs), iteration)
+        assert registry_state(restored) == state
+
+
+def test_replay_rejects_discounting_environment(tmp_path):
+    env = make_env(None)
+    log = EventLog(tmp_path / 'events.bin', N_ARMS)
+    env.attach_event_log(log)
+    Bandit(Strategy(env)).action()
+    log.close()
+
+    discounting = environment.TestEnvironment([0.5] * N_ARMS, [0.5] * N_ARMS, [300] * N_ARMS, cascade_gamma=0.99)
+    with pytest.raises(ValueError):
+        Replay(tmp_path / 'events.bin').restore(discounting, 1)
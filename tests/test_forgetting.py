@@ -0,0 +1,40 @@
+import numpy as np
+
+import environment
+from bandit import Strategy
+from forgetting import DiscountedBeta, SlidingWindowBeta
+
+
+def test_discounted_posterior_matches_direct_discounting():
+    rng = np.random.default_rng(0)
+    posterior = DiscountedBeta(3, gamma=0.5)
+    success, failure = np.zeros(3), np.zeros(3)
+    for _ in range(2000):
+        arm, reward = int(rng.integers(3)), int(rng.integers(2))
+        posterior.update(arm, reward)
+        success *= 0.5
+        failure *= 0.5
+        success[arm] += reward
+        failure[arm] += 1 - reward
+
+    assert np.allclose(posterior.alphas, 1 + success)
+    assert np.allclose(posterior.betas, 1 + failure)
+
+
+def test_sliding_window_keeps_last_payments():
+    posterior = SlidingWindowBeta(2, window=3)
+    for arm, reward in [(0, 1), (0, 1), (1, 0), (1, 1), (0, 0)]:
+        posterior.update(arm, reward)
+
+    assert posterior.alphas.tolist() == [1., 2.]
+    assert posterior.betas.tolist() == [2., 2.]
+
+
+def test_forgetting_steps_do_not_discount_cascades():
+    env = environment.TestEnvironment([0.5] * 3, [0.5] * 3, [10] * 3, rng=0)
+    posterior = DiscountedBeta(3, gamma=0.9)
+    strategy = Strategy(env, step_posteriors=[posterior])
+
+    assert env.cascade_gamma is None and env.cascades.gamma is None
+    env.play_cascade(env.update_cascade_config(strategy.cascade_builder()))
+    assert posterior.alphas.sum() + posterior.betas.sum() > 6
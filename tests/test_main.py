@@ -0,0 +1,15 @@
+import main
+
+
+def test_experiment_runs_given_cascade_params_only(capsys):
+    main.main(['experiment', '--iters', '30', '--replications', '2', '--workers', '1', '--seed', '0',
+               '--cascade-params', 'primary', 'repeated'])
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1 and lines[0].startswith('primary repeated ')
+
+
+def test_commands_use_default_cascade_params_if_not_given():
+    args = main.parse_args(['experiment'])
+    assert args.cascade_params is None
+    assert main.make_bandit(args).strategy.cascade_params == main.CASCADE_PARAMS
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+import environment
+from bandit import Bandit, Strategy
+from offpolicy import ThompsonPolicy, config_keys, create_log, evaluate, log_simulation, open_log
+
+PRIMARY = [0.2, 0.72, 0.83, 0.7, 0.75]
+REPEATED = [0.8, 0.7, 0.7, 0.4, 0.71]
+
+
+def make_bandit(seed=0):
+    env = environment.TestEnvironment(PRIMARY, REPEATED, [1000, 100, 75, 120, 50], rng=seed)
+    return Bandit(Strategy(env, cascade_params=['repeated', 'primary']))
+
+
+def test_policy_leaves_strategy_and_environment_untouched():
+    bandit = make_bandit()
+    for _ in range(30):
+        bandit.action()
+    env = bandit.env
+    n_configs, state = len(env.cascades), bandit.strategy.rng.bit_generator.state
+
+    policy = ThompsonPolicy(bandit.strategy, n_samples=5000, rng=1)
+
+    assert len(env.cascades) == n_configs
+    assert bandit.strategy.rng.bit_generator.state == state
+    assert (np.diff(policy.keys) > 0).all()
+    assert policy.probs.sum() == pytest.approx(1.)
+    assert policy.propensity(policy.keys).tolist() == policy.probs.tolist()
+    assert policy.propensity([10 ** 9]).tolist() == [0.]
+
+
+def test_policy_matches_decisions_of_strategy():
+    bandit = make_bandit()
+    for _ in range(30):
+        bandit.action()
+    policy = ThompsonPolicy(bandit.strategy, n_samples=20000, rng=1)
+
+    # decisions of the strategy register new configs, so every decision is made at a copy of the state
+    state = bandit.env.cascades.arms.copy(), bandit.env.cascades.alphas.copy(), bandit.env.cascades.betas.copy()
+    keys = []
+    for seed in range(2000):
+        env = environment.TestEnvironment(PRIMARY, REPEATED, list(bandit.env.constraints), rng=seed)
+        env.primary_alphas[:], env.primary_betas[:] = bandit.env.primary_alphas, bandit.env.primary_betas
+        env.repeated_alphas[:], env.repeated_betas[:] = bandit.env.repeated_alphas, bandit.env.repeated_betas
+        env.cascades.load(*state)
+        config_id = Strategy(env, cascade_params=['repeated', 'primary']).choose_cascade()
+        arms = np.full((1, 2), -1)
+        arms[0, :len(env.cascades.configs[config_id])] = env.cascades.configs[config_id]
+        keys.append(config_keys(arms, env.n_arms)[0])
+
+    chosen, counts = np.unique(keys, return_counts=True)
+    assert np.abs(counts / len(keys) - policy.propensity(chosen)).max() < 0.05
+
+
+def test_log_simulation_records_every_payment(tmp_path):
+    bandit = make_bandit()
+    log = log_simulation(tmp_path / 'log.npy', bandit, 40, context=3)
+
+    env = bandit.env
+    played = log['arms'][:, 0] >= 0
+    assert len(open_log(tmp_path / 'log.npy')) == 40
+    assert (log['context'] == 3).all()
+    assert log['reward'].sum() == env.n_cascade_success
+    assert ((log['propensity'] >= 1. / 2 ** 12) & (log['propensity'] <= 1.)).all()
+    assert (log['step_rewards'][played, 0] >= 0).all()
+    # a cascade succeeds at its last tried step only
+    tried = (log['step_rewards'] >= 0).sum(axis=1)
+    assert (log['step_rewards'][played, tried[played] - 1] == log['reward'][played]).all()
+
+
+def test_estimators_of_logging_policy_give_logged_conversion(tmp_path):
+    bandit = make_bandit()
+    for _ in range(30):
+        bandit.action()
+    policy = ThompsonPolicy(bandit.strategy, n_samples=5000, rng=1)
+
+    # log of the policy itself: every importance weight is 1
+    rng = np.random.default_rng(2)
+    keys = policy.sample(1000, rng)
+    assert (keys >= 0).all()
+    n_arms = bandit.env.n_arms
+    log = create_log(tmp_path / 'log.npy', len(keys), 2)
+    log['context'] = rng.integers(0, 3, len(keys))
+    log['arms'] = np.stack([(keys // (n_arms + 1) ** step) % (n_arms + 1) - 1 for step in range(2)], axis=1)
+    log['propensity'] = policy.propensity(keys)
+    log['reward'] = rng.random(len(keys)) < np.where(log['arms'][:, 0] == 2, 0.9, 0.5)
+    log['step_rewards'] = -1
+
+    result = evaluate(log, policy, chunk_size=300, rng=3, by_context=True)
+
+    conversion = log['reward'].mean()
+    assert result['n'] == 1000
+    assert result['ips'] == pytest.approx(conversion)
+    assert result['snips'] == pytest.approx(conversion)
+    # reward model is weighted by the policy, not by frequencies of the log
+    assert abs(result['dr'] - conversion) < 0.01
+    assert result['ess'] == pytest.approx(1000)
+    assert abs(result['replay'] - conversion) < 0.1
+
+    contexts = result['context']
+    assert contexts['values'].tolist() == [0, 1, 2]
+    assert contexts['n'].sum() == 1000
+    for value, ips in zip(contexts['values'], contexts['ips']):
+        assert ips == pytest.approx(log['reward'][log['context'] == value].mean())
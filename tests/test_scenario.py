@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import environment
+from bandit import Bandit, Strategy
+from scenario import (OUTAGE_CAPACITY, ScenarioDriver, bursts, linear_drift, merge, read_scenario,
+                      write_scenario)
+
+PRIMARY = [0.2, 0.72, 0.83, 0.7, 0.75]
+REPEATED = [0.8, 0.7, 0.7, 0.4, 0.71]
+
+
+def make_driver(scenario, constraints=(1000, 100, 75, 120, 50)):
+    env = environment.TestEnvironment(PRIMARY, REPEATED, list(constraints), rng=0)
+    return ScenarioDriver(Bandit(Strategy(env, cascade_params=['repeated', 'primary'])), scenario)
+
+
+def test_overlapping_bursts_are_rejected():
+    with pytest.raises(ValueError):
+        bursts(every=10, duration=11, rate=5)
+
+
+def test_bursts_keep_events_in_order():
+    events = list(bursts(every=10, duration=10, rate=5, stop=30))
+    assert [event['at'] for event in events] == sorted(event['at'] for event in events)
+
+    driver = make_driver(bursts(every=10, duration=4, rate=3, stop=30))
+    summary = list(driver.run(30, window=10))
+    # every window of 10 iterations has 4 iterations of 3 payments and 6 of one payment
+    assert [window['n_payments'] for window in summary] == [18, 18, 18]
+
+
+def test_outage_takes_capacity_away_and_refill_adds_to_returned_one():
+    scenario = [{'at': 2, 'type': 'outage', 'arm': 1, 'duration': 5},
+                {'at': 4, 'type': 'refill', 'arm': 1, 'amount': 10}]
+    driver = make_driver(scenario, constraints=(1000, 100, 75, 120, 50))
+
+    list(driver.run(2))
+    capacity = driver.env.constraints[1]
+    list(driver.run(5))
+    assert driver.env.constraints[1] == OUTAGE_CAPACITY
+
+    # the bank returns at iteration 7 with capacity it had before the outage and the refill
+    assert driver.iteration == 7
+    driver.step()
+    assert driver.env.constraints[1] == capacity + 10
+    assert len(driver._restores) == 0
+
+
+def test_scenario_files_and_merge(tmp_path):
+    drift = list(linear_drift(0, 0, 100, 0.2, 0.8, every=25))
+    assert drift[-1] == {'at': 100, 'type': 'proba', 'arm': 0, 'primary': 0.8}
+
+    write_scenario(merge(drift, bursts(every=30, duration=5, rate=2, stop=100)), tmp_path / 'scenario.jsonl')
+    events = list(read_scenario(tmp_path / 'scenario.jsonl'))
+    assert [event['at'] for event in events] == sorted(event['at'] for event in events)
+
+    driver = make_driver(events)
+    list(driver.run(101))
+    assert np.isclose(driver.env.arms_proba['primary'][0], 0.8)
+    assert PRIMARY[0] == 0.2
@@ -0,0 +1,88 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import environment
+from bandit import Strategy
+from service import AsyncRoutingService, FakeGateway, RoutingService, run_fake_traffic
+
+PRIMARY = [0.2, 0.72, 0.83, 0.7, 0.75]
+REPEATED = [0.8, 0.7, 0.7, 0.4, 0.71]
+
+
+def make_service(constraints=(1000, 100, 75, 120, 50), seed=0):
+    env = environment.TestEnvironment(PRIMARY, REPEATED, list(constraints), rng=seed)
+    return RoutingService(Strategy(env, cascade_params=['repeated', 'primary']))
+
+
+def test_fake_traffic_applies_all_feedback():
+    service = make_service()
+    front = AsyncRoutingService(service)
+    gateway = FakeGateway(PRIMARY, REPEATED, delay=0., rng=1)
+
+    latencies = asyncio.run(run_fake_traffic(front, gateway, 300, rate=1e5))
+
+    env = service.env
+    assert len(latencies) == 300
+    assert len(service.pending) == 0
+    assert env.n_cascade_payments == 300
+    assert env.n_primary_payments == 300
+    assert env.n_payments == env.n_cascade_payments + env.n_repeated_payments
+    assert np.array_equal(env.constraints + env.primary_alphas - 1 + env.repeated_alphas - 1,
+                          [1000, 100, 75, 120, 50])
+
+
+def test_failed_feedback_is_raised_by_stop_and_others_are_applied():
+    service = make_service()
+    front = AsyncRoutingService(service)
+
+    async def run():
+        await front.start()
+        cascade = await front.decide('known')
+        front.report('unknown', 0, 1)
+        front.report('known', len(cascade) - 1, 0)
+        await front.stop()
+
+    with pytest.raises(KeyError):
+        asyncio.run(run())
+    assert len(service.pending) == 0
+    assert service.env.n_cascade_payments == 1
+
+
+def test_batch_feedback_matches_one_by_one():
+    one_by_one, batched = make_service(seed=3), make_service(seed=3)
+    results = [(request_id, 0, request_id % 2) for request_id in range(40)]
+
+    for service in (one_by_one, batched):
+        for request_id, _, _ in results:
+            service.decide(request_id)
+    assert one_by_one.pending == batched.pending
+
+    for request_id, step, reward in results:
+        one_by_one.report(request_id, step, reward)
+    finished = batched.report_batch(*zip(*results))
+
+    assert finished == [reward == 1 for _, _, reward in results]
+    assert sorted(one_by_one.pending) == sorted(batched.pending)
+    assert np.array_equal(one_by_one.env.primary_alphas, batched.env.primary_alphas)
+    assert np.array_equal(one_by_one.env.constraints, batched.env.constraints)
+    assert one_by_one.env.n_cascade_success == batched.env.n_cascade_success == 20
+
+
+def test_bool_feedback_is_applied_as_int():
+    as_int, as_bool = make_service(seed=4), make_service(seed=4)
+    for service, success, failure in ((as_int, 1, 0), (as_bool, True, False)):
+        for request_id in range(6):
+            cascade = service.decide(request_id)
+            if request_id % 2 == 0:
+                service.report(request_id, 0, success)
+                service.report_repeated(cascade[0], success)
+            else:
+                service.report(request_id, len(cascade) - 1, failure)
+            service.report_repeated(cascade[0], failure)
+
+    for name in ('primary_alphas', 'primary_betas', 'repeated_alphas', 'repeated_betas', 'constraints', 'counts'):
+        assert np.array_equal(getattr(as_int.env, name), getattr(as_bool.env, name))
+    assert np.array_equal(as_int.env.cascades.alphas, as_bool.env.cascades.alphas)
+    assert as_bool.env.n_cascade_success == 3
@@ -0,0 +1,28 @@
+import environment
+from bandit import Bandit, Strategy
+from simulation import Simulation
+
+
+def make_bandit():
+    env = environment.TestEnvironment([0.2, 0.7, 0.8], [0.6, 0.7, 0.4], [30, 20, 10], rng=0)
+    return Bandit(Strategy(env, cascade_params=['repeated', 'primary']))
+
+
+def test_trace_keeps_constraints_only_on_request():
+    trace = Simulation(make_bandit()).run(50)
+    assert trace.constraints is None
+
+    bandit = make_bandit()
+    trace = Simulation(bandit).run(50, record_constraints=True)
+    assert trace.constraints.shape == (trace.n_iters, 3)
+    assert (trace.constraints[-1] == bandit.env.constraints).all()
+
+
+def test_trace_records_played_configs():
+    bandit = make_bandit()
+    trace = Simulation(bandit).run(200)
+
+    played = trace.cascade >= 0
+    assert trace.n_iters == len(trace.cascade)
+    assert trace.reward[played].sum() == bandit.env.n_cascade_success
+    assert set(trace.configs) <= set(bandit.env.cascades.configs)
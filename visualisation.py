@@ -3,28 +3,40 @@ Draw bandit behaviour at environment.
 """
 
 import numpy as np
-import scipy.stats as stats
 from matplotlib.cm import get_cmap
 
 from operator import itemgetter
 
 from bandit import Bandit
+from posterior import BetaCurves
+from simulation import Snapshot
 
 
 class DrawEnvironment():
 
-    def __init__(self, ax, bandit: Bandit):
+    def __init__(self, ax, bandit: Bandit = None, arms_proba=None, failure=False):
+        """
+        :param ax: 2 x 2 axes
+        :param bandit: bandit to step on every frame, not needed to draw snapshots
+        :param arms_proba: environment arms probabilities if bandit is not given
+        :param failure: environment failure flag if bandit is not given
+        """
 
         self.bandit = bandit
+        if bandit is not None:
+            arms_proba = bandit.env.arms_proba
+            failure = bandit.env.failure
 
-        if self.bandit.env.failure is True:
+        self.failure = failure
+        if self.failure is True:
             self.failure_message_text = ''
 
-        self.prob = bandit.env.arms_proba
-        self.n_arms = bandit.env.n_arms
+        self.prob = arms_proba
+        self.n_arms = len(arms_proba['primary'])
 
         self.x = np.linspace(0, 1, 500)
         self.y_max = 5
+        self.curves = BetaCurves(self.x)
 
         self.cm = get_cmap('tab10')
 
@@ -94,121 +106,110 @@ class DrawEnvironment():
         """Cascade full list"""
         self.ax4 = ax[1, 1]
 
-        self.table_text = [[None, None, None, None, None]]
+        self.table_text = [[''] * 5 for _ in range(9)]
 
         # Set up plot parameters
         self.ax4.title.set_text('Cascade config table')
         self.ax4.axis('off')
-        self.table4 = self.ax4.table(cellText = self.table_text,
-            colLabels=['Cascade\nConfig',
-                       'Estimated\nConversion\n(Mean)',
-                       'Alpha',
-                       'Beta',
-                       'Payment\nNumber'],
-            bbox=[0, 0, 1, 1])
 
-    def set_dist_params(self):
+        # Cells are created once and their text is changed in place on every frame
+        self.table4 = self.ax4.table(cellText=self.table_text,
+                                     colLabels=['Cascade\nConfig',
+                                                'Estimated\nConversion',
+                                                'Alpha',
+                                                'Beta',
+                                                'Payment\nNumber'],
+                                     bbox=[0, 0, 1, 1])
+        self.table_cells = [[self.table4[row + 1, col].get_text() for col in range(5)]
+                            for row in range(len(self.table_text))]
 
-        self.primary_alphas = self.bandit.env.primary_alphas
-        self.primary_betas = self.bandit.env.primary_betas
+    def __call__(self, i):
+        if self.failure is True:
+            # Bank failure simulation
+            failure_message = self.bandit.simulate_failure()
+            if failure_message is not None:
+                self.failure_message_text = failure_message
 
-        self.repeated_alphas = self.bandit.env.repeated_alphas
-        self.repeated_betas = self.bandit.env.repeated_betas
+        artists = self.draw(Snapshot(self.bandit, i))
 
-        self.cascade_alphas = self.bandit.env.cascade_alphas
-        self.cascade_betas = self.bandit.env.cascade_betas
+        self.bandit.action()
 
-        return self.primary_alphas, self.primary_betas, self.repeated_alphas, \
-               self.repeated_betas, self.cascade_alphas, self.cascade_betas
+        return artists
 
-    def __call__(self, i):
-        print(i)
-        alpha_beta = self.set_dist_params()
+    def draw(self, snapshot: Snapshot):
+        """ Draw one frame from bandit state snapshot.
 
-        if self.bandit.env.failure is True:
-            # Bank failure simulation
-            failure_message = self.bandit.env.delete_bank()
-            if failure_message is None:
-                failure_message = self.bandit.env.add_bank()
+        Also used as animation function for snapshots collected by headless Simulation.
 
-        if self.bandit.env.n_primary_payments > 0:
-            conv = round(self.bandit.env.n_primary_success / float(self.bandit.env.n_primary_payments) * 100, 2)
+        :param snapshot:
+        :return: changed artists
+        """
+        if snapshot.failure_message is not None:
+            self.failure_message_text = snapshot.failure_message
+
+        if snapshot.n_primary_payments > 0:
+            conv = round(snapshot.n_primary_success / float(snapshot.n_primary_payments) * 100, 2)
         else:
             conv = 0
 
-        text1 = 'payments = ' + str(self.bandit.env.n_primary_payments) + \
-                '\nsuccess = ' + str(self.bandit.env.n_primary_success) + \
+        text1 = 'payments = ' + str(snapshot.n_primary_payments) + \
+                '\nsuccess = ' + str(snapshot.n_primary_success) + \
                 '\nconversion = ' + str(conv) + '%'
 
-        if self.bandit.env.n_repeated_payments > 0:
-            conv = round(self.bandit.env.n_repeated_success / float(self.bandit.env.n_repeated_payments) * 100, 2)
+        if snapshot.n_repeated_payments > 0:
+            conv = round(snapshot.n_repeated_success / float(snapshot.n_repeated_payments) * 100, 2)
         else:
             conv = 0
 
-        text2 = 'payments = ' + str(self.bandit.env.n_repeated_payments) + \
-                '\nsuccess = ' + str(self.bandit.env.n_repeated_success) + \
+        text2 = 'payments = ' + str(snapshot.n_repeated_payments) + \
+                '\nsuccess = ' + str(snapshot.n_repeated_success) + \
                 '\nconversion = ' + str(conv) + '%'
 
-        if self.bandit.env.n_payments > 0:
-            conv = round(self.bandit.env.n_success / float(self.bandit.env.n_payments) * 100, 2)
+        if snapshot.n_payments > 0:
+            conv = round(snapshot.n_success / float(snapshot.n_payments) * 100, 2)
         else:
             conv = 0
 
-        if self.bandit.env.n_cascade_payments > 0:
-            conv_cascade = round(self.bandit.env.n_cascade_success / float(self.bandit.env.n_cascade_payments) * 100, 2)
+        if snapshot.n_cascade_payments > 0:
+            conv_cascade = round(snapshot.n_cascade_success / float(snapshot.n_cascade_payments) * 100, 2)
         else:
             conv_cascade = 0
 
-        text3 = 'iter = ' + str(i) + \
-                '\npayments = ' + str(self.bandit.env.n_payments) + \
-                '\nsuccess = ' + str(self.bandit.env.n_success) + \
+        text3 = 'iter = ' + str(snapshot.iteration) + \
+                '\npayments = ' + str(snapshot.n_payments) + \
+                '\nsuccess = ' + str(snapshot.n_success) + \
                 '\nconversion = ' + str(conv) + '%' + \
-                '\n\ncascade_payments = ' + str(self.bandit.env.n_cascade_payments) + \
-                '\ncascade_success = ' + str(self.bandit.env.n_cascade_success) + \
+                '\n\ncascade_payments = ' + str(snapshot.n_cascade_payments) + \
+                '\ncascade_success = ' + str(snapshot.n_cascade_success) + \
                 '\ncascade_conversion = ' + str(conv_cascade) + '%' + \
                 '\nconstraints:'
         for i in range(self.n_arms):
-            text3 += '\n bandit_' + str(i) + '= ' + str(self.bandit.env.constraints[i])
+            text3 += '\n bandit_' + str(i) + '= ' + str(snapshot.constraints[i])
 
-        text3 += '\n\ncascade_parameters: ' + str(self.bandit.strategy.cascade_params)
-        text3 += '\ncascade_configs: ' + str(self.bandit.env.get_cascade_mean()[:5])
+        text3 += '\n\ncascade_parameters: ' + str(snapshot.cascade_params)
+        text3 += '\ncascade_configs: ' + str(snapshot.top_cascades)
 
-        if self.bandit.env.failure is True:
-            if failure_message is not None:
-                self.failure_message_text = failure_message
+        if self.failure is True:
             text3 += '\n' + self.failure_message_text
 
-        self.table_text = [[c,
-                           str(round(self.bandit.env.cascade_mean[c] * 100, 1)) + '%',
-                           self.bandit.env.cascade_alphas[c],
-                           self.bandit.env.cascade_betas[c],
-                           self.bandit.env.cascade_alphas[c] + self.bandit.env.cascade_betas[c]]
-                           for c in self.bandit.env.historical_cascade_config]
-
-        if len(self.table_text) > 0:
-            self.table4 = self.ax4.table(cellText=sorted(self.table_text,key=lambda x: x[4], reverse = True)[:9],
-                                         colLabels=['Cascade\nConfig',
-                                                    'Estimated\nConversion',
-                                                    'Alpha',
-                                                    'Beta',
-                                                    'Payment\nNumber'],
-                                         bbox=[0, 0, 1, 1])
+        self.table_text = snapshot.table
+
+        for row, cells in enumerate(self.table_cells):
+            values = self.table_text[row] if row < len(self.table_text) else [''] * len(cells)
+            for cell, value in zip(cells, values):
+                cell.set_text(str(value))
 
         self.iter_text1.set_text(text1)
         self.iter_text2.set_text(text2)
         self.iter_text3.set_text(text3)
 
-        for lnum1, line1 in enumerate(self.line1):
-            y = stats.beta.pdf(self.x, alpha_beta[0][lnum1], alpha_beta[1][lnum1], 0, 1)
-            if y.max() > self.y_max:
-                self.y_max = y.max() + 5
-            line1.set_data(self.x, y)
-
-        for lnum2, line2 in enumerate(self.line2):
-            y = stats.beta.pdf(self.x, alpha_beta[2][lnum2], alpha_beta[3][lnum2], 0, 1)
-            if y.max() > self.y_max:
-                self.y_max = y.max() + 5
-            line2.set_data(self.x, y)
+        # both panels in one evaluation, unchanged posteriors are cached
+        curves, maximums = self.curves.pdf(np.concatenate([snapshot.primary_alphas, snapshot.repeated_alphas]),
+                                           np.concatenate([snapshot.primary_betas, snapshot.repeated_betas]))
+        for y, y_max, line in zip(curves, maximums, self.line1 + self.line2):
+            if y_max > self.y_max:
+                self.y_max = y_max + 5
+            line.set_data(self.x, y)
 
         self.ax1.set_ylim(0, self.y_max)
         self.ax1.set_xlim(0, 1)
@@ -216,7 +217,5 @@ class DrawEnvironment():
         self.ax2.set_ylim(0, self.y_max)
         self.ax2.set_xlim(0, 1)
 
-        self.bandit.action()
-
         return tuple(self.line1) + tuple(self.line2) + tuple([self.table4]) + \
                (self.iter_text1, self.iter_text2, self.iter_text3)